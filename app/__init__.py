@@ -1,8 +1,14 @@
 from quart import Quart
 from dotenv import load_dotenv
 from .redis_client import init_redis
-from .pubsub import listen_to_orders
-import asyncpg
+from .pubsub import listen_to_events
+from .order_events import consume_order_events, relay_order_outbox
+from .order_push import fan_out_order_events
+from .db_pool import create_observed_pool, create_service_pool
+from .metrics import init_metrics, COLLECTORS
+from .cache_utils import cache_metric_samples
+from .slow_queries import init_slow_query_log, close_slow_query_log
+from .sales_rollups import fold_sales_rollups
 import os
 import logging
 from datetime import timedelta
@@ -23,15 +29,10 @@ def create_app():
         Создание пула соединений с базой данных при запуске приложения.
         """
         try:
-            app.db_pool = await asyncpg.create_pool(
-                database=os.getenv("DB_NAME"),
-                user=os.getenv("DB_USER"),
-                password=os.getenv("DB_PASSWORD"),
-                host=os.getenv("DB_HOST"),
-                port=int(os.getenv("DB_PORT")),
-                min_size=1,
-                max_size=10,
-            )
+            app.db_pool = await create_observed_pool()
+            await app.db_pool.warm_up()
+            init_slow_query_log(await create_service_pool())
+            app.add_background_task(fold_sales_rollups, app.db_pool)
             logger.info("Пул соединений с базой данных успешно создан.")
         except Exception as e:
             logger.error(f"Ошибка при создании пула соединений: {e}")
@@ -40,7 +41,10 @@ def create_app():
         try:
             await init_redis()
             logger.info("Подключение к Redis установлено.")
-            app.add_background_task(listen_to_orders)
+            app.add_background_task(listen_to_events)
+            app.add_background_task(consume_order_events, app.db_pool)
+            app.add_background_task(relay_order_outbox, app.db_pool)
+            app.add_background_task(fan_out_order_events)
         except Exception as e:
             logger.error(f"Ошибка при подключении к Redis: {e}")
             raise e
@@ -51,6 +55,7 @@ def create_app():
         Закрытие пула соединений с базой данных.
         """
         try:
+            await close_slow_query_log()
             await app.db_pool.close()
             logger.info("Пул соединений с базой данных закрыт.")
         except Exception as e:
@@ -58,6 +63,15 @@ def create_app():
 
     from .routes import main as main_blueprint
     from .admin_routes import admin as admin_blueprint
+    from .utils import highlight, format_datetime
+
+    app.add_template_filter(highlight, "highlight")
+    app.add_template_filter(format_datetime, "format_datetime")
+
+    # Метрики: учёт запросов, /metrics, состояние пула БД и L1-кеша
+    init_metrics(app)
+    COLLECTORS.append(lambda: app.db_pool.metric_samples())
+    COLLECTORS.append(cache_metric_samples)
 
     app.register_blueprint(main_blueprint)
     app.register_blueprint(admin_blueprint)
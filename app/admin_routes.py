@@ -1,13 +1,21 @@
-from quart import Blueprint, render_template, request, redirect, url_for, flash, current_app, session, g
+from quart import Blueprint, render_template, request, redirect, url_for, flash, current_app, session, g, Response
 from app.db import *
-import os
 import datetime
+import decimal
+import uuid
 from app.utils import *
 from dotenv import load_dotenv
 import glob
 from datetime import datetime
-import subprocess
-from app.pubsub import publish_event
+from app.order_events import get_order_events_stats
+from app.cache_utils import invalidate_cache, invalidate_cache_keys, get_cache_stats
+from app.queries import get_query_stats
+from app.slow_queries import get_slow_queries, SLOW_QUERY_MS
+from app.pagination import decode_cursor, InvalidCursor
+from app.cache_codec import make_json_serializable
+from app.exports import build_export
+from app.product_import import import_products_csv, IMPORT_COLUMNS
+from app.backup_jobs import BACKUP_FORMATS, list_backups, get_backup_job, start_backup_job, run_backup, run_restore
 
 admin = Blueprint('admin', __name__, url_prefix='/admin')
 
@@ -19,7 +27,7 @@ async def admin_dashboard():
     """
     Главная страница админки.
     """
-    return await render_template('admin/dashboard.html')
+    return await render_template('admin/dashboard.html', job=await get_backup_job())
 
 @admin.route('/products', methods=['GET', 'POST'])
 @admin_required
@@ -39,6 +47,7 @@ async def manage_products():
             stock = int(form.get('stock'))
             manufacturer = form.get('manufacturer')
             await add_product(current_app.db_pool, name, description, price, stock, manufacturer, category_id)
+            await invalidate_cache("cache:manufacturers")
             await flash('Товар добавлен.', 'success')
         elif action == 'edit':
             # Редактирование существующего товара
@@ -50,69 +59,303 @@ async def manage_products():
             stock = int(form.get('stock'))
             manufacturer = form.get('manufacturer')
             await update_product(current_app.db_pool, product_id, name, description, price, stock, manufacturer, category_id)
+            await invalidate_cache(f"cache:product:{product_id}")
+            await invalidate_cache("cache:manufacturers")
             await flash('Товар обновлен.', 'success')
         elif action == 'delete':
             # Удаление товара
             product_id = form.get('product_id')
             await delete_product(current_app.db_pool, product_id)
+            await invalidate_cache(f"cache:product:{product_id}")
+            await invalidate_cache("cache:manufacturers")
             await flash('Товар удален.', 'success')
         return redirect(url_for('admin.manage_products'))
 
-    # GET-запрос: отображаем список товаров и категорий
-    products = await get_all_products_with_categories(current_app.db_pool)
+    # GET-запрос: страница сетки товаров, строки подгружаются через /admin/products/grid
     categories = await get_all_categories(current_app.db_pool)
-    return await render_template('admin/manage_products.html', products=products, categories=categories)
+    return await render_template(
+        'admin/manage_products.html',
+        categories=categories,
+        sorts=list(ADMIN_PRODUCT_SORTS),
+        page_size=ADMIN_PAGE_SIZE
+    )
+
+@admin.route('/products/grid', methods=['GET'])
+@admin_required
+async def products_grid():
+    """
+    Страница сетки товаров в формате JSON: сортировка (sort, dir), фильтры
+    (category, manufacturer, max_stock) и курсор следующей страницы.
+    """
+    args = request.args
+    after = decode_cursor(args.get('cursor', ''), 2)
+    if args.get('cursor') and after is None:
+        return {"error": "Неверный курсор."}, 400
+    try:
+        max_stock = args.get('max_stock', '').strip()
+        products, next_cursor = await get_admin_products_page(
+            current_app.db_pool,
+            sort=args.get('sort', 'name'),
+            descending=args.get('dir') == 'desc',
+            category_id=args.get('category', ''),
+            manufacturer=args.get('manufacturer', '').strip(),
+            max_stock=int(max_stock) if max_stock else None,
+            after=after,
+            limit=args.get('limit', ADMIN_PAGE_SIZE)
+        )
+    except InvalidCursor:
+        return {"error": "Неверный курсор."}, 400
+    except (ValueError, decimal.InvalidOperation) as e:
+        return {"error": f"Неверные параметры запроса: {e}"}, 400
+    return {"products": make_json_serializable(products), "next_cursor": next_cursor}
+
+@admin.route('/products/import', methods=['GET', 'POST'])
+@admin_required
+async def import_products():
+    """
+    Массовая загрузка и обновление товаров из CSV (цены и остатки поставщиков).
+    """
+    report = error = None
+    if request.method == 'POST':
+        files = await request.files
+        upload = files.get('file')
+        if upload is None or not upload.filename:
+            error = 'Выберите CSV-файл.'
+        else:
+            try:
+                report = await import_products_csv(current_app.db_pool, upload.stream)
+            except ValueError as e:
+                error = str(e)
+        if report:
+            await invalidate_cache_keys(f"cache:product:{product_id}" for product_id in report['updated_ids'])
+            if report['inserted'] or report['updated']:
+                await invalidate_cache("cache:manufacturers")
+            current_app.logger.info(
+                f"Импорт товаров: добавлено {report['inserted']}, обновлено {report['updated']}, "
+                f"ошибок {report['error_count']}"
+            )
+    return await render_template(
+        'admin/import_products.html',
+        columns=IMPORT_COLUMNS,
+        report=report,
+        error=error
+    )
+
+def parse_product_payload(data: dict) -> dict:
+    """
+    Проверяет поля товара из JSON. Бросает ValueError с понятным сообщением.
+    """
+    name = (data.get('name') or '').strip()
+    if not name:
+        raise ValueError("Название не может быть пустым.")
+    try:
+        price = decimal.Decimal(str(data.get('price')))
+        stock = int(data.get('stock'))
+    except (TypeError, ValueError, decimal.InvalidOperation):
+        raise ValueError("Цена и количество должны быть числами.")
+    if price < 0 or stock < 0:
+        raise ValueError("Цена и количество не могут быть отрицательными.")
+    category_id = data.get('category_id') or None
+    if category_id:
+        category_id = str(uuid.UUID(category_id))
+    return {
+        "name": name,
+        "description": data.get('description') or '',
+        "price": price,
+        "stock": stock,
+        "manufacturer": (data.get('manufacturer') or '').strip(),
+        "category_id": category_id,
+    }
+
+@admin.route('/products/<uuid:product_id>', methods=['PUT', 'DELETE'])
+@admin_required
+async def product_api(product_id):
+    """
+    Изменение (PUT, поля товара в JSON) и удаление товара без перезагрузки страницы.
+    """
+    if request.method == 'DELETE':
+        await delete_product(current_app.db_pool, product_id)
+    else:
+        try:
+            fields = parse_product_payload(await request.get_json(force=True) or {})
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        updated = await update_product(current_app.db_pool, product_id, **fields)
+        if not updated:
+            return {"error": "Товар не найден."}, 404
+    await invalidate_cache(f"cache:product:{product_id}")
+    await invalidate_cache("cache:manufacturers")
+    return {"ok": True}
 
 @admin.route('/orders', methods=['GET', 'POST'])
 @admin_required
 async def manage_orders():
     """
-    Управление заказами: просмотр и изменение статуса.
+    Управление заказами: просмотр с фильтрами и изменение статуса
+    (одного заказа или выбранных заказов разом).
     """
     if request.method == 'POST':
         form = await request.form
-        order_id = form.get('order_id')
         new_status = form.get('status')
-        await update_order_status(current_app.db_pool, order_id, new_status)
-        await publish_event("orders", {
-            "type": "status_changed",
-            "order_id": order_id,
-            "new_status": new_status
-        })
-        await flash('Статус заказа обновлен.', 'success')
-        return redirect(url_for('admin.manage_orders'))
+        order_ids = [order_id for order_id in form.getlist('order_ids') or [form.get('order_id')] if order_id]
+        if not order_ids:
+            await flash('Выберите заказы.', 'warning')
+            return redirect(url_for('admin.manage_orders', **request.args))
+        try:
+            updated = await update_orders_status(current_app.db_pool, order_ids, new_status)
+        except ValueError:
+            await flash('Неверный статус или номер заказа.', 'danger')
+            return redirect(url_for('admin.manage_orders', **request.args))
+        await flash(f'Статус обновлен у заказов: {len(updated)}.', 'success')
+        # Возвращаемся на ту же страницу с теми же фильтрами
+        return redirect(url_for('admin.manage_orders', **request.args))
+
+    # GET-запрос: страница заказов с фильтрами
+    args = request.args
+    filters = {
+        'status': args.get('status', ''),
+        'date_from': args.get('date_from', ''),
+        'date_to': args.get('date_to', ''),
+        'email': args.get('email', '').strip(),
+    }
+    orders, next_cursor = [], None
+    after = decode_cursor(args.get('cursor', ''), 2)
+    try:
+        page = dict(
+            status=filters['status'],
+            date_from=datetime.strptime(filters['date_from'], '%Y-%m-%d').date() if filters['date_from'] else None,
+            date_to=datetime.strptime(filters['date_to'], '%Y-%m-%d').date() if filters['date_to'] else None,
+            email=filters['email'],
+            limit=args.get('limit', ADMIN_PAGE_SIZE)
+        )
+        try:
+            orders, next_cursor = await get_admin_orders_page(current_app.db_pool, after=after, **page)
+        except InvalidCursor:
+            # Курсор повреждён — показываем первую страницу
+            after = None
+            orders, next_cursor = await get_admin_orders_page(current_app.db_pool, **page)
+    except ValueError:
+        await flash('Неверные параметры фильтра.', 'warning')
+    return await render_template(
+        'admin/manage_orders.html',
+        orders=orders,
+        statuses=ORDER_STATUSES,
+        filters=filters,
+        next_cursor=next_cursor,
+        is_first_page=after is None
+    )
 
-    # GET-запрос: отображаем список заказов
-    orders = await get_all_orders(current_app.db_pool)
-    return await render_template('admin/manage_orders.html', orders=orders)
 
+@admin.route('/cache/stats', methods=['GET'])
+@admin_required
+async def cache_stats():
+    """
+    Статистика кеша по уровням (L1 — память процесса, L2 — Redis) в формате JSON.
+    """
+    return get_cache_stats()
 
-@admin.route('/backup', methods=['GET'])
+
+@admin.route('/queries/stats', methods=['GET'])
 @admin_required
-async def backup_database():
+async def query_stats():
     """
-    Резервное копирование базы данных.
+    Число вызовов и время выполнения именованных запросов к БД в формате JSON.
     """
-    # Путь к резервной копии
-    backup_dir = 'backups'
-    os.makedirs(backup_dir, exist_ok=True)
-    backup_file = os.path.join(backup_dir, f'backup_{datetime.datetime.now().strftime("%Y%m%d%H%M%S")}.sql')
+    return get_query_stats()
 
-    # Команда для резервного копирования
-    db_name = os.getenv("DB_NAME")  # Замените на имя вашей базы данных
-    db_user = os.getenv("DB_USER")        # Замените на имя пользователя базы данных
-    db_password = os.getenv("DB_PASSWORD")  # Замените на пароль пользователя базы данных
 
-    command = f'PGPASSWORD="{db_password}" pg_dump -U {db_user} {db_name} > {backup_file}'
+@admin.route('/queries/slow', methods=['GET'])
+@admin_required
+async def slow_queries():
+    """
+    Последние медленные запросы к БД и снятые для них планы выполнения.
+    """
+    return await render_template(
+        'admin/slow_queries.html',
+        slow_queries=get_slow_queries(),
+        threshold_ms=SLOW_QUERY_MS,
+    )
+
+
+@admin.route('/events/stats', methods=['GET'])
+@admin_required
+async def order_events_stats():
+    """
+    Поток событий заказов: очередь outbox, длина потока, группы потребителей,
+    ожидающие и недоставленные события в формате JSON.
+    """
+    return await get_order_events_stats(current_app.db_pool)
 
-    # Выполнение команды
-    result = os.system(command)
-    if result == 0:
-        await flash(f'Резервная копия создана: {backup_file}', 'success')
-    else:
-        await flash('Ошибка при создании резервной копии.', 'danger')
 
-    return redirect(url_for('admin.admin_dashboard'))
+@admin.route('/pool/stats', methods=['GET'])
+@admin_required
+async def pool_stats():
+    """
+    Состояние пула соединений с БД и гистограмма ожидания соединения в формате JSON.
+    """
+    return current_app.db_pool.get_stats()
+
+
+@admin.route('/export/<name>', methods=['GET'])
+@admin_required
+async def export_data(name):
+    """
+    Потоковая выгрузка (orders, top_sales, revenue, reviews_by_category)
+    в CSV или NDJSON, при gzip=1 — сжатая на лету.
+    Параметры периода: date_from, date_to (YYYY-MM-DD), для revenue — group_by.
+    """
+    args = request.args
+    try:
+        date_from = datetime.strptime(args['date_from'], '%Y-%m-%d').date() if args.get('date_from') else None
+        date_to = datetime.strptime(args['date_to'], '%Y-%m-%d').date() if args.get('date_to') else None
+        body, filename, mimetype = build_export(
+            current_app.db_pool,
+            name,
+            fmt=args.get('format', 'csv'),
+            gzip=args.get('gzip') == '1',
+            date_from=date_from,
+            date_to=date_to,
+            group_by=args.get('group_by', 'day'),
+        )
+    except ValueError as e:
+        await flash(f'Неверные параметры выгрузки: {e}', 'danger')
+        return redirect(url_for('admin.analytics_dashboard'))
+
+    response = Response(body, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+    })
+    # Большая выгрузка отдаётся дольше стандартного RESPONSE_TIMEOUT
+    response.timeout = None
+    return response
+
+
+@admin.route('/backup', methods=['GET', 'POST'])
+@admin_required
+async def backup_database():
+    """
+    Резервное копирование базы данных: POST запускает pg_dump в фоне,
+    GET показывает страницу копий и состояние задачи.
+    """
+    if request.method == 'POST':
+        form = await request.form
+        fmt = form.get('format', 'plain')
+        try:
+            jobs = max(1, min(int(form.get('jobs') or 1), 16))
+            if fmt not in BACKUP_FORMATS:
+                raise ValueError(f'Неизвестный формат копии: {fmt}')
+            job_id = await start_backup_job('backup', format=fmt, jobs=jobs)
+        except ValueError as e:
+            await flash(str(e), 'warning')
+            return redirect(url_for('admin.backup_database'))
+        current_app.add_background_task(run_backup, job_id, current_app.db_pool, fmt, jobs)
+        await flash('Резервное копирование запущено.', 'success')
+        return redirect(url_for('admin.admin_dashboard'))
+
+    return await render_template(
+        'admin/restore_database.html',
+        backup_files=list_backups(),
+        job=await get_backup_job()
+    )
 
 @admin.route('/categories', methods=['GET', 'POST'])
 @admin_required
@@ -136,6 +379,7 @@ async def manage_categories():
             category_id = form.get('category_id')
             await delete_category(current_app.db_pool, category_id)
             await flash('Категория удалена.', 'success')
+        await invalidate_cache("cache:categories")
         return redirect(url_for('admin.manage_categories'))
 
     categories = await get_all_categories(current_app.db_pool)
@@ -145,9 +389,8 @@ async def manage_categories():
 @admin_required
 async def restore_database():
     """
-    Восстановление базы данных из резервной копии.
+    Восстановление базы данных из резервной копии (в фоне).
     """
-    backup_dir = 'backups'
     if request.method == 'POST':
         form = await request.form
         backup_file = form.get('backup_file')
@@ -155,9 +398,8 @@ async def restore_database():
             await flash('Пожалуйста, выберите файл резервной копии.', 'warning')
             return redirect(url_for('admin.restore_database'))
 
-        # Полный путь к файлу резервной копии
-        backup_path = os.path.join(backup_dir, backup_file)
-        if not os.path.exists(backup_path):
+        # Принимаем только имена из списка копий (без путей)
+        if backup_file not in list_backups():
             await flash('Файл резервной копии не найден.', 'danger')
             return redirect(url_for('admin.restore_database'))
 
@@ -167,42 +409,31 @@ async def restore_database():
             await flash('Вы должны подтвердить восстановление базы данных.', 'warning')
             return redirect(url_for('admin.restore_database'))
 
-        # Выполнение команды для восстановления базы данных
-        db_name = os.getenv('DB_NAME')  # Используем переменные окружения
-        db_user = os.getenv('DB_USER')
-        db_password = os.getenv('DB_PASSWORD')
-
         try:
-            # Устанавливаем переменную окружения для пароля
-            env = os.environ.copy()
-            env['PGPASSWORD'] = db_password
-
-            # Команда для восстановления базы данных
-            command = [
-                'psql',
-                '-U', db_user,
-                '-d', db_name,
-                '-f', backup_path
-            ]
-
-            # Выполняем команду восстановления
-            result = subprocess.run(command, env=env, capture_output=True, text=True)
-
-            if result.returncode == 0:
-                await flash('База данных успешно восстановлена из резервной копии.', 'success')
-            else:
-                logger.error(f"Ошибка при восстановлении базы данных: {result.stderr}")
-                await flash('Ошибка при восстановлении базы данных.', 'danger')
-        except Exception as e:
-            logger.error(f"Исключение при восстановлении базы данных: {e}")
-            await flash('Ошибка при восстановлении базы данных.', 'danger')
-
+            jobs = max(1, min(int(form.get('jobs') or 1), 16))
+            job_id = await start_backup_job('restore', file=backup_file, jobs=jobs)
+        except ValueError as e:
+            await flash(str(e), 'warning')
+            return redirect(url_for('admin.restore_database'))
+        current_app.add_background_task(run_restore, job_id, backup_file, jobs)
+        await flash('Восстановление базы данных запущено.', 'success')
         return redirect(url_for('admin.admin_dashboard'))
 
     # GET-запрос: отображаем список доступных резервных копий
-    backup_files = sorted(os.listdir(backup_dir), reverse=True)
-    backup_files = [f for f in backup_files if f.endswith('.sql')]
-    return await render_template('admin/restore_database.html', backup_files=backup_files)
+    return await render_template(
+        'admin/restore_database.html',
+        backup_files=list_backups(),
+        job=await get_backup_job()
+    )
+
+
+@admin.route('/jobs/backup', methods=['GET'])
+@admin_required
+async def backup_job_status():
+    """
+    Состояние текущей или последней задачи резервного копирования/восстановления в формате JSON.
+    """
+    return {"job": await get_backup_job()}
 
 @admin.route('/analytics', methods=['GET'])
 @admin_required
@@ -6,7 +6,13 @@ from quart import request
 
 AUTH_TOKEN_TTL = int(os.getenv("AUTH_TOKEN_TTL", 3600))
 
-async def store_token(token: str, user_id: str, ttl: int = 1800):
+def _token_key(token: str) -> str:
+    return f"auth_token:{token}"
+
+def _roles_version_key(user_id: str) -> str:
+    return f"roles_version:{user_id}"
+
+async def store_token(token: str, user_id: str, roles: list | None = None, roles_version: int = 0, ttl: int = 1800):
     r = await get_redis()
     
     # Формируем запись логов с IP и временем
@@ -18,13 +24,71 @@ async def store_token(token: str, user_id: str, ttl: int = 1800):
     await r.lpush(f"session_log:{user_id}", json.dumps(log_entry))
     await r.ltrim(f"session_log:{user_id}", 0, 9)
     
-    # Сохраняем сам токен с привязкой к user_id и временем жизни
-    await r.set(f"auth_token:{token}", user_id, ex=ttl)
+    # Сохраняем сам токен с привязкой к user_id, ролям и временем жизни
+    record = {"user_id": user_id, "roles": roles, "roles_version": roles_version}
+    await r.set(_token_key(token), json.dumps(record), ex=ttl)
+
+async def get_roles_version(user_id: str) -> int:
+    """
+    Текущая версия ролей пользователя (0, если роли ни разу не менялись).
+    """
+    r = await get_redis()
+    return int(await r.get(_roles_version_key(user_id)) or 0)
+
+async def bump_roles_version(user_id: str):
+    """
+    Вызывается при изменении ролей пользователя: роли, сохранённые в его токенах,
+    станут устаревшими и будут перечитаны из БД при следующем запросе.
+    """
+    r = await get_redis()
+    await r.incr(_roles_version_key(user_id))
+
+async def get_auth_context(token: str, user_id: str) -> dict | None:
+    """
+    Запись токена и текущая версия ролей пользователя за один запрос к Redis (MGET).
+    Возвращает None, если токен недействителен или выдан другому пользователю.
+    Поле stale=True означает, что роли в записи нужно перечитать из БД.
+    """
+    r = await get_redis()
+    raw, current_version = await r.mget(_token_key(token), _roles_version_key(user_id))
+    if raw is None:
+        return None
+
+    try:
+        record = json.loads(raw)
+    except ValueError:
+        record = None
+    if not isinstance(record, dict):
+        # Токен старого формата: значением был сам user_id
+        record = {"user_id": raw, "roles": None, "roles_version": None}
+
+    if record.get("user_id") != user_id:
+        return None
+
+    current_version = int(current_version or 0)
+    record["stale"] = record.get("roles") is None or record.get("roles_version") != current_version
+    record["current_roles_version"] = current_version
+    return record
+
+async def refresh_token_roles(token: str, user_id: str, roles: list, roles_version: int):
+    """
+    Обновляет роли в записи токена, не меняя её время жизни.
+    """
+    r = await get_redis()
+    record = {"user_id": user_id, "roles": roles, "roles_version": roles_version}
+    await r.set(_token_key(token), json.dumps(record), keepttl=True, xx=True)
 
 async def get_user_by_token(token: str) -> str | None:
     r = await get_redis()
-    return await r.get(f"auth_token:{token}")
+    raw = await r.get(_token_key(token))
+    if raw is None:
+        return None
+    try:
+        record = json.loads(raw)
+    except ValueError:
+        return raw
+    return record.get("user_id") if isinstance(record, dict) else raw
 
 async def delete_token(token: str):
     r = await get_redis()
-    await r.delete(f"auth_token:{token}")
\ No newline at end of file
+    await r.delete(_token_key(token))
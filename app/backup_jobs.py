@@ -0,0 +1,364 @@
+import os
+import re
+import time
+import uuid
+import zlib
+import shutil
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime
+from app.redis_client import get_redis
+from app.cache_utils import RELEASE_LOCK_SCRIPT, invalidate_cache_keys
+
+logger = logging.getLogger(__name__)
+
+# Резервное копирование и восстановление БД в фоне.
+# pg_dump / psql / pg_restore запускаются как асинхронные подпроцессы, поэтому
+# цикл событий не блокируется; сжатие и запись файла идут в потоках.
+# Состояние задачи хранится в Redis (видно всем воркерам), одновременно
+# выполняется не больше одной задачи.
+
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_GZIP_LEVEL = int(os.getenv("BACKUP_GZIP_LEVEL", 6))
+BACKUP_CHUNK_BYTES = 256 * 1024
+
+# Хеш с состоянием последней задачи и блокировка "одна задача за раз".
+# Блокировка живёт BACKUP_LOCK_TTL секунд и продлевается фоновым пульсом
+# каждые BACKUP_LOCK_TTL / 3 секунд, пока задача идёт (в том числе когда
+# утилита долго ничего не выводит): если воркер упал, она истечёт,
+# и задача покажется прерванной.
+BACKUP_JOB_KEY = "jobs:backup"
+BACKUP_LOCK_KEY = "lock:jobs:backup"
+BACKUP_LOCK_TTL = 60
+
+# Продлеваем блокировку, только если она всё ещё принадлежит задаче
+RENEW_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+# Как часто записывать прогресс в Redis, секунды
+BACKUP_PROGRESS_INTERVAL = 1.0
+
+BACKUP_FORMATS = ("plain", "directory")
+
+# Строки подробного вывода (-v), по которым считается прогресс
+_DUMP_TABLE_RE = re.compile(r"dumping contents of table")
+_PARALLEL_ITEM_RE = re.compile(r"finished item \d+ TABLE DATA")
+_RESTORE_ITEM_RE = re.compile(r"(processing|finished) item \d+")
+
+COUNT_TABLES_SQL = """
+    SELECT COUNT(*)
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.relkind IN ('r', 'p')
+      AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+      AND n.nspname NOT LIKE 'pg_toast%'
+"""
+
+
+def list_backups() -> list:
+    """
+    Резервные копии в BACKUP_DIR, новые первыми: .sql.gz (сжатый SQL),
+    .sql (старые несжатые копии) и каталоги .dir (формат directory).
+    """
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    names = [
+        name for name in os.listdir(BACKUP_DIR)
+        if name.endswith((".sql", ".sql.gz"))
+        or (name.endswith(".dir") and os.path.isdir(os.path.join(BACKUP_DIR, name)))
+    ]
+    return sorted(names, reverse=True)
+
+
+def _connection_args() -> tuple:
+    """
+    Параметры подключения утилит PostgreSQL и окружение с паролем
+    (пароль не попадает в командную строку).
+    """
+    args = ["-U", os.getenv("DB_USER", "")]
+    if os.getenv("DB_HOST"):
+        args += ["-h", os.getenv("DB_HOST")]
+    if os.getenv("DB_PORT"):
+        args += ["-p", os.getenv("DB_PORT")]
+    env = os.environ.copy()
+    env["PGPASSWORD"] = os.getenv("DB_PASSWORD", "")
+    return args, env
+
+
+async def get_backup_job():
+    """
+    Состояние текущей или последней задачи (словарь) или None.
+    Задача в статусе running без блокировки — воркер, выполнявший её, остановился.
+    """
+    r = await get_redis()
+    job = await r.hgetall(BACKUP_JOB_KEY)
+    if not job:
+        return None
+    if job.get("status") == "running" and not await r.exists(BACKUP_LOCK_KEY):
+        job["status"] = "interrupted"
+    return job
+
+
+async def start_backup_job(kind: str, **params) -> str:
+    """
+    Занимает блокировку и записывает новую задачу. ValueError — если другая
+    задача ещё выполняется. Саму задачу запускает вызывающий (run_backup / run_restore).
+    """
+    r = await get_redis()
+    job_id = uuid.uuid4().hex
+    if not await r.set(BACKUP_LOCK_KEY, job_id, nx=True, ex=BACKUP_LOCK_TTL):
+        raise ValueError("Другая задача резервного копирования или восстановления ещё выполняется.")
+    await r.delete(BACKUP_JOB_KEY)
+    await r.hset(BACKUP_JOB_KEY, mapping={
+        "job_id": job_id,
+        "kind": kind,
+        "status": "running",
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "percent": 0,
+        "bytes": 0,
+        **{key: str(value) for key, value in params.items()},
+    })
+    return job_id
+
+
+class _JobProgress:
+    """
+    Запись прогресса в Redis не чаще раза в BACKUP_PROGRESS_INTERVAL.
+    Пока задача не завершена, блокировку продлевает отдельная задача-пульс.
+    """
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.fields = {}
+        self.last_flush = 0.0
+        self.heartbeat = asyncio.ensure_future(self._renew_lock())
+
+    async def _renew_lock(self):
+        r = await get_redis()
+        while True:
+            await asyncio.sleep(BACKUP_LOCK_TTL / 3)
+            try:
+                if not await r.eval(RENEW_LOCK_SCRIPT, 1, BACKUP_LOCK_KEY, self.job_id, BACKUP_LOCK_TTL):
+                    logger.error(f"Блокировка задачи {self.job_id} потеряна, продление остановлено")
+                    return
+            except Exception as e:
+                # Redis временно недоступен — попробуем на следующем такте, пока TTL не истёк
+                logger.warning(f"Не удалось продлить блокировку задачи {self.job_id}: {e}")
+
+    async def update(self, force: bool = False, **fields):
+        self.fields.update(fields)
+        now = time.monotonic()
+        if not force and now - self.last_flush < BACKUP_PROGRESS_INTERVAL:
+            return
+        self.last_flush = now
+        r = await get_redis()
+        if self.fields:
+            await r.hset(BACKUP_JOB_KEY, mapping={key: str(value) for key, value in self.fields.items()})
+            self.fields = {}
+
+    async def finish(self, status: str, **fields):
+        self.heartbeat.cancel()
+        await self.update(
+            force=True, status=status, finished_at=datetime.now().isoformat(timespec="seconds"), **fields
+        )
+        r = await get_redis()
+        await r.eval(RELEASE_LOCK_SCRIPT, 1, BACKUP_LOCK_KEY, self.job_id)
+
+
+async def _collect_stderr(stream, pattern, on_match, tail: deque):
+    """
+    Читает stderr утилиты: совпадения с pattern считаются как прогресс,
+    остальные строки сохраняются в tail (для сообщения об ошибке).
+    """
+    while True:
+        line = await stream.readline()
+        if not line:
+            return
+        text = line.decode("utf-8", "replace").rstrip()
+        if pattern is not None and pattern.search(text):
+            await on_match()
+        elif text:
+            tail.append(text)
+
+
+async def _wait_process(proc, stderr_task, tail: deque, tool: str):
+    await stderr_task
+    returncode = await proc.wait()
+    if returncode != 0:
+        raise RuntimeError(f"{tool} завершился с кодом {returncode}: " + " | ".join(tail))
+
+
+async def run_backup(job_id: str, pool, fmt: str = "plain", jobs: int = 1):
+    """
+    Снимает резервную копию. plain — SQL-дамп (с --clean), сжатый gzip на лету
+    в backups/backup_<время>.sql.gz; directory — формат каталога pg_dump
+    с параллельной выгрузкой таблиц (-j) и встроенным сжатием.
+    """
+    progress = _JobProgress(job_id)
+    conn_args, env = _connection_args()
+    stamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    target = os.path.join(BACKUP_DIR, f"backup_{stamp}.dir" if fmt == "directory" else f"backup_{stamp}.sql.gz")
+    partial = target + ".part"
+    proc = None
+    try:
+        async with pool.acquire() as conn:
+            total_tables = max(await conn.fetchval(COUNT_TABLES_SQL), 1)
+        done_tables = 0
+
+        async def table_done():
+            nonlocal done_tables
+            done_tables += 1
+            await progress.update(percent=min(99, done_tables * 100 // total_tables), tables=done_tables)
+
+        tail = deque(maxlen=20)
+        if fmt == "directory":
+            proc = await asyncio.create_subprocess_exec(
+                "pg_dump", *conn_args, "-Fd", "-j", str(jobs), "-Z", str(BACKUP_GZIP_LEVEL), "-v",
+                "-f", partial, os.getenv("DB_NAME", ""),
+                env=env, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+            )
+            pattern = _PARALLEL_ITEM_RE if jobs > 1 else _DUMP_TABLE_RE
+            stderr_task = asyncio.ensure_future(_collect_stderr(proc.stderr, pattern, table_done, tail))
+            await _wait_process(proc, stderr_task, tail, "pg_dump")
+        else:
+            proc = await asyncio.create_subprocess_exec(
+                "pg_dump", *conn_args, "--clean", "--if-exists", "-v", os.getenv("DB_NAME", ""),
+                env=env, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+            )
+            stderr_task = asyncio.ensure_future(_collect_stderr(proc.stderr, _DUMP_TABLE_RE, table_done, tail))
+            compressor = zlib.compressobj(BACKUP_GZIP_LEVEL, zlib.DEFLATED, 31)  # 31 — формат gzip
+            written = 0
+            with open(partial, "wb") as f:
+                def write_chunk(chunk: bytes) -> int:
+                    data = compressor.compress(chunk)
+                    f.write(data)
+                    return len(data)
+
+                while True:
+                    chunk = await proc.stdout.read(BACKUP_CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    # zlib отпускает GIL, поэтому сжатие в потоке не мешает циклу событий
+                    written += await asyncio.to_thread(write_chunk, chunk)
+                    await progress.update(bytes=written)
+                tail_data = compressor.flush()
+                await asyncio.to_thread(f.write, tail_data)
+                written += len(tail_data)
+            await _wait_process(proc, stderr_task, tail, "pg_dump")
+            await progress.update(bytes=written)
+
+        os.replace(partial, target)
+        await progress.finish("succeeded", percent=100, file=os.path.basename(target))
+        logger.info(f"Резервная копия создана: {target}")
+    except BaseException as e:
+        if proc is not None and proc.returncode is None:
+            proc.kill()
+        _remove(partial)
+        await progress.finish("failed", error=str(e) or type(e).__name__)
+        logger.error(f"Ошибка при создании резервной копии: {e}")
+        if isinstance(e, asyncio.CancelledError):
+            raise
+
+
+async def run_restore(job_id: str, backup_file: str, jobs: int = 1):
+    """
+    Восстанавливает БД из копии: SQL (.sql.gz или .sql) — через psql одной
+    транзакцией с остановкой на первой ошибке, каталог (.dir) — через pg_restore
+    с параллельной загрузкой (-j). После восстановления сбрасывается кеш.
+    """
+    progress = _JobProgress(job_id)
+    conn_args, env = _connection_args()
+    path = os.path.join(BACKUP_DIR, backup_file)
+    proc = None
+    try:
+        tail = deque(maxlen=20)
+        if backup_file.endswith(".dir"):
+            total_items = await _count_archive_items(path, env)
+            done_items = 0
+
+            async def item_done():
+                nonlocal done_items
+                done_items += 1
+                await progress.update(percent=min(99, done_items * 100 // total_items))
+
+            proc = await asyncio.create_subprocess_exec(
+                "pg_restore", *conn_args, "-d", os.getenv("DB_NAME", ""), "--clean", "--if-exists",
+                "-j", str(jobs), "-v", path,
+                env=env, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+            )
+            stderr_task = asyncio.ensure_future(_collect_stderr(proc.stderr, _RESTORE_ITEM_RE, item_done, tail))
+            await _wait_process(proc, stderr_task, tail, "pg_restore")
+        else:
+            proc = await asyncio.create_subprocess_exec(
+                "psql", *conn_args, "-d", os.getenv("DB_NAME", ""), "-q",
+                "-v", "ON_ERROR_STOP=1", "--single-transaction",
+                env=env, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            stderr_task = asyncio.ensure_future(_collect_stderr(proc.stderr, None, None, tail))
+            total_bytes = max(os.path.getsize(path), 1)
+            decompressor = zlib.decompressobj(31) if backup_file.endswith(".gz") else None
+            read_bytes = 0
+            with open(path, "rb") as f:
+                def read_chunk() -> tuple:
+                    raw = f.read(BACKUP_CHUNK_BYTES)
+                    return len(raw), decompressor.decompress(raw) if decompressor and raw else raw
+
+                try:
+                    while True:
+                        size, data = await asyncio.to_thread(read_chunk)
+                        if not size:
+                            break
+                        read_bytes += size
+                        proc.stdin.write(data)
+                        # Ждём, пока psql заберёт данные, чтобы не копить их в памяти
+                        await proc.stdin.drain()
+                        await progress.update(percent=min(99, read_bytes * 100 // total_bytes), bytes=read_bytes)
+                    proc.stdin.close()
+                except (BrokenPipeError, ConnectionResetError):
+                    # psql остановился на ошибке — причина будет в stderr
+                    pass
+            await _wait_process(proc, stderr_task, tail, "psql")
+
+        await _flush_cache()
+        await progress.finish("succeeded", percent=100)
+        logger.info(f"База данных восстановлена из {backup_file}")
+    except BaseException as e:
+        if proc is not None and proc.returncode is None:
+            proc.kill()
+        await progress.finish("failed", error=str(e) or type(e).__name__)
+        logger.error(f"Ошибка при восстановлении базы данных: {e}")
+        if isinstance(e, asyncio.CancelledError):
+            raise
+
+
+async def _count_archive_items(path: str, env) -> int:
+    """
+    Число элементов оглавления архива (pg_restore -l) — база для процента.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        "pg_restore", "-l", path, env=env, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+    )
+    stdout, _ = await proc.communicate()
+    return max(sum(1 for line in stdout.splitlines() if line and not line.startswith(b";")), 1)
+
+
+async def _flush_cache():
+    """
+    После восстановления данные в кеше устарели: удаляем все ключи cache:*.
+    """
+    r = await get_redis()
+    keys = [key.split("|", 1)[1] async for key in r.scan_iter(match="*|cache:*", count=1000)]
+    await invalidate_cache_keys(keys)
+
+
+def _remove(path: str):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
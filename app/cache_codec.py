@@ -0,0 +1,164 @@
+import os
+import json
+import zlib
+import uuid
+import decimal
+import datetime
+
+try:
+    import msgpack
+except ImportError:  # msgpack необязателен: без него используется JSON
+    msgpack = None
+
+# Значения длиннее порога сжимаются zlib
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", 1024))
+CACHE_COMPRESS_LEVEL = int(os.getenv("CACHE_COMPRESS_LEVEL", 1))
+
+# Первый байт значения в Redis: сжато оно или нет
+_RAW = b"\x00"
+_ZLIB = b"\x01"
+
+# Коды расширенных типов msgpack
+_EXT_UUID = 1
+_EXT_DECIMAL = 2
+_EXT_DATETIME = 3
+_EXT_DATE = 4
+
+
+def make_json_serializable(obj):
+    """
+    Преобразует asyncpg.Record, dict и списки с UUID/Decimal/датами в сериализуемую
+    структуру; вложенные списки и словари обрабатываются рекурсивно.
+    """
+    if isinstance(obj, (list, tuple)):
+        return [make_json_serializable(item) for item in obj]
+
+    elif isinstance(obj, dict) or hasattr(obj, 'items'):
+        return {k: make_json_serializable(v) for k, v in obj.items()}
+
+    elif isinstance(obj, uuid.UUID):
+        return str(obj)
+
+    elif isinstance(obj, decimal.Decimal):
+        return float(obj)
+
+    elif isinstance(obj, (datetime.date, datetime.datetime)):
+        return obj.isoformat()
+
+    return obj
+
+
+def to_plain(obj):
+    """
+    Преобразует asyncpg.Record (и списки записей) в dict/list без изменения типов значений.
+    """
+    if isinstance(obj, (list, tuple)):
+        return [to_plain(item) for item in obj]
+    if isinstance(obj, dict):
+        return {k: to_plain(v) for k, v in obj.items()}
+    if hasattr(obj, 'items'):
+        return {k: to_plain(v) for k, v in obj.items()}
+    return obj
+
+
+class JsonCodec:
+    """
+    Прежний формат: UUID и Decimal превращаются в строки и float.
+    """
+    name = "json"
+
+    def prepare(self, obj):
+        return make_json_serializable(obj)
+
+    def dumps(self, obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+    def loads(self, data: bytes):
+        return json.loads(data)
+
+
+class MsgpackCodec:
+    """
+    Компактный двоичный формат; UUID, Decimal, datetime и date сохраняются как есть.
+    """
+    name = "msgpack"
+
+    def prepare(self, obj):
+        return to_plain(obj)
+
+    def dumps(self, obj) -> bytes:
+        return msgpack.packb(obj, default=self._default, use_bin_type=True)
+
+    def loads(self, data: bytes):
+        return msgpack.unpackb(data, ext_hook=self._ext_hook, raw=False, strict_map_key=False)
+
+    @staticmethod
+    def _default(value):
+        if isinstance(value, uuid.UUID):
+            return msgpack.ExtType(_EXT_UUID, value.bytes)
+        if isinstance(value, decimal.Decimal):
+            return msgpack.ExtType(_EXT_DECIMAL, str(value).encode("ascii"))
+        if isinstance(value, datetime.datetime):
+            return msgpack.ExtType(_EXT_DATETIME, value.isoformat().encode("ascii"))
+        if isinstance(value, datetime.date):
+            return msgpack.ExtType(_EXT_DATE, value.isoformat().encode("ascii"))
+        raise TypeError(f"Тип {type(value).__name__} не поддерживается кодеком msgpack")
+
+    @staticmethod
+    def _ext_hook(code, data):
+        if code == _EXT_UUID:
+            return uuid.UUID(bytes=data)
+        if code == _EXT_DECIMAL:
+            return decimal.Decimal(data.decode("ascii"))
+        if code == _EXT_DATETIME:
+            return datetime.datetime.fromisoformat(data.decode("ascii"))
+        if code == _EXT_DATE:
+            return datetime.date.fromisoformat(data.decode("ascii"))
+        return msgpack.ExtType(code, data)
+
+
+class CacheCodec:
+    """
+    Кодирует значения кеша: формат + сжатие zlib для больших значений.
+    `tag` входит в ключ Redis, поэтому смена формата не ломает уже записанные данные.
+    """
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, serializer, compress_min_bytes: int = CACHE_COMPRESS_MIN_BYTES):
+        self.serializer = serializer
+        self.compress_min_bytes = compress_min_bytes
+        self.tag = f"{serializer.name}.v{self.FORMAT_VERSION}"
+
+    def prepare(self, obj):
+        """
+        Приводит результат запроса к виду, который вернёт decode (для единообразия промаха и попадания).
+        """
+        return self.serializer.prepare(obj)
+
+    def encode(self, obj) -> bytes:
+        payload = self.serializer.dumps(obj)
+        if self.compress_min_bytes and len(payload) >= self.compress_min_bytes:
+            return _ZLIB + zlib.compress(payload, CACHE_COMPRESS_LEVEL)
+        return _RAW + payload
+
+    def decode(self, data: bytes):
+        header, payload = data[:1], data[1:]
+        if header == _ZLIB:
+            payload = zlib.decompress(payload)
+        return self.serializer.loads(payload)
+
+
+def make_codec(name: str | None = None) -> CacheCodec:
+    """
+    Кодек по имени ("msgpack" или "json"). По умолчанию — из CACHE_CODEC,
+    msgpack при наличии библиотеки.
+    """
+    name = name or os.getenv("CACHE_CODEC") or ("msgpack" if msgpack else "json")
+    if name == "msgpack":
+        if msgpack is None:
+            raise RuntimeError("Для CACHE_CODEC=msgpack установите пакет msgpack.")
+        return CacheCodec(MsgpackCodec())
+    if name == "json":
+        return CacheCodec(JsonCodec())
+    raise ValueError(f"Неизвестный кодек кеша: {name}")
@@ -1,80 +1,394 @@
 import os
-import json
+import math
+import time
+import random
+import asyncio
 import uuid
-from app.redis_client import get_redis
+import logging
+from collections import OrderedDict
+from app.redis_client import get_redis, get_binary_redis
+from app.cache_codec import make_codec
+from app.metrics import cache_requests_total
+
+logger = logging.getLogger(__name__)
 
 DEFAULT_TTL = int(os.getenv("CACHE_TTL", 300))  # по умолчанию 5 минут
 
-import uuid
-import decimal
+# Формат значений в Redis; его тег входит в ключ (см. _redis_key)
+codec = make_codec()
+
+# Локальный (L1) кеш в памяти процесса перед Redis (L2)
+L1_TTL = int(os.getenv("CACHE_L1_TTL", 30))
+L1_MAX_ENTRIES = int(os.getenv("CACHE_L1_MAX_ENTRIES", 1000))
+L1_MAX_BYTES = int(os.getenv("CACHE_L1_MAX_BYTES", 16 * 1024 * 1024))
+
+# Защита от одновременного пересчёта ключа (cache stampede)
+CACHE_TTL_JITTER = float(os.getenv("CACHE_TTL_JITTER", 0.1))  # до +10% к TTL
+CACHE_LOCK_TIMEOUT_MS = int(os.getenv("CACHE_LOCK_TIMEOUT_MS", 5000))
+CACHE_LOCK_POLL_INTERVAL = float(os.getenv("CACHE_LOCK_POLL_INTERVAL", 0.05))
+
+# Режим обновления в фоне для горячих ключей (stale-while-revalidate + XFetch)
+CACHE_STALE_TTL = int(os.getenv("CACHE_STALE_TTL", 3600))
+CACHE_XFETCH_BETA = float(os.getenv("CACHE_XFETCH_BETA", 1.0))
+
+# Снимаем блокировку, только если она всё ещё наша
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
 
-def make_json_serializable(obj):
+# Канал Redis, через который воркеры сообщают друг другу об инвалидации ключей
+INVALIDATION_CHANNEL = "cache_invalidation"
+# Сколько ключей удаляется одной командой при массовой инвалидации
+INVALIDATION_BATCH_SIZE = int(os.getenv("CACHE_INVALIDATION_BATCH_SIZE", 500))
+
+
+class LocalCache:
     """
-    Преобразует asyncpg.Record или dict с UUID/Decimal в сериализуемую структуру.
+    LRU-кеш в памяти процесса с TTL и ограничением на число ключей
+    и суммарный размер значений (размер считается по длине закодированного значения).
     """
-    if isinstance(obj, list):
-        return [make_json_serializable(item) for item in obj]
 
-    elif isinstance(obj, dict):
-        return {
-            k: (
-                str(v) if isinstance(v, uuid.UUID)
-                else float(v) if isinstance(v, decimal.Decimal)
-                else v
-            )
-            for k, v in obj.items()
-        }
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
 
-    elif hasattr(obj, 'items'):
-        return {
-            k: (
-                str(v) if isinstance(v, uuid.UUID)
-                else float(v) if isinstance(v, decimal.Decimal)
-                else v
-            )
-            for k, v in dict(obj).items()
-        }
+    def get(self, key: str):
+        """
+        Возвращает пару (найдено, значение). Просроченный ключ удаляется.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        expires_at, _, value = entry
+        if expires_at <= time.monotonic():
+            self.delete(key)
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+
+    def set(self, key: str, value, size: int, ttl: int):
+        """
+        Сохраняет значение; при переполнении вытесняет давно не использованные ключи.
+        """
+        self.delete(key)
+        if ttl <= 0 or size > self.max_bytes:
+            return
+        self._entries[key] = (time.monotonic() + ttl, size, value)
+        self.total_bytes += size
+        while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self.total_bytes -= evicted_size
+            self.evictions += 1
 
-    elif isinstance(obj, uuid.UUID):
-        return str(obj)
+    def delete(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[1]
 
-    elif isinstance(obj, decimal.Decimal):
-        return float(obj)
+    def clear(self):
+        self._entries.clear()
+        self.total_bytes = 0
 
-    return obj
+    def key_sizes(self) -> dict:
+        """
+        Размер каждого ключа в байтах.
+        """
+        return {key: entry[1] for key, entry in self._entries.items()}
 
-async def get_or_cache_json(key: str, fetch_fn, ttl: int = DEFAULT_TTL):
+
+local_cache = LocalCache(L1_MAX_ENTRIES, L1_MAX_BYTES)
+
+# Загрузки, выполняющиеся в этом процессе: key -> asyncio.Task
+_inflight = {}
+
+# Счётчики попаданий и промахов по уровням кеша
+cache_stats = {
+    "l1": {"hits": 0, "misses": 0},
+    "l2": {"hits": 0, "misses": 0},
+}
+
+
+def _count(key: str, level: str, result: str):
+    """
+    Учитывает попадание или промах: в общих счётчиках и в метрике
+    по префиксу ключа ("cache:product:<id>" -> "cache:product").
+    """
+    cache_stats[level][result] += 1
+    cache_requests_total.inc(":".join(key.split(":", 2)[:2]), level, result)
+
+
+async def get_or_cache_json(
+    key: str,
+    fetch_fn,
+    ttl: int = DEFAULT_TTL,
+    stale_ttl: int = 0,
+    xfetch_beta: float = 0.0
+):
     """
     Универсальная функция получения данных из кеша или из БД:
-    - Пытается получить значение по ключу `key` из Redis.
-    - Если значение найдено — возвращает его.
-    - Если нет — вызывает функцию `fetch_fn`, сохраняет результат в Redis с TTL.
+    - Ищет значение по ключу `key` в локальном кеше процесса (L1).
+    - Затем пытается получить его из Redis (L2) и кладёт в L1.
+    - Если нигде нет — вызывает функцию `fetch_fn`, сохраняет результат в Redis с TTL и в L1.
+
+    Одновременные промахи по одному ключу объединяются: внутри процесса
+    `fetch_fn` выполняется один раз (single-flight), между процессами —
+    только владельцем короткой блокировки в Redis, остальные ждут значение.
+
+    Опционально (stale_ttl > 0 или xfetch_beta > 0) включается режим обновления
+    в фоне: значение свежее `ttl` секунд, после этого ещё `stale_ttl` секунд
+    отдаётся устаревшим, пока фоновая задача его обновляет. При xfetch_beta > 0
+    обновление может начаться раньше — с вероятностью, растущей по мере
+    приближения к истечению (XFetch); чем больше beta, тем раньше.
+    """
+    refresh_ahead = stale_ttl > 0 or xfetch_beta > 0
+    l1_ttl = min(ttl + stale_ttl, L1_TTL)
+
+    found, value = local_cache.get(key)
+    if found:
+        _count(key, "l1", "hits")
+    else:
+        _count(key, "l1", "misses")
+        try:
+            rb = await get_binary_redis()
+            cached = await rb.get(_redis_key(key))
+            if cached:
+                _count(key, "l2", "hits")
+                value = _store_local(key, cached, l1_ttl)
+                found = True
+        except Exception as e:
+            logger.warning(f"Redis недоступен (get): {e}")
+
+    if not found:
+        # Single-flight: все корутины процесса ждут одну загрузку.
+        # shield — чтобы отмена одного запроса не прерывала загрузку для остальных.
+        task = _inflight.get(key)
+        if task is None:
+            task = _start_inflight(key, _load_with_lock(key, fetch_fn, ttl, stale_ttl if refresh_ahead else None))
+        value, from_redis = await asyncio.shield(task)
+        # Один исход L2 на обращение: значение дождались в Redis — попадание, загрузили — промах
+        _count(key, "l2", "hits" if from_redis else "misses")
+
+    # В режиме обновления в фоне значение хранится в обёртке с мягким сроком.
+    is_envelope = isinstance(value, dict) and "soft_expiry" in value and "value" in value
+    if not refresh_ahead:
+        return value["value"] if is_envelope else value
+
+    # Значение, записанное без обёртки (до включения режима), считаем устаревшим.
+    refresh_key = f"refresh:{key}"
+    if (not is_envelope or _needs_refresh(value, xfetch_beta)) and refresh_key not in _inflight:
+        _start_inflight(refresh_key, _refresh_in_background(key, fetch_fn, ttl, stale_ttl))
+    return value["value"] if is_envelope else value
+
+
+def _start_inflight(key: str, coro):
+    """
+    Запускает загрузку ключа как задачу и регистрирует её в _inflight до завершения.
+    """
+    task = asyncio.ensure_future(coro)
+    _inflight[key] = task
+    task.add_done_callback(lambda _: _inflight.pop(key, None))
+    return task
+
+
+def _redis_key(key: str) -> str:
+    """
+    Ключ в Redis с тегом формата, например "msgpack.v1|cache:categories".
+    """
+    return f"{codec.tag}|{key}"
+
+
+def _store_local(key: str, encoded: bytes, l1_ttl: int):
+    """
+    Декодирует значение из Redis и кладёт его в L1.
+    """
+    data = codec.decode(encoded)
+    local_cache.set(key, data, len(encoded), l1_ttl)
+    return data
+
+
+def _jittered_ttl(ttl: int) -> int:
+    """
+    Добавляет к TTL случайную надбавку, чтобы ключи не истекали одновременно.
+    """
+    return ttl + random.randint(0, int(ttl * CACHE_TTL_JITTER))
+
+
+def _needs_refresh(envelope: dict, xfetch_beta: float) -> bool:
+    """
+    Истёк ли мягкий срок значения. При xfetch_beta > 0 — с вероятностным
+    ранним обновлением: now - delta * beta * ln(rand) >= soft_expiry,
+    где delta — сколько длилась последняя загрузка.
+    """
+    now = time.time()
+    if xfetch_beta > 0:
+        now -= envelope["delta"] * xfetch_beta * math.log(1.0 - random.random())
+    return now >= envelope["soft_expiry"]
+
+
+async def _fetch_and_store(key: str, fetch_fn, ttl: int, stale_ttl: int | None):
+    """
+    Вызывает `fetch_fn` и сохраняет результат в Redis и L1.
+    Если stale_ttl задан, значение хранится в обёртке
+    {"value", "soft_expiry", "delta"} и живёт в Redis ttl + stale_ttl секунд.
+    """
+    started = time.monotonic()
+    data = await fetch_fn()
+    serializable_data = codec.prepare(data)
+
+    if stale_ttl is None:
+        stored = serializable_data
+        redis_ttl = _jittered_ttl(ttl)
+        l1_ttl = min(ttl, L1_TTL)
+    else:
+        soft_ttl = _jittered_ttl(ttl)
+        stored = {
+            "value": serializable_data,
+            "soft_expiry": time.time() + soft_ttl,
+            "delta": time.monotonic() - started,
+        }
+        redis_ttl = soft_ttl + stale_ttl
+        l1_ttl = min(ttl + stale_ttl, L1_TTL)
+    encoded = codec.encode(stored)
+
+    try:
+        rb = await get_binary_redis()
+        logger.debug(f"Сохраняем ключ в Redis: {key}")
+        await rb.set(_redis_key(key), encoded, ex=redis_ttl)
+    except Exception as e:
+        logger.warning(f"Redis недоступен (set): {e}")
+
+    local_cache.set(key, stored, len(encoded), l1_ttl)
+    return stored
+
+
+async def _load_with_lock(key: str, fetch_fn, ttl: int, stale_ttl: int | None = None):
     """
+    Загружает значение через `fetch_fn` под распределённой блокировкой lock:{key}.
+    Если блокировку держит другой процесс — ждёт, пока он положит значение в Redis.
+    При недоступности Redis или истечении ожидания загружает значение сам.
+    Возвращает (значение, получено ли оно из Redis).
+    """
+    lock_key = f"lock:{key}"
+    token = uuid.uuid4().hex
+    l1_ttl = min(ttl + (stale_ttl or 0), L1_TTL)
+    r = None
+    acquired = False
+
     try:
         r = await get_redis()
-        cached = await r.get(key)
-        if cached:
-            return json.loads(cached)
+        acquired = await r.set(lock_key, token, nx=True, px=CACHE_LOCK_TIMEOUT_MS)
+        if not acquired:
+            deadline = time.monotonic() + CACHE_LOCK_TIMEOUT_MS / 1000
+            while time.monotonic() < deadline:
+                await asyncio.sleep(CACHE_LOCK_POLL_INTERVAL)
+                cached = await (await get_binary_redis()).get(_redis_key(key))
+                if cached:
+                    return _store_local(key, cached, l1_ttl), True
+                # Владелец блокировки завершился без результата — пробуем занять её сами
+                acquired = await r.set(lock_key, token, nx=True, px=CACHE_LOCK_TIMEOUT_MS)
+                if acquired:
+                    break
     except Exception as e:
-        print(f"Redis недоступен (get): {e}")
+        logger.warning(f"Redis недоступен (lock): {e}")
+
+    try:
+        return await _fetch_and_store(key, fetch_fn, ttl, stale_ttl), False
+    finally:
+        if acquired:
+            await _release_lock(r, lock_key, token)
 
-    data = await fetch_fn()
-    serializable_data = make_json_serializable(data)
 
+async def _refresh_in_background(key: str, fetch_fn, ttl: int, stale_ttl: int):
+    """
+    Фоновое обновление устаревшего значения. Если другой процесс уже обновил
+    ключ в Redis — берём его значение; если он обновляет его сейчас — ничего не делаем.
+    """
+    lock_key = f"lock:{key}"
+    token = uuid.uuid4().hex
     try:
         r = await get_redis()
-        print(f"[DEBUG] Сохраняем ключ в Redis: {key}")
-        await r.set(key, json.dumps(serializable_data), ex=ttl)
+        cached = await (await get_binary_redis()).get(_redis_key(key))
+        current = codec.decode(cached) if cached else None
+        if isinstance(current, dict) and time.time() < current.get("soft_expiry", 0):
+            _store_local(key, cached, min(ttl + stale_ttl, L1_TTL))
+            return
+        if not await r.set(lock_key, token, nx=True, px=CACHE_LOCK_TIMEOUT_MS):
+            return
     except Exception as e:
-        print(f"Redis недоступен (set): {e}")
+        logger.warning(f"Redis недоступен (refresh): {e}")
+        return
 
-    return serializable_data
+    try:
+        await _fetch_and_store(key, fetch_fn, ttl, stale_ttl)
+    except Exception as e:
+        logger.error(f"Ошибка фонового обновления ключа {key}: {e}")
+    finally:
+        await _release_lock(r, lock_key, token)
+
+
+async def _release_lock(r, lock_key: str, token: str):
+    try:
+        await r.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+    except Exception as e:
+        logger.warning(f"Redis недоступен (unlock): {e}")
 
 
 async def invalidate_cache(key: str):
     """
-    Удаляет ключ из кеша Redis.
+    Удаляет ключ из кеша Redis и из локальных кешей всех воркеров.
     Используется при обновлении данных (например, категорий, товаров).
     """
+    local_cache.delete(key)
     r = await get_redis()
-    await r.delete(key)
\ No newline at end of file
+    await r.delete(_redis_key(key))
+    # Остальные процессы удалят ключ из своего L1, получив сообщение в listen_to_events
+    await r.publish(INVALIDATION_CHANNEL, key)
+
+
+async def invalidate_cache_keys(keys, batch_size: int = INVALIDATION_BATCH_SIZE):
+    """
+    Удаляет много ключей (например, после массового импорта товаров) пачками:
+    одна команда DEL и одно сообщение в INVALIDATION_CHANNEL на пачку
+    (ключи в сообщении разделены переводом строки).
+    """
+    keys = list(keys)
+    r = await get_redis()
+    for start in range(0, len(keys), batch_size):
+        batch = keys[start:start + batch_size]
+        for key in batch:
+            local_cache.delete(key)
+        await r.delete(*(_redis_key(key) for key in batch))
+        await r.publish(INVALIDATION_CHANNEL, "\n".join(batch))
+
+
+def get_cache_stats() -> dict:
+    """
+    Статистика кеша: попадания/промахи по уровням и заполненность L1.
+    """
+    return {
+        "l1": dict(cache_stats["l1"]),
+        "l2": dict(cache_stats["l2"]),
+        "l1_entries": len(local_cache.key_sizes()),
+        "l1_bytes": local_cache.total_bytes,
+        "l1_evictions": local_cache.evictions,
+        "l1_key_sizes": local_cache.key_sizes(),
+        "codec": codec.tag,
+    }
+
+
+def cache_metric_samples():
+    """
+    Заполненность L1 в текстовом формате Prometheus (для /metrics).
+    """
+    yield "# TYPE cache_l1_entries gauge"
+    yield f"cache_l1_entries {len(local_cache._entries)}"
+    yield "# TYPE cache_l1_bytes gauge"
+    yield f"cache_l1_bytes {local_cache.total_bytes}"
+    yield "# TYPE cache_l1_evictions_total counter"
+    yield f"cache_l1_evictions_total {local_cache.evictions}"
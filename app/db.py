@@ -1,18 +1,48 @@
 import asyncpg
+import itertools
 import uuid
+import decimal
 import bcrypt
 import logging
+import os
+from datetime import datetime, timedelta
+from app.pagination import clamp_page_size, encode_cursor, cursor_values, cursor_uuid
+from app import queries as q
+from app.queries import register_query
 
 logger = logging.getLogger(__name__)
 
+CATALOG_PAGE_SIZE = int(os.getenv("CATALOG_PAGE_SIZE", 24))
+CATALOG_MAX_PAGE_SIZE = int(os.getenv("CATALOG_MAX_PAGE_SIZE", 100))
+
+# Размер страницы списков в админке (товары, заказы)
+ADMIN_PAGE_SIZE = int(os.getenv("ADMIN_PAGE_SIZE", 50))
+ADMIN_MAX_PAGE_SIZE = int(os.getenv("ADMIN_MAX_PAGE_SIZE", 200))
+
+# Размер страницы отзывов на странице товара
+REVIEWS_PAGE_SIZE = int(os.getenv("REVIEWS_PAGE_SIZE", 10))
+REVIEWS_MAX_PAGE_SIZE = int(os.getenv("REVIEWS_MAX_PAGE_SIZE", 50))
+
+# Конфигурация полнотекстового поиска (должна совпадать с products.search_vector)
+SEARCH_TS_CONFIG = 'english'
+# Маркеры подсветки в snippet; в HTML их превращает фильтр highlight
+SNIPPET_START = '[[['
+SNIPPET_STOP = ']]]'
+
+register_query("get_all_products", """
+            SELECT product_id, name, description, price, stock, manufacturer
+            FROM products
+        """)
+
 async def get_all_products(pool):
     """
     Получить список всех продуктов.
     """
     async with pool.acquire() as conn:
-        return await conn.fetch("""
-            SELECT product_id, name, description, price, stock, manufacturer
-            FROM products
+        return await q.fetch(conn, "get_all_products")
+
+register_query("get_role_id_by_name", """
+            SELECT role_id FROM roles WHERE name = $1
         """)
 
 async def get_role_id_by_name(pool: asyncpg.pool.Pool, role_name: str) -> int:
@@ -20,146 +50,244 @@ async def get_role_id_by_name(pool: asyncpg.pool.Pool, role_name: str) -> int:
     Получить ID роли по её имени.
     """
     async with pool.acquire() as conn:
-        role_id = await conn.fetchval("""
-            SELECT role_id FROM roles WHERE name = $1
-        """, role_name)
+        role_id = await q.fetchval(conn, "get_role_id_by_name", role_name)
         if not role_id:
             logger.error(f"Роль с именем {role_name} не найдена.")
         return role_id
 
+register_query("get_user_roles", """
+            SELECT r.name
+            FROM user_roles ur
+            JOIN roles r ON ur.role_id = r.role_id
+            WHERE ur.user_id = $1
+        """)
+
 async def get_user_roles(pool: asyncpg.pool.Pool, user_id: str):
     """
     Получить список ролей пользователя.
     """
     async with pool.acquire() as conn:
-        roles = await conn.fetch("""
-            SELECT r.name
-            FROM user_roles ur
-            JOIN roles r ON ur.role_id = r.role_id
-            WHERE ur.user_id = $1
-        """, user_id)
+        roles = await q.fetch(conn, "get_user_roles", user_id)
         return [role['name'] for role in roles]
 
-async def get_user_by_id(pool: asyncpg.pool.Pool, user_id: str):
+register_query("delete_user_roles", """
+            DELETE FROM user_roles WHERE user_id = $1
+        """)
+
+register_query("insert_user_roles_by_name", """
+            INSERT INTO user_roles (user_id, role_id)
+            SELECT $1, role_id FROM roles WHERE name = ANY($2::text[])
+            RETURNING role_id
+        """)
+
+async def set_user_roles(pool: asyncpg.pool.Pool, user_id: str, role_names: list):
     """
-    Получить информацию о пользователе по user_id.
+    Заменить роли пользователя набором role_names (одной транзакцией).
+    ValueError — если какой-то роли нет. После вызова нужно увеличить версию
+    ролей (auth_token_utils.bump_roles_version), иначе токены сохранят старые роли.
     """
+    role_names = sorted(set(role_names))
     async with pool.acquire() as conn:
-        return await conn.fetchrow("""
+        async with conn.transaction():
+            await q.execute(conn, "delete_user_roles", user_id)
+            inserted = await q.fetch(conn, "insert_user_roles_by_name", user_id, role_names)
+            if len(inserted) != len(role_names):
+                raise ValueError(f"Неизвестная роль среди: {', '.join(role_names)}")
+
+register_query("get_user_by_id", """
             SELECT username, email
             FROM users
             WHERE user_id = $1
-        """, user_id)
+        """)
 
-async def create_user(pool: asyncpg.pool.Pool, username: str, hashed_password: str, email: str):
+async def get_user_by_id(pool: asyncpg.pool.Pool, user_id: str):
     """
-    Создать нового пользователя и вернуть его user_id.
+    Получить информацию о пользователе по user_id.
     """
-    user_id = uuid.uuid4()
     async with pool.acquire() as conn:
-        await conn.execute("""
+        return await q.fetchrow(conn, "get_user_by_id", user_id)
+
+register_query("insert_user", """
             INSERT INTO users (user_id, username, hashed_password, email)
             VALUES ($1, $2, $3, $4)
-        """, user_id, username, hashed_password, email)
+        """)
 
-        role_id = await get_role_id_by_name(pool, "User")
-        await conn.execute("""
+register_query("insert_user_role", """
             INSERT INTO user_roles (user_id, role_id)
             VALUES ($1, $2)
-        """, user_id, role_id)
+        """)
+
+async def create_user(pool: asyncpg.pool.Pool, username: str, hashed_password: str, email: str):
+    """
+    Создать нового пользователя и вернуть его user_id.
+    """
+    user_id = uuid.uuid4()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await q.execute(conn, "insert_user", user_id, username, hashed_password, email)
+
+            # Роль читаем на том же соединении, не занимая второе из пула
+            role_id = await q.fetchval(conn, "get_role_id_by_name", "User")
+            await q.execute(conn, "insert_user_role", user_id, role_id)
     return user_id
 
+register_query("get_user_by_email", """
+            SELECT * FROM users WHERE email = $1
+        """)
+
 async def get_user_by_email(pool: asyncpg.pool.Pool, email: str):
     """
     Получить пользователя по email.
     """
     async with pool.acquire() as conn:
-        return await conn.fetchrow("""
-            SELECT * FROM users WHERE email = $1
-        """, email)
+        return await q.fetchrow(conn, "get_user_by_email", email)
+
+register_query("get_product_by_id", """
+            SELECT product_id, name, description, category_id, price, stock, manufacturer
+            FROM products
+            WHERE product_id = $1
+        """)
 
 async def get_product_by_id(pool: asyncpg.pool.Pool, product_id: str):
     """
     Получить информацию о продукте по его ID.
     """
     async with pool.acquire() as conn:
-        return await conn.fetchrow("""
-            SELECT * FROM products WHERE product_id = $1
-        """, product_id)
+        return await q.fetchrow(conn, "get_product_by_id", product_id)
 
 async def add_to_cart(pool: asyncpg.pool.Pool, user_id: str, product_id: str, quantity: int):
     """
     Добавить товар в корзину пользователя.
+    Возвращает список ошибок (см. apply_cart_changes).
     """
-    async with pool.acquire() as conn:
-        # Проверяем, есть ли уже этот товар в корзине пользователя
-        existing = await conn.fetchrow("""
-            SELECT quantity FROM cart WHERE user_id = $1 AND product_id = $2
-        """, user_id, product_id)
+    return await apply_cart_changes(pool, user_id, {product_id: quantity}, mode='add')
 
-        if existing:
-            # Обновляем количество товара в корзине
-            await conn.execute("""
-                UPDATE cart SET quantity = quantity + $1 WHERE user_id = $2 AND product_id = $3
-            """, quantity, user_id, product_id)
-        else:
-            # Добавляем новый товар в корзину
-            await conn.execute("""
-                INSERT INTO cart (user_id, product_id, quantity)
-                VALUES ($1, $2, $3)
-            """, user_id, product_id, quantity)
+register_query("get_cart_items", """
+            SELECT product_id, name, description, price, stock, quantity, total_cost
+            FROM cart_details
+            WHERE user_id = $1
+        """)
 
 async def get_cart_items(pool: asyncpg.pool.Pool, user_id: str):
     """
     Получить все товары в корзине пользователя.
     """
     async with pool.acquire() as conn:
-        return await conn.fetch("""
-            SELECT product_id, name, description, price, stock, quantity, total_cost
-            FROM cart_details
-            WHERE user_id = $1
-        """, user_id)
+        return await q.fetch(conn, "get_cart_items", user_id)
+
+register_query("remove_from_cart", """
+            DELETE FROM cart WHERE user_id = $1 AND product_id = $2
+        """)
 
 async def remove_from_cart(pool: asyncpg.pool.Pool, user_id: str, product_id: str):
     """
     Удалить товар из корзины пользователя.
     """
     async with pool.acquire() as conn:
-        await conn.execute("""
-            DELETE FROM cart WHERE user_id = $1 AND product_id = $2
-        """, user_id, product_id)
+        await q.execute(conn, "remove_from_cart", user_id, product_id)
 
 async def update_cart_quantities(pool: asyncpg.pool.Pool, user_id: str, quantities: dict):
     """
     Обновить количество товаров в корзине пользователя.
+    Возвращает список ошибок (см. apply_cart_changes).
+    """
+    return await apply_cart_changes(pool, user_id, quantities, mode='set')
+
+# Массовое изменение корзины одним запросом.
+# {source} — выборка (product_id, quantity) с изменениями; $1 — user_id, $2 — режим 'add'.
+# В режиме 'add' quantity прибавляется к текущему количеству, в режиме 'set' — заменяет его,
+# quantity <= 0 в режиме 'set' удаляет товар из корзины.
+# Запрос возвращает только строки, которые применить не удалось.
+CART_CHANGES_SQL = """
+    WITH input AS (
+        {source}
+    ),
+    checked AS (
+        SELECT i.product_id,
+               i.quantity,
+               p.stock,
+               p.product_id IS NULL AS missing,
+               CASE WHEN $2 THEN COALESCE(c.quantity, 0) + i.quantity ELSE i.quantity END AS new_quantity
+        FROM input i
+        LEFT JOIN products p ON p.product_id = i.product_id
+        LEFT JOIN cart c ON c.user_id = $1 AND c.product_id = i.product_id
+    ),
+    deleted AS (
+        DELETE FROM cart c
+        USING checked ch
+        WHERE c.user_id = $1 AND c.product_id = ch.product_id AND ch.new_quantity <= 0
+        RETURNING c.product_id
+    ),
+    upserted AS (
+        INSERT INTO cart (user_id, product_id, quantity)
+        SELECT $1, ch.product_id, ch.quantity
+        FROM checked ch
+        WHERE NOT ch.missing AND ch.new_quantity > 0 AND ch.new_quantity <= ch.stock
+        ON CONFLICT (user_id, product_id) DO UPDATE
+        SET quantity = CASE WHEN $2 THEN cart.quantity + EXCLUDED.quantity ELSE EXCLUDED.quantity END
+        RETURNING product_id
+    )
+    SELECT ch.product_id, ch.new_quantity AS requested, ch.stock AS available,
+           CASE WHEN ch.missing THEN 'not_found' ELSE 'insufficient_stock' END AS reason
+    FROM checked ch
+    WHERE ch.missing OR (ch.new_quantity > 0 AND ch.new_quantity > ch.stock)
+"""
+
+register_query("apply_cart_changes", CART_CHANGES_SQL.format(source="""
+        SELECT * FROM unnest($3::uuid[], $4::int[]) AS t(product_id, quantity)
+"""))
+
+register_query("repeat_order_to_cart", CART_CHANGES_SQL.format(source="""
+        SELECT oi.product_id, oi.quantity
+        FROM order_items oi
+        JOIN orders o ON o.order_id = oi.order_id
+        WHERE oi.order_id = $3 AND o.user_id = $1
+"""))
+
+async def apply_cart_changes(pool: asyncpg.pool.Pool, user_id: str, changes: dict, mode: str = 'set') -> list[dict]:
+    """
+    Применить набор изменений корзины {product_id: quantity} одним запросом.
+
+    mode='set' — установить количество (<= 0 — удалить товар), mode='add' — прибавить.
+    Ошибки не прерывают остальные изменения: возвращается список
+    {"product_id", "requested", "available", "reason"}, где reason —
+    'invalid' (некорректный ID или количество), 'not_found' или 'insufficient_stock'.
     """
+    if mode not in ('set', 'add'):
+        raise ValueError("Параметр mode должен быть 'set' или 'add'.")
+
+    failures = []
+    # Разные написания одного UUID (регистр, фигурные скобки) — один товар:
+    # побеждает последнее значение, иначе ON CONFLICT затронул бы строку дважды
+    parsed = {}
+    for product_id, quantity in changes.items():
+        try:
+            product_uuid = uuid.UUID(str(product_id))
+            quantity = int(quantity)
+        except (TypeError, ValueError):
+            failures.append({"product_id": product_id, "requested": quantity, "available": None, "reason": "invalid"})
+            continue
+        parsed.pop(product_uuid, None)
+        parsed[product_uuid] = quantity
+
+    if not parsed:
+        return failures
+
     async with pool.acquire() as conn:
-        async with conn.transaction():
-            for product_id, quantity in quantities.items():
-                quantity = int(quantity)
-                if quantity <= 0:
-                    # Удаляем товар из корзины, если количество <= 0
-                    await conn.execute("""
-                        DELETE FROM cart WHERE user_id = $1 AND product_id = $2
-                    """, user_id, product_id)
-                else:
-                    # Проверяем доступность товара на складе
-                    stock = await conn.fetchval("""
-                        SELECT stock FROM products WHERE product_id = $1
-                    """, product_id)
-                    if quantity > stock:
-                        raise ValueError(f"Недостаточно товара на складе для продукта {product_id}")
-                    await conn.execute("""
-                        UPDATE cart SET quantity = $1 WHERE user_id = $2 AND product_id = $3
-                    """, quantity, user_id, product_id)
+        rows = await q.fetch(conn, "apply_cart_changes", user_id, mode == 'add', list(parsed), list(parsed.values()))
+    return failures + [dict(row) for row in rows]
 
-async def get_last_orders(pool: asyncpg.pool.Pool, user_id: str):
+async def repeat_order_to_cart(pool: asyncpg.pool.Pool, user_id: str, order_id: str) -> list[dict]:
     """
-    Получить последние пять заказов пользователя.
+    Добавить в корзину все товары заказа пользователя одним запросом.
+    Возвращает список ошибок (см. apply_cart_changes).
     """
     async with pool.acquire() as conn:
-        return await conn.fetch("""
-            SELECT o.order_id, o.order_date, o.total_cost, ARRAY(
+        rows = await q.fetch(conn, "repeat_order_to_cart", user_id, True, order_id)
+    return [dict(row) for row in rows]
+
+register_query("get_last_orders", """
+            SELECT o.order_id, o.order_date, o.total_cost, o.status, ARRAY(
                 SELECT p.name
                 FROM order_items oi
                 JOIN products p ON oi.product_id = p.product_id
@@ -169,202 +297,698 @@ async def get_last_orders(pool: asyncpg.pool.Pool, user_id: str):
             WHERE o.user_id = $1
             ORDER BY o.order_date DESC
             LIMIT 5
-        """, user_id)
+        """)
 
+async def get_last_orders(pool: asyncpg.pool.Pool, user_id: str):
+    """
+    Получить последние пять заказов пользователя.
+    """
+    async with pool.acquire() as conn:
+        return await q.fetch(conn, "get_last_orders", user_id)
+
+
+# Событие new_order пишется в order_outbox тем же оператором, что и заказ
+register_query("process_order", """
+            WITH placed AS (
+                SELECT checkout_user_order($1::uuid) AS order_id
+            ), event AS (
+                INSERT INTO order_outbox (payload)
+                SELECT jsonb_build_object('type', 'new_order', 'order_id', order_id, 'user_id', $1::uuid)
+                FROM placed
+            )
+            SELECT order_id FROM placed
+        """)
 
 async def process_order(pool: asyncpg.pool.Pool, user_id: str):
+    """
+    Оформить заказ из корзины пользователя и вернуть его order_id.
+    Событие new_order попадает в order_outbox в той же транзакции.
+    """
     async with pool.acquire() as conn:
-        # Вызов хранимой процедуры, которая сама проведет все операции
-        await conn.execute("CALL process_user_order($1)", user_id)
+        # Вызов хранимой функции, которая сама проведет все операции
+        return await q.fetchval(conn, "process_order", user_id)
 
-async def add_product(pool, name, description, price, stock, manufacturer, category_id=None):
+register_query("get_order_product_ids", """
+            SELECT product_id FROM order_items WHERE order_id = $1
+        """)
+
+async def get_order_product_ids(pool: asyncpg.pool.Pool, order_id) -> list:
+    """
+    Товары заказа (для сброса кеша карточек после списания остатков).
+    """
     async with pool.acquire() as conn:
-        await conn.execute("""
+        rows = await q.fetch(conn, "get_order_product_ids", order_id)
+    return [row['product_id'] for row in rows]
+
+register_query("add_product", """
             INSERT INTO products (product_id, name, description, price, stock, manufacturer, category_id)
             VALUES (uuid_generate_v4(), $1, $2, $3, $4, $5, $6)
-        """, name, description, price, stock, manufacturer, category_id)
+        """)
 
-async def update_product(pool, product_id, name, description, price, stock, manufacturer, category_id=None):
+async def add_product(pool, name, description, price, stock, manufacturer, category_id=None):
     async with pool.acquire() as conn:
-        await conn.execute("""
+        await q.execute(conn, "add_product", name, description, price, stock, manufacturer, category_id)
+
+register_query("update_product", """
             UPDATE products
             SET name = $1, description = $2, price = $3, stock = $4, manufacturer = $5, category_id = $6
             WHERE product_id = $7
-        """, name, description, price, stock, manufacturer, category_id, product_id)
+            RETURNING product_id
+        """)
 
-async def delete_product(pool, product_id):
+async def update_product(pool, product_id, name, description, price, stock, manufacturer, category_id=None) -> bool:
+    """
+    Обновить товар. Возвращает False, если товара нет.
+    """
     async with pool.acquire() as conn:
-        await conn.execute("""
+        return await q.fetchval(conn, "update_product", name, description, price, stock, manufacturer, category_id, product_id) is not None
+
+register_query("delete_product", """
             DELETE FROM products WHERE product_id = $1
-        """, product_id)
+        """)
 
-async def get_all_products_with_categories(pool):
+async def delete_product(pool, product_id):
     async with pool.acquire() as conn:
-        return await conn.fetch("""
-            SELECT p.*, c.name AS category_name
+        await q.execute(conn, "delete_product", product_id)
+
+# Сортируемые столбцы сетки товаров в админке: выражение (под него есть индекс
+# вида (выражение, product_id)) и приведение значения из курсора к типу столбца
+ADMIN_PRODUCT_SORTS = {
+    'name': ("p.name", str),
+    'price': ("p.price", decimal.Decimal),
+    'stock': ("p.stock", int),
+    'manufacturer': ("COALESCE(p.manufacturer, '')", str),
+}
+
+def _admin_products_sql(sort: str, descending: bool, has_category: bool, has_manufacturer: bool,
+                        has_max_stock: bool, has_after: bool) -> str:
+    """
+    Текст запроса сетки товаров для заданной сортировки и набора фильтров.
+    Параметры идут в порядке: категория, производитель, порог остатка,
+    ключ предыдущей страницы (2 значения), лимит.
+    """
+    column = ADMIN_PRODUCT_SORTS[sort][0]
+    conditions = []
+    n = 0
+    if has_category:
+        n += 1
+        conditions.append(f"p.category_id = ${n}::uuid")
+    if has_manufacturer:
+        n += 1
+        conditions.append(f"p.manufacturer ILIKE ${n}")
+    if has_max_stock:
+        n += 1
+        conditions.append(f"p.stock <= ${n}")
+    if has_after:
+        conditions.append(f"({column}, p.product_id) {'<' if descending else '>'} (${n + 1}, ${n + 2}::uuid)")
+        n += 2
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    direction = "DESC" if descending else "ASC"
+    return f"""
+            SELECT p.product_id, p.name, p.description, p.category_id, c.name AS category_name,
+                   p.price, p.stock, p.manufacturer, {column} AS sort_key
             FROM products p
             LEFT JOIN categories c ON p.category_id = c.category_id
-            ORDER BY p.name
-        """)
+            {where}
+            ORDER BY {column} {direction}, p.product_id {direction}
+            LIMIT ${n + 1}
+        """
+
+def _admin_products_query_name(sort: str, descending: bool, *flags: bool) -> str:
+    names = [name for name, enabled in zip(("category", "manufacturer", "max_stock", "after"), flags) if enabled]
+    return f"admin_products:{sort}:{'desc' if descending else 'asc'}[{','.join(names)}]"
 
-async def get_all_orders(pool):
+# 128 вариантов сетки — подготавливаются при первом использовании
+for _sort in ADMIN_PRODUCT_SORTS:
+    for _descending, *_flags in itertools.product((False, True), repeat=5):
+        register_query(
+            _admin_products_query_name(_sort, _descending, *_flags),
+            _admin_products_sql(_sort, _descending, *_flags),
+            lazy=True
+        )
+
+async def get_admin_products_page(
+    pool: asyncpg.pool.Pool,
+    sort: str = 'name',
+    descending: bool = False,
+    category_id: str = '',
+    manufacturer: str = '',
+    max_stock: int | None = None,
+    after: list | None = None,
+    limit: int = ADMIN_PAGE_SIZE
+):
+    """
+    Страница сетки товаров в админке с сортировкой по столбцу из ADMIN_PRODUCT_SORTS
+    и фильтрами по категории, производителю (подстрока) и остатку (не больше max_stock).
+
+    Выдача постраничная (keyset): `after` — ключ последнего товара предыдущей страницы.
+    Возвращает кортеж (товары, курсор следующей страницы или None).
+    Неподходящий курсор — InvalidCursor (ValueError).
+    """
+    if sort not in ADMIN_PRODUCT_SORTS:
+        raise ValueError(f"Недопустимый столбец сортировки: {sort}")
+    limit = clamp_page_size(limit, ADMIN_PAGE_SIZE, ADMIN_MAX_PAGE_SIZE)
+
+    params = []
+    if category_id:
+        params.append(str(uuid.UUID(category_id)))
+    if manufacturer:
+        params.append(f"%{manufacturer}%")
+    if max_stock is not None:
+        params.append(int(max_stock))
+    if after:
+        params.extend(cursor_values(after, ADMIN_PRODUCT_SORTS[sort][1], cursor_uuid))
+    params.append(limit + 1)
+
+    name = _admin_products_query_name(
+        sort, descending, bool(category_id), bool(manufacturer), max_stock is not None, bool(after)
+    )
     async with pool.acquire() as conn:
-        return await conn.fetch("""
-            SELECT o.order_id, o.user_id, u.username, o.total_cost, o.order_date, o.status
+        rows = await q.fetch(conn, name, *params)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['sort_key'], rows[-1]['product_id'])
+    return [dict(row) for row in rows], next_cursor
+
+# Допустимые статусы заказа
+ORDER_STATUSES = ('Pending', 'Processing', 'Shipped', 'Delivered', 'Cancelled')
+
+def _admin_orders_sql(has_status: bool, has_from: bool, has_to: bool, has_email: bool, has_after: bool) -> str:
+    """
+    Текст запроса консоли заказов для заданного набора фильтров.
+    Параметры идут в порядке: статус, начало периода, конец периода (не включая),
+    email, ключ предыдущей страницы (2 значения), лимит.
+    """
+    conditions = []
+    n = 0
+    if has_status:
+        n += 1
+        conditions.append(f"o.status = ${n}")
+    if has_from:
+        n += 1
+        conditions.append(f"o.order_date >= ${n}")
+    if has_to:
+        n += 1
+        conditions.append(f"o.order_date < ${n}")
+    if has_email:
+        n += 1
+        conditions.append(f"u.email = ${n}")
+    if has_after:
+        conditions.append(f"(o.order_date, o.order_id) < (${n + 1}, ${n + 2}::uuid)")
+        n += 2
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f"""
+            SELECT o.order_id, o.user_id, u.username, u.email, o.total_cost, o.order_date, o.status
             FROM orders o
             JOIN users u ON o.user_id = u.user_id
-            ORDER BY o.order_date DESC
+            {where}
+            ORDER BY o.order_date DESC, o.order_id DESC
+            LIMIT ${n + 1}
+        """
+
+def _admin_orders_query_name(*flags: bool) -> str:
+    names = [name for name, enabled in zip(("status", "from", "to", "email", "after"), flags) if enabled]
+    return f"admin_orders[{','.join(names)}]"
+
+for _flags in itertools.product((False, True), repeat=5):
+    register_query(_admin_orders_query_name(*_flags), _admin_orders_sql(*_flags), lazy=True)
+
+async def get_admin_orders_page(
+    pool: asyncpg.pool.Pool,
+    status: str = '',
+    date_from=None,
+    date_to=None,
+    email: str = '',
+    after: list | None = None,
+    limit: int = ADMIN_PAGE_SIZE
+):
+    """
+    Страница консоли заказов, новые первыми, с фильтрами по статусу,
+    периоду (date_from и date_to включительно, тип date) и email покупателя.
+
+    Выдача постраничная (keyset) по (order_date, order_id): `after` — ключ
+    последнего заказа предыдущей страницы.
+    Возвращает кортеж (заказы, курсор следующей страницы или None).
+    Неподходящий курсор — InvalidCursor (ValueError).
+    """
+    if status and status not in ORDER_STATUSES:
+        raise ValueError(f"Недопустимый статус заказа: {status}")
+    limit = clamp_page_size(limit, ADMIN_PAGE_SIZE, ADMIN_MAX_PAGE_SIZE)
+
+    params = []
+    if status:
+        params.append(status)
+    if date_from:
+        params.append(datetime.combine(date_from, datetime.min.time()))
+    if date_to:
+        params.append(datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
+    if email:
+        params.append(email)
+    if after:
+        params.extend(cursor_values(after, datetime.fromisoformat, cursor_uuid))
+    params.append(limit + 1)
+
+    name = _admin_orders_query_name(bool(status), bool(date_from), bool(date_to), bool(email), bool(after))
+    async with pool.acquire() as conn:
+        rows = await q.fetch(conn, name, *params)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['order_date'].isoformat(), rows[-1]['order_id'])
+    return rows, next_cursor
+
+# Одно событие status_changed на всю операцию (если что-то изменилось);
+# user_ids[i] — покупатель заказа order_ids[i] (для уведомлений в браузер)
+register_query("update_orders_status", """
+            WITH updated AS (
+                UPDATE orders
+                SET status = $1
+                WHERE order_id = ANY($2::uuid[]) AND status <> $1
+                RETURNING order_id, user_id
+            ), event AS (
+                INSERT INTO order_outbox (payload)
+                SELECT jsonb_build_object(
+                    'type', 'status_changed',
+                    'order_ids', array_agg(order_id ORDER BY order_id),
+                    'user_ids', array_agg(user_id ORDER BY order_id),
+                    'new_status', $1
+                )
+                FROM updated
+                HAVING count(*) > 0
+            )
+            SELECT order_id FROM updated
         """)
 
-async def update_order_status(pool, order_id, new_status):
+async def update_orders_status(pool: asyncpg.pool.Pool, order_ids: list, new_status: str) -> list:
+    """
+    Изменить статус нескольких заказов одним запросом.
+    Заказы, у которых статус уже такой, не трогаются (и не попадают в историю).
+    Событие status_changed попадает в order_outbox в той же транзакции.
+    Возвращает идентификаторы изменённых заказов. Неверный номер заказа — ValueError.
+    """
+    if new_status not in ORDER_STATUSES:
+        raise ValueError(f"Недопустимый статус заказа: {new_status}")
+    try:
+        order_ids = [str(uuid.UUID(order_id)) for order_id in order_ids]
+    except (TypeError, ValueError, AttributeError) as e:
+        raise ValueError(f"Неверный номер заказа: {e}") from e
     async with pool.acquire() as conn:
-        await conn.execute("""
-            UPDATE orders SET status = $1 WHERE order_id = $2
-        """, new_status, order_id)
+        rows = await q.fetch(conn, "update_orders_status", new_status, order_ids)
+    return [row['order_id'] for row in rows]
 
-async def add_review(pool: asyncpg.pool.Pool, product_id: str, user_id: str, rating: int, comment: str):
+register_query("lock_order_outbox", """
+            SELECT pg_try_advisory_xact_lock(hashtext('order_outbox'))
+        """)
+
+register_query("fetch_order_outbox", """
+            SELECT event_id, payload::text AS payload
+            FROM order_outbox
+            ORDER BY event_id
+            LIMIT $1
+        """)
+
+register_query("delete_order_outbox", """
+            DELETE FROM order_outbox WHERE event_id = ANY($1::bigint[])
+        """)
+
+async def drain_order_outbox(pool: asyncpg.pool.Pool, limit: int, publish) -> int:
     """
-    Добавить отзыв к товару.
+    Передать следующую пачку событий из order_outbox (JSON-строки в порядке event_id)
+    в async publish(payloads) и удалить их в той же транзакции.
+    Если publish упал, события остаются и будут переданы повторно.
+    Разбирает очередь только один процесс за раз (advisory lock), иначе
+    пачки разных процессов могли бы попасть в поток вперемешку.
+    Возвращает число переданных событий (0 — очередь пуста или занята).
+    """
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            if not await q.fetchval(conn, "lock_order_outbox"):
+                return 0
+            rows = await q.fetch(conn, "fetch_order_outbox", limit)
+            if not rows:
+                return 0
+            await publish([row['payload'] for row in rows])
+            await q.execute(conn, "delete_order_outbox", [row['event_id'] for row in rows])
+    return len(rows)
+
+register_query("get_order_outbox_stats", """
+            SELECT count(*) AS pending,
+                   EXTRACT(EPOCH FROM NOW() - min(created_at))::float8 AS oldest_age_seconds
+            FROM order_outbox
+        """)
+
+async def get_order_outbox_stats(pool: asyncpg.pool.Pool) -> dict:
+    """
+    Число неотправленных событий в order_outbox и возраст самого старого (секунды).
     """
     async with pool.acquire() as conn:
-        await conn.execute("""
+        return dict(await q.fetchrow(conn, "get_order_outbox_stats"))
+
+register_query("add_review", """
             INSERT INTO reviews (product_id, user_id, rating, comment)
             VALUES ($1, $2, $3, $4)
-        """, product_id, user_id, rating, comment)
+        """)
 
-async def get_reviews_by_product_id(pool: asyncpg.pool.Pool, product_id: str):
+async def add_review(pool: asyncpg.pool.Pool, product_id: str, user_id: str, rating: int, comment: str):
     """
-    Получить все отзывы для данного товара.
+    Добавить отзыв к товару.
     """
     async with pool.acquire() as conn:
-        return await conn.fetch("""
-            SELECT r.*, u.username
+        await q.execute(conn, "add_review", product_id, user_id, rating, comment)
+
+REVIEWS_PAGE_SQL = """
+            SELECT r.review_id, r.rating, r.comment, r.review_date, u.username
             FROM reviews r
             JOIN users u ON r.user_id = u.user_id
-            WHERE r.product_id = $1
-            ORDER BY r.review_date DESC
-        """, product_id)
+            WHERE r.product_id = $1{after}
+            ORDER BY r.review_date DESC, r.review_id DESC
+            LIMIT {limit}
+        """
+
+register_query("get_reviews_page", REVIEWS_PAGE_SQL.format(after="", limit="$2"))
+register_query("get_reviews_page:after", REVIEWS_PAGE_SQL.format(
+    after=" AND (r.review_date, r.review_id) < ($2, $3)", limit="$4"
+))
+
+async def get_reviews_page(
+    pool: asyncpg.pool.Pool,
+    product_id: str,
+    after: list | None = None,
+    limit: int = REVIEWS_PAGE_SIZE
+):
+    """
+    Страница отзывов о товаре, новые первыми.
+
+    Выдача постраничная (keyset) по (review_date, review_id): `after` — ключ
+    последнего отзыва предыдущей страницы (из курсора).
+    Возвращает кортеж (отзывы, курсор следующей страницы или None).
+    Неподходящий курсор — InvalidCursor (ValueError).
+    """
+    limit = clamp_page_size(limit, REVIEWS_PAGE_SIZE, REVIEWS_MAX_PAGE_SIZE)
+    async with pool.acquire() as conn:
+        if after:
+            review_date, review_id = cursor_values(after, datetime.fromisoformat, uuid.UUID)
+            rows = await q.fetch(conn, "get_reviews_page:after", product_id, review_date, review_id, limit + 1)
+        else:
+            rows = await q.fetch(conn, "get_reviews_page", product_id, limit + 1)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['review_date'].isoformat(), rows[-1]['review_id'])
+    return [dict(row) for row in rows], next_cursor
+
+register_query("get_average_rating", """
+            SELECT rating_sum::numeric / NULLIF(rating_count, 0)
+            FROM product_ratings
+            WHERE product_id = $1
+        """)
 
 async def get_average_rating(pool: asyncpg.pool.Pool, product_id: str):
+    """
+    Средняя оценка товара по агрегатам product_ratings (None, если отзывов нет).
+    """
     async with pool.acquire() as conn:
-        return await conn.fetchval("""
-            SELECT get_average_product_rating($1)
-        """, product_id)
+        return await q.fetchval(conn, "get_average_rating", product_id)
+
+register_query("get_product_rating", """
+            SELECT rating_count,
+                   rating_sum::numeric / NULLIF(rating_count, 0) AS average_rating,
+                   ARRAY[rating_5, rating_4, rating_3, rating_2, rating_1] AS histogram
+            FROM product_ratings
+            WHERE product_id = $1
+        """)
 
-async def search_products(pool: asyncpg.pool.Pool, query: str = '', category_id: str = '', manufacturer: str = ''):
+async def get_product_rating(pool: asyncpg.pool.Pool, product_id: str) -> dict | None:
     """
-    Поиск товаров по названию, описанию, категории (UUID) и производителю.
+    Число отзывов, средняя оценка и распределение оценок товара
+    (histogram — число оценок от 5 до 1). None, если агрегата ещё нет.
     """
     async with pool.acquire() as conn:
-        sql = """
+        row = await q.fetchrow(conn, "get_product_rating", product_id)
+    return dict(row) if row else None
+
+def _search_products_sql(has_query: bool, has_category: bool, has_manufacturer: bool, has_after: bool) -> str:
+    """
+    Текст запроса поиска для заданного набора фильтров.
+    Параметры идут в порядке: ключевое слово, категория, производитель,
+    ключ предыдущей страницы (2 значения), лимит.
+    """
+    conditions = []
+    params = 0
+
+    def param():
+        nonlocal params
+        params += 1
+        return f"${params}"
+
+    # Фильтр по ключевому слову
+    if has_query:
+        kw = param()
+        conditions.append(
+            f"(p.search_vector @@ websearch_to_tsquery('{SEARCH_TS_CONFIG}', {kw})"
+            f" OR p.name % {kw} OR p.name ILIKE '%' || {kw} || '%')"
+        )
+
+    # Фильтр по категории (UUID)
+    if has_category:
+        conditions.append(f"p.category_id = {param()}::uuid")
+
+    # Фильтр по производителю
+    if has_manufacturer:
+        conditions.append(f"p.manufacturer ILIKE {param()}")
+
+    where = " AND ".join(conditions) or "TRUE"
+
+    if has_query:
+        rank = (
+            f"ts_rank_cd(p.search_vector, websearch_to_tsquery('{SEARCH_TS_CONFIG}', $1))"
+            f" + similarity(p.name, $1)"
+        )
+        keyset = ""
+        if has_after:
+            # Продолжаем с места, где закончилась предыдущая страница
+            keyset = f"WHERE (s.rank, s.product_id) < ({param()}::float8, {param()}::uuid)"
+        # Берём на одну строку больше, чтобы понять, есть ли следующая страница
+        page_limit = param()
+        # Подсветку считаем только для строк текущей страницы
+        return f"""
+            SELECT s.*, ts_headline(
+                '{SEARCH_TS_CONFIG}', coalesce(s.description, ''),
+                websearch_to_tsquery('{SEARCH_TS_CONFIG}', $1),
+                'StartSel="{SNIPPET_START}", StopSel="{SNIPPET_STOP}", MaxWords=25, MinWords=10, MaxFragments=2'
+            ) AS snippet
+            FROM (
+                SELECT *
+                FROM (
+                    SELECT p.product_id, p.name, p.description, p.price, p.stock, p.manufacturer,
+                           c.name AS category_name, ({rank})::float8 AS rank
+                    FROM products p
+                    LEFT JOIN categories c ON p.category_id = c.category_id
+                    WHERE {where}
+                ) s
+                {keyset}
+                ORDER BY s.rank DESC, s.product_id DESC
+                LIMIT {page_limit}
+            ) s
+            ORDER BY s.rank DESC, s.product_id DESC
+        """
+
+    if has_after:
+        # Продолжаем с места, где закончилась предыдущая страница
+        where += f" AND (p.name, p.product_id) > ({param()}, {param()}::uuid)"
+    page_limit = param()
+    return f"""
             SELECT p.product_id, p.name, p.description, p.price, p.stock, p.manufacturer, c.name AS category_name
             FROM products p
             LEFT JOIN categories c ON p.category_id = c.category_id
-            WHERE TRUE
+            WHERE {where}
+            ORDER BY p.name, p.product_id
+            LIMIT {page_limit}
         """
-        params = []
-        param_index = 1
-
-        # Фильтр по ключевому слову
-        if query:
-            sql += f" AND (p.name ILIKE '%' || ${param_index} || '%' OR p.description ILIKE '%' || ${param_index} || '%')"
-            params.append(query)
-            param_index += 1
-
-        # Фильтр по категории (UUID)
-        if category_id:
-            try:
-                category_uuid = str(uuid.UUID(category_id))  # Проверка и преобразование в UUID
-                sql += f" AND p.category_id = ${param_index}"
-                params.append(category_uuid)  # Добавляем строку UUID
-                param_index += 1
-            except ValueError:
-                raise ValueError(f"Неверный формат UUID для category_id: {category_id}")
-
-        # Фильтр по производителю
-        if manufacturer:
-            sql += f" AND p.manufacturer ILIKE ${param_index}"
-            params.append(f"%{manufacturer}%")
-            param_index += 1
-
-        sql += " ORDER BY p.name"
-        return await conn.fetch(sql, *params)
 
+def _search_products_query_name(has_query: bool, has_category: bool, has_manufacturer: bool, has_after: bool) -> str:
+    flags = [
+        flag for flag, enabled in (
+            ("query", has_query), ("category", has_category),
+            ("manufacturer", has_manufacturer), ("after", has_after),
+        ) if enabled
+    ]
+    return f"search_products[{','.join(flags)}]"
 
-async def get_all_categories(pool: asyncpg.pool.Pool):
+# Все 16 комбинаций фильтров поиска — фиксированный набор подготовленных запросов
+for _flags in itertools.product((False, True), repeat=4):
+    register_query(_search_products_query_name(*_flags), _search_products_sql(*_flags))
+
+async def search_products(
+    pool: asyncpg.pool.Pool,
+    query: str = '',
+    category_id: str = '',
+    manufacturer: str = '',
+    after: list | None = None,
+    limit: int = CATALOG_PAGE_SIZE
+):
     """
-    Получить список всех категорий.
+    Поиск товаров по названию, описанию, категории (UUID) и производителю.
+
+    Без ключевого слова товары упорядочены по (name, product_id).
+    С ключевым словом используется полнотекстовый поиск по search_vector
+    (название весит больше описания) и триграммный поиск по названию
+    (опечатки и подстроки); результаты упорядочены по релевантности
+    (rank, product_id) и содержат фрагмент описания с подсветкой (snippet).
+
+    Выдача постраничная (keyset): `after` — ключ последнего товара предыдущей страницы.
+    Возвращает кортеж (товары, курсор следующей страницы или None).
+    Неподходящий курсор — InvalidCursor (ValueError).
     """
+    limit = clamp_page_size(limit, CATALOG_PAGE_SIZE, CATALOG_MAX_PAGE_SIZE)
+
+    params = []
+    if query:
+        params.append(query)
+    if category_id:
+        try:
+            params.append(str(uuid.UUID(category_id)))  # Проверка и преобразование в UUID
+        except ValueError:
+            raise ValueError(f"Неверный формат UUID для category_id: {category_id}")
+    if manufacturer:
+        params.append(f"%{manufacturer}%")
+    if after:
+        params.extend(cursor_values(after, float if query else str, cursor_uuid))
+    # Берём на одну строку больше, чтобы понять, есть ли следующая страница
+    params.append(limit + 1)
+
+    name = _search_products_query_name(bool(query), bool(category_id), bool(manufacturer), bool(after))
     async with pool.acquire() as conn:
-        return await conn.fetch("""
+        rows = await q.fetch(conn, name, *params)
+
+    cursor_columns = ('rank', 'product_id') if query else ('name', 'product_id')
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(*(rows[-1][column] for column in cursor_columns))
+    return rows, next_cursor
+
+
+register_query("get_all_categories", """
             SELECT category_id, name
             FROM categories
             ORDER BY name
         """)
 
-async def get_all_manufacturers(pool: asyncpg.pool.Pool):
+async def get_all_categories(pool: asyncpg.pool.Pool):
     """
-    Получить список всех производителей.
+    Получить список всех категорий.
     """
     async with pool.acquire() as conn:
-        records = await conn.fetch("""
+        return await q.fetch(conn, "get_all_categories")
+
+register_query("get_all_manufacturers", """
             SELECT DISTINCT manufacturer
             FROM products
             WHERE manufacturer IS NOT NULL AND manufacturer != ''
             ORDER BY manufacturer
         """)
+
+async def get_all_manufacturers(pool: asyncpg.pool.Pool):
+    """
+    Получить список всех производителей.
+    """
+    async with pool.acquire() as conn:
+        records = await q.fetch(conn, "get_all_manufacturers")
         # Преобразуем список записей в список строк
         return [record['manufacturer'] for record in records]
 
 
-async def add_category(pool: asyncpg.pool.Pool, name: str):
-    async with pool.acquire() as conn:
-        await conn.execute("""
+register_query("add_category", """
             INSERT INTO categories (category_id, name)
             VALUES (uuid_generate_v4(), $1)
-        """, name)
+        """)
 
-async def update_category(pool: asyncpg.pool.Pool, category_id: str, name: str):
+async def add_category(pool: asyncpg.pool.Pool, name: str):
     async with pool.acquire() as conn:
-        await conn.execute("""
+        await q.execute(conn, "add_category", name)
+
+register_query("update_category", """
             UPDATE categories
             SET name = $1
             WHERE category_id = $2
-        """, name, category_id)
+        """)
 
-async def delete_category(pool: asyncpg.pool.Pool, category_id: str):
+async def update_category(pool: asyncpg.pool.Pool, category_id: str, name: str):
     async with pool.acquire() as conn:
-        await conn.execute("""
+        await q.execute(conn, "update_category", name, category_id)
+
+register_query("delete_category", """
             DELETE FROM categories WHERE category_id = $1
-        """, category_id)
+        """)
 
+async def delete_category(pool: asyncpg.pool.Pool, category_id: str):
+    async with pool.acquire() as conn:
+        await q.execute(conn, "delete_category", category_id)
 
-async def get_top_sales(pool: asyncpg.pool.Pool, start_date: str, end_date: str, limit: int) -> list[dict]:
+
+register_query("fold_sales_rollup_deltas", """
+            SELECT fold_sales_rollup_deltas($1)
+        """)
+
+async def fold_sales_rollup_deltas(pool: asyncpg.pool.Pool, limit: int) -> int:
     """
-    Получить топ X товаров по количеству продаж за указанный период.
+    Перенести накопленные изменения продаж (sales_rollup_delta) в дневные агрегаты.
+    Возвращает число перенесённых строк (0 — нечего переносить или переносит другой процесс).
     """
     async with pool.acquire() as conn:
-        rows = await conn.fetch("""
+        return await q.fetchval(conn, "fold_sales_rollup_deltas", limit)
+
+register_query("get_top_sales", """
             SELECT 
                 p.name AS product_name,
-                SUM(oi.quantity) AS total_quantity_sold,
-                SUM(oi.price * oi.quantity) AS total_revenue
+                SUM(s.quantity) AS total_quantity_sold,
+                SUM(s.revenue) AS total_revenue
             FROM 
-                order_items oi
+                sales_daily_product s
             JOIN 
-                products p ON oi.product_id = p.product_id
-            JOIN 
-                orders o ON oi.order_id = o.order_id
+                products p ON s.product_id = p.product_id
             WHERE 
-                o.order_date BETWEEN $1 AND $2
+                s.sale_date BETWEEN $1 AND $2
             GROUP BY 
                 p.name
             ORDER BY 
                 total_quantity_sold DESC
             LIMIT $3;
-        """, start_date, end_date, limit)
+        """)
+
+async def get_top_sales(pool: asyncpg.pool.Pool, start_date: str, end_date: str, limit: int) -> list[dict]:
+    """
+    Получить топ X товаров по количеству продаж за указанный период
+    (по дневным агрегатам sales_daily_product, включая обе границы).
+    """
+    async with pool.acquire() as conn:
+        rows = await q.fetch(conn, "get_top_sales", start_date, end_date, limit)
     return [dict(row) for row in rows]
 
+ANALYTICS_SQL = """
+            SELECT 
+                DATE_TRUNC('{group_by}', s.sale_date::timestamp) AS period,
+                SUM(s.revenue) AS total_revenue,
+                SUM(s.quantity) AS total_items_sold
+            FROM 
+                sales_daily_category s
+            WHERE 
+                s.sale_date BETWEEN $1 AND $2
+            GROUP BY 
+                period
+            ORDER BY 
+                period ASC;
+        """
+
+# Для каждого варианта группировки — свой подготовленный запрос
+for _group_by in ('day', 'month'):
+    register_query(f"get_analytics:{_group_by}", ANALYTICS_SQL.format(group_by=_group_by))
+
 async def get_analytics(
     pool: asyncpg.pool.Pool,
     start_date: str,
@@ -372,7 +996,8 @@ async def get_analytics(
     group_by: str = 'day'
 ) -> list[dict]:
     """
-    Получить аналитические данные за указанный период с группировкой.
+    Получить аналитические данные за указанный период с группировкой
+    (по дневным агрегатам sales_daily_category).
 
     :param pool: Пул соединений с базой данных.
     :param start_date: Начальная дата периода (YYYY-MM-DD).
@@ -383,49 +1008,34 @@ async def get_analytics(
     if group_by not in ['day', 'month']:
         raise ValueError("Параметр group_by должен быть 'day' или 'month'.")
 
-    group_by_clause = f"DATE_TRUNC('{group_by}', o.order_date)"
-
     async with pool.acquire() as conn:
-        rows = await conn.fetch(f"""
-            SELECT 
-                {group_by_clause} AS period,
-                SUM(oi.price * oi.quantity) AS total_revenue,
-                SUM(oi.quantity) AS total_items_sold
-            FROM 
-                orders o
-            JOIN 
-                order_items oi ON o.order_id = oi.order_id
-            JOIN 
-                products p ON oi.product_id = p.product_id
-            WHERE 
-                o.order_date BETWEEN $1 AND $2
-            GROUP BY 
-                period
-            ORDER BY 
-                period ASC;
-        """, start_date, end_date)
+        rows = await q.fetch(conn, f"get_analytics:{group_by}", start_date, end_date)
     return [dict(row) for row in rows]
 
-async def get_reviews_by_category(pool: asyncpg.pool.Pool) -> list[dict]:
-    """
-    Получить анализ отзывов по категориям.
-    """
-    async with pool.acquire() as conn:
-        rows = await conn.fetch("""
+register_query("get_reviews_by_category", """
             SELECT 
                 c.name AS category_name,
-                AVG(r.rating) AS average_rating,
-                COUNT(r.review_id) AS total_reviews
+                SUM(pr.rating_sum)::numeric / SUM(pr.rating_count) AS average_rating,
+                SUM(pr.rating_count) AS total_reviews
             FROM 
-                reviews r
+                product_ratings pr
             JOIN 
-                products p ON r.product_id = p.product_id
+                products p ON pr.product_id = p.product_id
             JOIN 
                 categories c ON p.category_id = c.category_id
             GROUP BY 
                 c.name
+            HAVING 
+                SUM(pr.rating_count) > 0
             ORDER BY 
                 average_rating DESC;
         """)
+
+async def get_reviews_by_category(pool: asyncpg.pool.Pool) -> list[dict]:
+    """
+    Получить анализ отзывов по категориям (по агрегатам product_ratings).
+    """
+    async with pool.acquire() as conn:
+        rows = await q.fetch(conn, "get_reviews_by_category")
     return [dict(row) for row in rows]
 
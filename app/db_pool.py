@@ -0,0 +1,218 @@
+import os
+import time
+import asyncio
+import logging
+import traceback
+import asyncpg
+from app.queries import RegistryConnection, prepare_queries
+
+logger = logging.getLogger(__name__)
+
+# Настройки пула соединений с БД
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 1))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+DB_POOL_MAX_INACTIVE_LIFETIME = float(os.getenv("DB_POOL_MAX_INACTIVE_LIFETIME", 300))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", 0)) or None  # 0 — без ограничения
+# Ожидание соединения дольше порога считается признаком исчерпания пула
+DB_POOL_SLOW_ACQUIRE_MS = float(os.getenv("DB_POOL_SLOW_ACQUIRE_MS", 100))
+# Отладка: поиск вложенных acquire в одной задаче (со стеками вызовов)
+DB_POOL_DEBUG = os.getenv("DB_POOL_DEBUG", "False").lower() in ("1", "true", "yes")
+
+# Границы корзин гистограммы времени ожидания соединения, мс
+ACQUIRE_WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class ObservedPool:
+    """
+    Обёртка над asyncpg.Pool: измеряет время ожидания соединения,
+    считает занятые и свободные соединения и ожидающие задачи,
+    в отладочном режиме логирует вложенные acquire в одной задаче.
+    Остальные методы пула доступны напрямую.
+    """
+
+    def __init__(self, pool: asyncpg.pool.Pool, debug: bool = DB_POOL_DEBUG,
+                 slow_acquire_ms: float = DB_POOL_SLOW_ACQUIRE_MS):
+        self._pool = pool
+        self.debug = debug
+        self.slow_acquire_ms = slow_acquire_ms
+        self.waiting = 0
+        self.acquired_total = 0
+        self.slow_acquires = 0
+        self.nested_acquires = 0
+        self.wait_buckets = [0] * (len(ACQUIRE_WAIT_BUCKETS_MS) + 1)  # последняя — +Inf
+        self.wait_sum = 0.0
+        # Задача -> стеки вызовов её текущих acquire (стеки сохраняются только в debug)
+        self._holders = {}
+
+    def acquire(self, *, timeout: float | None = DB_POOL_ACQUIRE_TIMEOUT):
+        return _ObservedAcquire(self, timeout)
+
+    def _observe_wait(self, elapsed: float):
+        elapsed_ms = elapsed * 1000
+        self.acquired_total += 1
+        self.wait_sum += elapsed
+        for i, bound in enumerate(ACQUIRE_WAIT_BUCKETS_MS):
+            if elapsed_ms <= bound:
+                self.wait_buckets[i] += 1
+                break
+        else:
+            self.wait_buckets[-1] += 1
+
+        if elapsed_ms > self.slow_acquire_ms:
+            self.slow_acquires += 1
+            logger.warning(
+                f"Ожидание соединения из пула {elapsed_ms:.1f} мс "
+                f"(занято {self.in_use()} из {self._pool.get_max_size()}, ждут {self.waiting})"
+            )
+
+    def _check_nested(self, task):
+        stacks = self._holders.get(task)
+        if not stacks:
+            return
+        self.nested_acquires += 1
+        if self.debug:
+            outer = "".join(stacks[-1]) if stacks[-1] else ""
+            inner = "".join(traceback.format_stack()[:-3])
+            logger.warning(
+                f"Вложенный acquire в задаче {task.get_name()}: задача уже держит {len(stacks)} соединение(я).\n"
+                f"Внешний acquire:\n{outer}\nВложенный acquire:\n{inner}"
+            )
+
+    def in_use(self) -> int:
+        return self._pool.get_size() - self._pool.get_idle_size()
+
+    async def warm_up(self):
+        """
+        Открывает min_size соединений и проверяет каждое простым запросом,
+        чтобы первые запросы не ждали подключения и подготовки запросов.
+        """
+        count = self._pool.get_min_size()
+        connections = [await self._pool.acquire() for _ in range(count)]
+        try:
+            await asyncio.gather(*(conn.fetchval("SELECT 1") for conn in connections))
+        finally:
+            for conn in connections:
+                await self._pool.release(conn)
+
+    def get_stats(self) -> dict:
+        """
+        Состояние пула и гистограмма времени ожидания соединения.
+        """
+        buckets = {}
+        cumulative = 0
+        for bound, count in zip(list(ACQUIRE_WAIT_BUCKETS_MS) + ["+Inf"], self.wait_buckets):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {
+            "size": self._pool.get_size(),
+            "min_size": self._pool.get_min_size(),
+            "max_size": self._pool.get_max_size(),
+            "in_use": self.in_use(),
+            "idle": self._pool.get_idle_size(),
+            "waiting": self.waiting,
+            "acquired_total": self.acquired_total,
+            "slow_acquires": self.slow_acquires,
+            "nested_acquires": self.nested_acquires,
+            "acquire_wait_ms_buckets": buckets,
+            "acquire_wait_seconds_sum": round(self.wait_sum, 6),
+        }
+
+    def metric_samples(self):
+        """
+        Состояние пула в текстовом формате Prometheus (для /metrics).
+        """
+        stats = self.get_stats()
+        yield "# TYPE db_pool_connections gauge"
+        for state in ("in_use", "idle"):
+            yield f'db_pool_connections{{state="{state}"}} {stats[state]}'
+        yield "# TYPE db_pool_max_connections gauge"
+        yield f"db_pool_max_connections {stats['max_size']}"
+        yield "# TYPE db_pool_waiting_tasks gauge"
+        yield f"db_pool_waiting_tasks {stats['waiting']}"
+        yield "# TYPE db_pool_slow_acquires_total counter"
+        yield f"db_pool_slow_acquires_total {stats['slow_acquires']}"
+        yield "# TYPE db_pool_nested_acquires_total counter"
+        yield f"db_pool_nested_acquires_total {stats['nested_acquires']}"
+        yield "# TYPE db_pool_acquire_wait_seconds histogram"
+        for bound, count in stats["acquire_wait_ms_buckets"].items():
+            le = bound if bound == "+Inf" else repr(int(bound) / 1000)
+            yield f'db_pool_acquire_wait_seconds_bucket{{le="{le}"}} {count}'
+        yield f"db_pool_acquire_wait_seconds_sum {stats['acquire_wait_seconds_sum']}"
+        yield f"db_pool_acquire_wait_seconds_count {stats['acquired_total']}"
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+
+class _ObservedAcquire:
+    def __init__(self, pool: ObservedPool, timeout: float | None):
+        self._pool = pool
+        self._timeout = timeout
+        self._conn = None
+        self._task = None
+
+    async def __aenter__(self):
+        pool = self._pool
+        self._task = asyncio.current_task()
+        pool._check_nested(self._task)
+
+        pool.waiting += 1
+        started = time.perf_counter()
+        try:
+            self._conn = await pool._pool.acquire(timeout=self._timeout)
+        finally:
+            pool.waiting -= 1
+        pool._observe_wait(time.perf_counter() - started)
+
+        stack = traceback.format_stack()[:-1] if pool.debug else None
+        pool._holders.setdefault(self._task, []).append(stack)
+        return self._conn
+
+    async def __aexit__(self, *exc):
+        pool = self._pool
+        stacks = pool._holders.get(self._task)
+        if stacks:
+            stacks.pop()
+            if not stacks:
+                del pool._holders[self._task]
+        await pool._pool.release(self._conn)
+
+
+def _connect_options() -> dict:
+    return {
+        "database": os.getenv("DB_NAME"),
+        "user": os.getenv("DB_USER"),
+        "password": os.getenv("DB_PASSWORD"),
+        "host": os.getenv("DB_HOST"),
+        "port": int(os.getenv("DB_PORT")),
+    }
+
+
+async def create_observed_pool() -> ObservedPool:
+    """
+    Создаёт пул соединений по настройкам из переменных окружения.
+    """
+    pool = await asyncpg.create_pool(
+        **_connect_options(),
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        max_inactive_connection_lifetime=DB_POOL_MAX_INACTIVE_LIFETIME,
+        # Каждое новое соединение заранее подготавливает запросы реестра
+        connection_class=RegistryConnection,
+        init=prepare_queries,
+    )
+    return ObservedPool(pool)
+
+
+async def create_service_pool() -> asyncpg.pool.Pool:
+    """
+    Отдельный пул на одно соединение для служебных запросов (планы медленных
+    запросов): они не занимают соединения основного пула. Соединение
+    открывается при первом обращении и закрывается после простоя.
+    """
+    return await asyncpg.create_pool(
+        **_connect_options(),
+        min_size=0,
+        max_size=1,
+        max_inactive_connection_lifetime=DB_POOL_MAX_INACTIVE_LIFETIME,
+    )
@@ -0,0 +1,179 @@
+import os
+import zlib
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Сколько фрагментов COPY может ждать отправки клиенту (ограничивает память на выгрузку)
+EXPORT_QUEUE_CHUNKS = int(os.getenv("EXPORT_QUEUE_CHUNKS", 16))
+# Строк, которые курсор забирает с сервера за раз (NDJSON)
+EXPORT_CURSOR_PREFETCH = int(os.getenv("EXPORT_CURSOR_PREFETCH", 1000))
+# Размер фрагмента NDJSON, отдаваемого клиенту, байт
+EXPORT_NDJSON_CHUNK_BYTES = 64 * 1024
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", 6))
+
+# Выгрузки: имя -> запрос. Параметры: $1, $2 — начало и конец периода
+# (date, включительно; NULL — без ограничения), кроме выгрузок из
+# EXPORTS_WITHOUT_PERIOD. Запросы без ";" в конце:
+# они оборачиваются в COPY (...) TO STDOUT или в SELECT to_json(...).
+EXPORT_QUERIES = {
+    # Заказы с позициями: строка на позицию
+    "orders": """
+        SELECT o.order_id, o.order_date, o.status, u.email, o.total_cost,
+               oi.product_id, p.name AS product_name, oi.quantity, oi.price
+        FROM orders o
+        JOIN users u ON u.user_id = o.user_id
+        JOIN order_items oi ON oi.order_id = o.order_id
+        JOIN products p ON p.product_id = oi.product_id
+        WHERE ($1::date IS NULL OR o.order_date >= $1::date)
+          AND ($2::date IS NULL OR o.order_date < $2::date + 1)
+        ORDER BY o.order_date, o.order_id
+    """,
+    # Продажи товаров за период (как «Топ продаж», без ограничения числа строк)
+    "top_sales": """
+        SELECT p.name AS product_name,
+               SUM(s.quantity) AS total_quantity_sold,
+               SUM(s.revenue) AS total_revenue
+        FROM sales_daily_product s
+        JOIN products p ON s.product_id = p.product_id
+        WHERE ($1::date IS NULL OR s.sale_date >= $1::date)
+          AND ($2::date IS NULL OR s.sale_date <= $2::date)
+        GROUP BY p.name
+        ORDER BY total_quantity_sold DESC
+    """,
+    # Выручка по дням или месяцам ({group_by} подставляется из проверенного списка)
+    "revenue": """
+        SELECT DATE_TRUNC('{group_by}', s.sale_date::timestamp) AS period,
+               SUM(s.revenue) AS total_revenue,
+               SUM(s.quantity) AS total_items_sold
+        FROM sales_daily_category s
+        WHERE ($1::date IS NULL OR s.sale_date >= $1::date)
+          AND ($2::date IS NULL OR s.sale_date <= $2::date)
+        GROUP BY period
+        ORDER BY period
+    """,
+    # Отзывы по категориям (без периода)
+    "reviews_by_category": """
+        SELECT c.name AS category_name,
+               SUM(pr.rating_sum)::numeric / SUM(pr.rating_count) AS average_rating,
+               SUM(pr.rating_count) AS total_reviews
+        FROM product_ratings pr
+        JOIN products p ON pr.product_id = p.product_id
+        JOIN categories c ON p.category_id = c.category_id
+        GROUP BY c.name
+        HAVING SUM(pr.rating_count) > 0
+        ORDER BY average_rating DESC
+    """,
+}
+
+EXPORTS_WITHOUT_PERIOD = {"reviews_by_category"}
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+async def _copy_csv(pool, sql: str, args):
+    """
+    CSV через COPY ... TO STDOUT. COPY пишет фрагменты в очередь ограниченного
+    размера, поэтому при медленном клиенте чтение из БД приостанавливается.
+    """
+    queue = asyncio.Queue(maxsize=EXPORT_QUEUE_CHUNKS)
+
+    async def produce():
+        async with pool.acquire() as conn:
+            await conn.copy_from_query(sql, *args, output=queue.put, format="csv", header=True)
+
+    task = asyncio.ensure_future(produce())
+    try:
+        while True:
+            getter = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                yield getter.result()
+                continue
+            # COPY завершился (или упал): отдаём то, что осталось в очереди
+            getter.cancel()
+            while not queue.empty():
+                yield queue.get_nowait()
+            task.result()
+            return
+    finally:
+        # Клиент отключился или выгрузка упала — останавливаем COPY
+        task.cancel()
+
+
+async def _cursor_ndjson(pool, sql: str, args):
+    """
+    NDJSON через серверный курсор: строки сериализует PostgreSQL (to_json),
+    здесь они только склеиваются во фрагменты.
+    """
+    query = f"SELECT to_json(t)::text FROM ({sql}) t"
+    async with pool.acquire() as conn:
+        async with conn.transaction(isolation="repeatable_read", readonly=True):
+            buffer, size = [], 0
+            async for record in conn.cursor(query, *args, prefetch=EXPORT_CURSOR_PREFETCH):
+                line = record[0].encode("utf-8") + b"\n"
+                buffer.append(line)
+                size += len(line)
+                if size >= EXPORT_NDJSON_CHUNK_BYTES:
+                    yield b"".join(buffer)
+                    buffer, size = [], 0
+            if buffer:
+                yield b"".join(buffer)
+
+
+async def _gzip(chunks):
+    """
+    Сжимает поток фрагментов в gzip на лету.
+    """
+    compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31)  # 31 — формат gzip
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+async def _logged(name: str, chunks):
+    """
+    Логирует ошибку выгрузки: заголовки к этому моменту уже отправлены,
+    клиент получит обрезанный файл.
+    """
+    try:
+        async for chunk in chunks:
+            yield chunk
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка при выгрузке {name}: {e}")
+        raise
+
+
+def build_export(pool, name: str, fmt: str = "csv", gzip: bool = False,
+                 date_from=None, date_to=None, group_by: str = "day"):
+    """
+    Возвращает (поток байтов, имя файла, MIME-тип) для выгрузки `name`.
+    Поток читает данные из БД по мере отправки клиенту.
+    """
+    if name not in EXPORT_QUERIES:
+        raise ValueError(f"Неизвестная выгрузка: {name}")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+    if group_by not in ("day", "month"):
+        raise ValueError("Параметр group_by должен быть 'day' или 'month'.")
+
+    sql = EXPORT_QUERIES[name].format(group_by=group_by) if name == "revenue" else EXPORT_QUERIES[name]
+    args = () if name in EXPORTS_WITHOUT_PERIOD else (date_from, date_to)
+    chunks = _copy_csv(pool, sql, args) if fmt == "csv" else _cursor_ndjson(pool, sql, args)
+    chunks = _logged(name, chunks)
+
+    filename = f"{name}.{fmt}"
+    mimetype = EXPORT_FORMATS[fmt]
+    if gzip:
+        chunks = _gzip(chunks)
+        filename += ".gz"
+        mimetype = "application/gzip"
+    return chunks, filename, mimetype
@@ -0,0 +1,209 @@
+import os
+import time
+from bisect import bisect_left
+from quart import request, g, abort
+
+# Метрики приложения в текстовом формате Prometheus (отдаются на /metrics).
+# Реализация без внешних зависимостей: значения хранятся в словарях
+# "кортеж меток -> значение" в памяти процесса, каждый воркер отдаёт свои.
+
+# Границы корзин гистограмм времени, секунды
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Все созданные метрики в порядке объявления
+REGISTRY = []
+
+# Адреса, которым отдаётся /metrics (через запятую); пустое значение отключает страницу.
+# Сравнивается адрес соединения, а не X-Forwarded-For, который задаёт клиент.
+METRICS_ALLOWED_IPS = {
+    ip.strip() for ip in os.getenv("METRICS_ALLOWED_IPS", "127.0.0.1,::1").split(",") if ip.strip()
+}
+
+# Потоковые ответы (уведомления, выгрузки) открыты минутами и часами: в учёт
+# запросов не попадают, иначе искажают время обработки и число запросов в обработке
+UNTIMED_ENDPOINTS = {"main.order_status_events", "admin.export_data"}
+
+# Функции, возвращающие строки метрик, которые снимаются в момент запроса (например, пул БД)
+COLLECTORS = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Монотонно растущий счётчик с метками.
+    """
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    """
+    Текущее значение с метками (может уменьшаться).
+    """
+    kind = "gauge"
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value: float):
+        self._values[labels] = value
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными корзинами; в каждой корзине хранится
+    число наблюдений именно в ней, накопленные суммы считаются при выводе.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # метки -> [счётчики корзин (+Inf последняя), сумма]
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *labels):
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def samples(self):
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+            label_str = _format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum{label_str} {_format_value(total)}"
+            yield f"{self.name}_count{label_str} {cumulative}"
+
+
+http_requests_total = Counter(
+    "http_requests_total", "Число обработанных HTTP-запросов.", ("blueprint", "route", "method", "status")
+)
+http_request_duration_seconds = Histogram(
+    "http_request_duration_seconds", "Время обработки HTTP-запроса.", ("blueprint", "route", "method")
+)
+http_requests_in_flight = Gauge("http_requests_in_flight", "Число HTTP-запросов в обработке.")
+
+db_query_duration_seconds = Histogram(
+    "db_query_duration_seconds", "Время выполнения именованных запросов к БД (реестр app/queries.py).", ("query",)
+)
+db_query_errors_total = Counter("db_query_errors_total", "Число запросов к БД, завершившихся ошибкой.", ("query",))
+
+redis_command_duration_seconds = Histogram(
+    "redis_command_duration_seconds", "Время выполнения команд Redis.", ("command",)
+)
+
+cache_requests_total = Counter(
+    "cache_requests_total", "Обращения к кешу get_or_cache_json по префиксу ключа и уровню.",
+    ("prefix", "level", "result")
+)
+
+order_events_total = Counter(
+    "order_events_total", "События заказов из Redis Stream по типу и результату (ok, error, dead_letter).",
+    ("type", "result")
+)
+
+order_outbox_relayed_total = Counter(
+    "order_outbox_relayed_total", "События заказов, перенесённые из order_outbox в Redis Stream."
+)
+
+order_push_clients = Gauge(
+    "order_push_clients", "Открытые подключения к уведомлениям о заказах (SSE)."
+)
+
+order_push_dropped_total = Counter(
+    "order_push_dropped_total", "Подключения к уведомлениям, закрытые из-за переполнения очереди."
+)
+
+
+def render_metrics() -> str:
+    """
+    Все метрики процесса в текстовом формате Prometheus.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    for collect in COLLECTORS:
+        lines.extend(collect())
+    return "\n".join(lines) + "\n"
+
+
+def init_metrics(app):
+    """
+    Подключает к приложению учёт HTTP-запросов: время, коды ответа
+    и число запросов в обработке. Метка route — шаблон маршрута
+    (например, /product/<uuid:product_id>), а не фактический путь.
+    Потоковые ответы (UNTIMED_ENDPOINTS) не учитываются.
+    """
+
+    @app.before_request
+    async def start_request_timer():
+        if request.endpoint in UNTIMED_ENDPOINTS:
+            return
+        g.metrics_started = time.perf_counter()
+        http_requests_in_flight.inc()
+
+    @app.after_request
+    async def record_response_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    async def record_request(exc=None):
+        started = g.pop("metrics_started", None)
+        if started is None:
+            return
+        http_requests_in_flight.dec()
+        rule = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+        blueprint = request.blueprint or ""
+        # Если обработчик упал, after_request не вызывался — это ответ 500
+        status = g.pop("metrics_status", 500)
+        http_request_duration_seconds.observe(time.perf_counter() - started, blueprint, rule, request.method)
+        http_requests_total.inc(blueprint, rule, request.method, str(status))
+
+    @app.route("/metrics")
+    async def metrics():
+        """
+        Метрики процесса для Prometheus; только для адресов из METRICS_ALLOWED_IPS.
+        """
+        if request.remote_addr not in METRICS_ALLOWED_IPS:
+            abort(404)
+        return render_metrics(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
@@ -0,0 +1,258 @@
+import os
+import json
+import time
+import socket
+import asyncio
+import logging
+from redis.exceptions import ResponseError
+from app.redis_client import get_redis
+from app.cache_utils import invalidate_cache_keys
+from app.db import get_order_product_ids, drain_order_outbox, get_order_outbox_stats
+from app.metrics import order_events_total, order_outbox_relayed_total
+
+logger = logging.getLogger(__name__)
+
+# События заказов (new_order, status_changed) в Redis Stream.
+# Приложение пишет их в таблицу order_outbox в транзакции изменения заказа;
+# фоновый ретранслятор (relay_order_outbox) переносит их в поток пачками
+# в порядке записи — запрос пользователя в Redis не ходит.
+# Каждый процесс приложения — потребитель одной группы: событие обрабатывает
+# ровно один из них, а сообщения, опубликованные, пока потребителей нет,
+# дождутся их в потоке. Сообщение подтверждается (XACK) после успешной
+# обработки; неподтверждённые дольше ORDER_EVENTS_CLAIM_IDLE_MS забирает
+# и повторяет другой потребитель, после ORDER_EVENTS_MAX_DELIVERIES попыток
+# сообщение уходит в поток недоставленных (ORDER_DEAD_LETTER_STREAM).
+# Обработка «хотя бы один раз»: обработчики должны быть идемпотентны.
+
+ORDER_STREAM = os.getenv("ORDER_STREAM", "stream:orders")
+ORDER_DEAD_LETTER_STREAM = f"{ORDER_STREAM}:dead"
+ORDER_CONSUMER_GROUP = os.getenv("ORDER_CONSUMER_GROUP", "order-workers")
+# Примерная длина потока (старые события обрезаются при XADD)
+ORDER_STREAM_MAXLEN = int(os.getenv("ORDER_STREAM_MAXLEN", 100_000))
+
+ORDER_EVENTS_BATCH = int(os.getenv("ORDER_EVENTS_BATCH", 100))
+ORDER_EVENTS_BLOCK_MS = 5000
+ORDER_EVENTS_CLAIM_IDLE_MS = int(os.getenv("ORDER_EVENTS_CLAIM_IDLE_MS", 60_000))
+ORDER_EVENTS_CLAIM_INTERVAL = 30
+ORDER_EVENTS_MAX_DELIVERIES = int(os.getenv("ORDER_EVENTS_MAX_DELIVERIES", 5))
+
+ORDER_OUTBOX_BATCH = int(os.getenv("ORDER_OUTBOX_BATCH", 500))
+# Пауза между опросами order_outbox, когда очередь пуста, секунды
+ORDER_OUTBOX_POLL_INTERVAL = float(os.getenv("ORDER_OUTBOX_POLL_INTERVAL", 0.5))
+
+# Тип события -> обработчики async def handler(pool, event)
+_handlers = {}
+
+
+def order_event_handler(event_type: str):
+    """
+    Регистрирует обработчик событий заказов указанного типа.
+    """
+    def decorator(fn):
+        _handlers.setdefault(event_type, []).append(fn)
+        return fn
+    return decorator
+
+
+async def publish_order_events(payloads: list):
+    """
+    Добавляет пачку событий (JSON-строки) в поток одним конвейером, сохраняя порядок.
+    """
+    r = await get_redis()
+    async with r.pipeline(transaction=False) as pipe:
+        for payload in payloads:
+            pipe.xadd(ORDER_STREAM, {"data": payload}, maxlen=ORDER_STREAM_MAXLEN, approximate=True)
+        await pipe.execute()
+
+
+async def relay_order_outbox(pool):
+    """
+    Фоновая задача процесса: переносит события из order_outbox в поток.
+    Пачка удаляется из таблицы только после успешной публикации, поэтому
+    при сбое между ними события будут опубликованы повторно (не потеряны).
+    Пока один процесс разбирает очередь, остальные ждут следующего опроса.
+    """
+    logger.info(f"Ретранслятор order_outbox -> '{ORDER_STREAM}' запущен")
+    while True:
+        try:
+            relayed = await drain_order_outbox(pool, ORDER_OUTBOX_BATCH, publish_order_events)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка передачи событий заказов из order_outbox: {e}")
+            await asyncio.sleep(1)
+            continue
+        if relayed:
+            order_outbox_relayed_total.inc(amount=relayed)
+        # Полная пачка — в очереди, скорее всего, есть ещё
+        if relayed < ORDER_OUTBOX_BATCH:
+            await asyncio.sleep(ORDER_OUTBOX_POLL_INTERVAL)
+
+
+def consumer_name() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+async def ensure_consumer_group(r):
+    """
+    Создаёт поток и группу потребителей, если их ещё нет. Новая группа читает
+    поток с начала, чтобы не потерять события, записанные до её создания.
+    """
+    try:
+        await r.xgroup_create(ORDER_STREAM, ORDER_CONSUMER_GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def _event_type(data: str) -> str:
+    try:
+        return json.loads(data).get("type", "unknown")
+    except (ValueError, AttributeError):
+        return "unknown"
+
+
+async def _process_messages(r, pool, messages):
+    """
+    Обрабатывает пачку сообщений и подтверждает успешно обработанные одной командой XACK.
+    Сообщения с ошибкой остаются в списке ожидающих и будут повторены.
+    """
+    acked = []
+    for message_id, fields in messages:
+        if fields is None:
+            # Сообщение обрезано из потока, пока ожидало повтора
+            acked.append(message_id)
+            continue
+        event_type = "unknown"
+        try:
+            event = json.loads(fields["data"])
+            event_type = event.get("type", "unknown")
+            for handler in _handlers.get(event_type, ()):
+                await handler(pool, event)
+        except Exception as e:
+            logger.error(f"Ошибка обработки события заказа {message_id}: {e}")
+            order_events_total.inc(event_type, "error")
+            continue
+        order_events_total.inc(event_type, "ok")
+        acked.append(message_id)
+    if acked:
+        await r.xack(ORDER_STREAM, ORDER_CONSUMER_GROUP, *acked)
+
+
+async def _reclaim_pending(r, pool, consumer: str):
+    """
+    Забирает зависшие сообщения (потребитель упал или обработка не удалась):
+    после ORDER_EVENTS_MAX_DELIVERIES попыток переносит их в поток недоставленных,
+    остальные обрабатывает повторно.
+    """
+    pending = await r.xpending_range(
+        ORDER_STREAM, ORDER_CONSUMER_GROUP, min="-", max="+",
+        count=ORDER_EVENTS_BATCH, idle=ORDER_EVENTS_CLAIM_IDLE_MS,
+    )
+    retry = []
+    for entry in pending:
+        if entry["times_delivered"] < ORDER_EVENTS_MAX_DELIVERIES:
+            retry.append(entry["message_id"])
+            continue
+        message_id = entry["message_id"]
+        original = await r.xrange(ORDER_STREAM, min=message_id, max=message_id)
+        data = original[0][1]["data"] if original else ""
+        await r.xadd(ORDER_DEAD_LETTER_STREAM, {
+            "data": data,
+            "message_id": message_id,
+            "consumer": entry["consumer"],
+            "deliveries": entry["times_delivered"],
+        }, maxlen=ORDER_STREAM_MAXLEN, approximate=True)
+        await r.xack(ORDER_STREAM, ORDER_CONSUMER_GROUP, message_id)
+        order_events_total.inc(_event_type(data), "dead_letter")
+        logger.error(f"Событие заказа {message_id} перенесено в {ORDER_DEAD_LETTER_STREAM} "
+                     f"после {entry['times_delivered']} попыток")
+    if retry:
+        claimed = await r.xclaim(ORDER_STREAM, ORDER_CONSUMER_GROUP, consumer, ORDER_EVENTS_CLAIM_IDLE_MS, retry)
+        await _process_messages(r, pool, claimed)
+
+
+async def consume_order_events(pool):
+    """
+    Фоновая задача процесса: читает события из потока пачками (XREADGROUP)
+    и периодически забирает зависшие сообщения.
+    """
+    r = await get_redis()
+    consumer = consumer_name()
+    await ensure_consumer_group(r)
+    logger.info(f"Потребитель {consumer} группы '{ORDER_CONSUMER_GROUP}' потока '{ORDER_STREAM}' запущен")
+
+    last_claim = 0.0
+    try:
+        while True:
+            try:
+                if time.monotonic() - last_claim >= ORDER_EVENTS_CLAIM_INTERVAL:
+                    last_claim = time.monotonic()
+                    await _reclaim_pending(r, pool, consumer)
+                response = await r.xreadgroup(
+                    ORDER_CONSUMER_GROUP, consumer, {ORDER_STREAM: ">"},
+                    count=ORDER_EVENTS_BATCH, block=ORDER_EVENTS_BLOCK_MS,
+                )
+                for _, messages in response or []:
+                    await _process_messages(r, pool, messages)
+            except asyncio.CancelledError:
+                raise
+            except ResponseError as e:
+                # Поток или группу удалили (например, при очистке Redis) — создаём заново
+                if "NOGROUP" in str(e):
+                    await ensure_consumer_group(r)
+                else:
+                    logger.error(f"Ошибка чтения потока событий заказов: {e}")
+                    await asyncio.sleep(1)
+            except Exception as e:
+                logger.error(f"Ошибка чтения потока событий заказов: {e}")
+                await asyncio.sleep(1)
+    finally:
+        await _remove_idle_consumer(r, consumer)
+
+
+async def _remove_idle_consumer(r, consumer: str):
+    """
+    При остановке процесса удаляет потребителя из группы, если за ним нет
+    неподтверждённых сообщений (иначе их заберут другие через XCLAIM).
+    """
+    try:
+        pending = await r.xpending_range(
+            ORDER_STREAM, ORDER_CONSUMER_GROUP, min="-", max="+", count=1, consumername=consumer
+        )
+        if not pending:
+            await r.xgroup_delconsumer(ORDER_STREAM, ORDER_CONSUMER_GROUP, consumer)
+    except Exception as e:
+        logger.warning(f"Не удалось удалить потребителя {consumer}: {e}")
+
+
+async def get_order_events_stats(pool) -> dict:
+    """
+    Очередь order_outbox, длина потока, состояние групп потребителей
+    и число недоставленных событий.
+    """
+    r = await get_redis()
+    await ensure_consumer_group(r)
+    return {
+        "outbox": await get_order_outbox_stats(pool),
+        "stream": ORDER_STREAM,
+        "length": await r.xlen(ORDER_STREAM),
+        "groups": await r.xinfo_groups(ORDER_STREAM),
+        "consumers": await r.xinfo_consumers(ORDER_STREAM, ORDER_CONSUMER_GROUP),
+        "dead_letters": await r.xlen(ORDER_DEAD_LETTER_STREAM),
+    }
+
+
+@order_event_handler("new_order")
+@order_event_handler("status_changed")
+async def log_order_event(pool, event: dict):
+    logger.info(f"Получено событие: {event}")
+
+
+@order_event_handler("new_order")
+async def invalidate_ordered_products(pool, event: dict):
+    """
+    Оформление заказа списывает остатки: карточки товаров в кеше устарели.
+    """
+    product_ids = await get_order_product_ids(pool, event["order_id"])
+    await invalidate_cache_keys(f"cache:product:{product_id}" for product_id in product_ids)
@@ -0,0 +1,134 @@
+import os
+import json
+import asyncio
+import logging
+from app.redis_client import get_redis
+from app.order_events import ORDER_STREAM, ORDER_EVENTS_BATCH, ORDER_EVENTS_BLOCK_MS
+from app.metrics import order_push_clients, order_push_dropped_total
+
+logger = logging.getLogger(__name__)
+
+# Уведомления покупателям о смене статуса их заказов (server-sent events).
+# Группа потребителей раздаёт событие одному процессу, а уведомление нужно
+# во всех процессах (клиент подключён к любому), поэтому каждый процесс
+# читает поток событий заказов сам — один XREAD на процесс, без подписки
+# на каждого клиента — и раздаёт события своим клиентам по user_id.
+#
+# У каждого подключения своя очередь на ORDER_PUSH_QUEUE_SIZE сообщений.
+# Если клиент не успевает их забирать, очередь очищается, клиент получает
+# событие resync (перечитать заказы) и отключается; EventSource подключится заново.
+
+ORDER_PUSH_QUEUE_SIZE = int(os.getenv("ORDER_PUSH_QUEUE_SIZE", 16))
+# Комментарий-пинг раз в столько секунд, чтобы прокси не закрывали простаивающее соединение
+ORDER_PUSH_HEARTBEAT = int(os.getenv("ORDER_PUSH_HEARTBEAT", 20))
+# Через сколько миллисекунд браузер переподключается после обрыва
+ORDER_PUSH_RETRY_MS = 3000
+
+RESYNC_MESSAGE = b"event: resync\ndata: {}\n\n"
+
+# user_id -> очереди подключений этого пользователя в процессе
+_clients = {}
+
+
+def subscribe(user_id: str) -> asyncio.Queue:
+    queue = asyncio.Queue(maxsize=ORDER_PUSH_QUEUE_SIZE)
+    _clients.setdefault(user_id, set()).add(queue)
+    order_push_clients.inc()
+    return queue
+
+
+def unsubscribe(user_id: str, queue: asyncio.Queue):
+    queues = _clients.get(user_id)
+    if not queues or queue not in queues:
+        return
+    queues.discard(queue)
+    if not queues:
+        del _clients[user_id]
+    order_push_clients.dec()
+
+
+def _deliver(user_id: str, message: bytes):
+    """
+    Кладёт сообщение в очереди подключений пользователя, не дожидаясь клиентов.
+    Переполненная очередь означает медленного клиента: он отключается (None в очереди).
+    """
+    for queue in list(_clients.get(user_id, ())):
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            unsubscribe(user_id, queue)
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)
+            order_push_dropped_total.inc()
+
+
+def _dispatch(message_id: str, fields: dict):
+    """
+    Раздаёт событие status_changed покупателям изменённых заказов, подключённым к процессу.
+    """
+    try:
+        event = json.loads(fields["data"])
+    except (TypeError, KeyError, ValueError):
+        return
+    if event.get("type") != "status_changed":
+        return
+
+    orders_by_user = {}
+    for order_id, user_id in zip(event.get("order_ids", ()), event.get("user_ids", ())):
+        if user_id in _clients:
+            orders_by_user.setdefault(user_id, []).append(order_id)
+
+    for user_id, order_ids in orders_by_user.items():
+        data = json.dumps({"order_ids": order_ids, "new_status": event.get("new_status")})
+        _deliver(user_id, f"id: {message_id}\nevent: status_changed\ndata: {data}\n\n".encode())
+
+
+async def fan_out_order_events():
+    """
+    Фоновая задача процесса: читает новые события из потока заказов (XREAD,
+    без группы потребителей) и раздаёт их подключённым клиентам.
+    После ошибки чтение продолжается с последнего прочитанного события.
+    """
+    r = await get_redis()
+    last_id = "$"
+    logger.info(f"Раздача событий потока '{ORDER_STREAM}' клиентам запущена")
+    while True:
+        try:
+            response = await r.xread({ORDER_STREAM: last_id}, count=ORDER_EVENTS_BATCH, block=ORDER_EVENTS_BLOCK_MS)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка чтения потока событий заказов для уведомлений: {e}")
+            await asyncio.sleep(1)
+            continue
+        for _, messages in response or []:
+            for message_id, fields in messages:
+                last_id = message_id
+                _dispatch(message_id, fields)
+
+
+async def order_status_stream(user_id: str, resync: bool = False):
+    """
+    Тело ответа text/event-stream для пользователя: события status_changed его заказов.
+    resync — клиент переподключился (передал Last-Event-ID) и мог пропустить события.
+    Ожидающее подключение — только очередь и корутина, без обращений к Redis и БД.
+    """
+    queue = subscribe(user_id)
+    try:
+        yield f"retry: {ORDER_PUSH_RETRY_MS}\n\n".encode()
+        if resync:
+            yield RESYNC_MESSAGE
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), ORDER_PUSH_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield b": ping\n\n"
+                continue
+            if message is None:
+                yield RESYNC_MESSAGE
+                return
+            yield message
+    finally:
+        unsubscribe(user_id, queue)
+
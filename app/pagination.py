@@ -0,0 +1,60 @@
+import base64
+import json
+import uuid
+
+class InvalidCursor(ValueError):
+    """
+    Курсор не подходит к запросу: повреждён, изменён вручную или получен
+    для другой сортировки (например, без ключевого слова поиска).
+    """
+
+def clamp_page_size(limit, default: int, maximum: int) -> int:
+    """
+    Приводит размер страницы к допустимому диапазону [1, maximum].
+    Некорректное значение заменяется на default.
+    """
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(limit, maximum))
+
+def encode_cursor(*values) -> str:
+    """
+    Кодирует значения ключа последней строки страницы в непрозрачный курсор.
+    UUID, даты и Decimal сохраняются строками.
+    """
+    raw = json.dumps(list(values), default=str, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str, size: int) -> list | None:
+    """
+    Декодирует курсор, созданный encode_cursor.
+    Возвращает список из size значений или None, если курсор пустой или повреждён.
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, UnicodeError):
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    return values
+
+def cursor_values(after: list, *converters) -> list:
+    """
+    Приводит значения декодированного курсора к типам ключа страницы
+    (по одному преобразователю на значение). Ошибка приведения — InvalidCursor.
+    """
+    try:
+        return [convert(value) for convert, value in zip(converters, after)]
+    except (TypeError, ValueError, AttributeError, ArithmeticError) as e:
+        raise InvalidCursor("Неверный курсор.") from e
+
+def cursor_uuid(value) -> str:
+    """
+    UUID из курсора в каноническом виде (для параметров ::uuid).
+    """
+    return str(uuid.UUID(value))
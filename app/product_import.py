@@ -0,0 +1,199 @@
+import csv
+import asyncpg
+
+# Массовая загрузка товаров из CSV (прайс-листы и остатки поставщиков).
+# Файл копируется через COPY во временную таблицу, строки проверяются одним
+# UPDATE в SQL, корректные сливаются в products одним INSERT ... ON CONFLICT.
+#
+# Столбцы файла (заголовок обязателен, порядок любой, лишних быть не должно):
+# product_id, name, description, category_id, price, stock, manufacturer.
+# Строка с product_id существующего товара обновляет его; пустые и отсутствующие
+# столбцы оставляют прежние значения (так файл "product_id,price,stock"
+# обновляет только цены и остатки). Строка без product_id или с неизвестным
+# product_id создаёт товар — для неё обязательны name, price и stock.
+
+IMPORT_COLUMNS = ('product_id', 'name', 'description', 'category_id', 'price', 'stock', 'manufacturer')
+
+# Сколько ошибочных строк возвращать в отчёте (всего ошибок — в error_count)
+IMPORT_ERROR_LIMIT = 1000
+
+_UUID_RE = r'^[0-9a-fA-F]{8}-([0-9a-fA-F]{4}-){3}[0-9a-fA-F]{12}$'
+
+# Все столбцы — текст, чтобы COPY не падал на первом неверном значении;
+# line_no нумерует записи CSV (без заголовка) в порядке COPY. Это не номер
+# строки файла: запись с переводом строки в кавычках занимает несколько строк
+CREATE_STAGING_SQL = """
+    CREATE TEMP TABLE product_import (
+        line_no BIGSERIAL,
+        product_id TEXT,
+        name TEXT,
+        description TEXT,
+        category_id TEXT,
+        price TEXT,
+        stock TEXT,
+        manufacturer TEXT,
+        error TEXT,
+        product_uuid UUID,
+        category_uuid UUID,
+        price_value NUMERIC(10, 2),
+        stock_value INT
+    ) ON COMMIT DROP
+"""
+
+NORMALIZE_SQL = """
+    UPDATE product_import
+    SET product_id = NULLIF(btrim(product_id), ''),
+        name = NULLIF(btrim(name), ''),
+        description = NULLIF(description, ''),
+        category_id = NULLIF(btrim(category_id), ''),
+        price = NULLIF(btrim(price), ''),
+        stock = NULLIF(btrim(stock), ''),
+        manufacturer = NULLIF(btrim(manufacturer), '')
+"""
+
+# Проверки идут по порядку: приведение типов в последующих ветках CASE
+# выполняется только для строк, прошедших проверку формата
+VALIDATE_SQL = f"""
+    UPDATE product_import s
+    SET error = CASE
+        WHEN s.product_id IS NOT NULL AND s.product_id !~ '{_UUID_RE}'
+            THEN 'неверный product_id'
+        WHEN s.product_id IS NOT NULL AND d.first_line <> s.line_no
+            THEN 'product_id повторяется (первая запись ' || d.first_line || ')'
+        WHEN s.price IS NOT NULL AND s.price !~ '^[0-9]{{1,8}}([.][0-9]{{1,2}})?$'
+            THEN 'неверная цена'
+        WHEN s.stock IS NOT NULL AND s.stock !~ '^[0-9]{{1,9}}$'
+            THEN 'неверный остаток'
+        WHEN s.category_id IS NOT NULL AND s.category_id !~ '{_UUID_RE}'
+            THEN 'неверный category_id'
+        WHEN s.category_id IS NOT NULL
+             AND NOT EXISTS (SELECT 1 FROM categories c WHERE c.category_id = s.category_id::uuid)
+            THEN 'категория не найдена'
+        WHEN length(s.name) > 150
+            THEN 'название длиннее 150 символов'
+        WHEN length(s.manufacturer) > 150
+            THEN 'производитель длиннее 150 символов'
+        WHEN (s.name IS NULL OR s.price IS NULL OR s.stock IS NULL)
+             AND (s.product_id IS NULL
+                  OR NOT EXISTS (SELECT 1 FROM products p WHERE p.product_id = s.product_id::uuid))
+            THEN 'для нового товара обязательны name, price и stock'
+    END
+    FROM (
+        SELECT line_no, MIN(line_no) OVER (PARTITION BY lower(product_id)) AS first_line
+        FROM product_import
+    ) d
+    WHERE d.line_no = s.line_no
+"""
+
+# Приведение типов — только для строк без ошибок
+CONVERT_SQL = """
+    UPDATE product_import
+    SET product_uuid = product_id::uuid,
+        category_uuid = category_id::uuid,
+        price_value = price::numeric,
+        stock_value = stock::int
+    WHERE error IS NULL
+"""
+
+# Пустые значения берутся из текущей строки товара. Неизменившиеся товары
+# не перезаписываются (WHERE ... IS DISTINCT FROM) и не попадают в RETURNING.
+# xmax = 0 у только что вставленной строки, у обновлённой — нет.
+MERGE_SQL = """
+    INSERT INTO products AS p (product_id, name, description, category_id, price, stock, manufacturer)
+    SELECT COALESCE(s.product_uuid, uuid_generate_v4()),
+           COALESCE(s.name, e.name),
+           COALESCE(s.description, e.description),
+           COALESCE(s.category_uuid, e.category_id),
+           COALESCE(s.price_value, e.price),
+           COALESCE(s.stock_value, e.stock),
+           COALESCE(s.manufacturer, e.manufacturer)
+    FROM product_import s
+    LEFT JOIN products e ON e.product_id = s.product_uuid
+    WHERE s.error IS NULL
+    ON CONFLICT (product_id) DO UPDATE
+    SET name = EXCLUDED.name,
+        description = EXCLUDED.description,
+        category_id = EXCLUDED.category_id,
+        price = EXCLUDED.price,
+        stock = EXCLUDED.stock,
+        manufacturer = EXCLUDED.manufacturer
+    WHERE (p.name, p.description, p.category_id, p.price, p.stock, p.manufacturer)
+          IS DISTINCT FROM
+          (EXCLUDED.name, EXCLUDED.description, EXCLUDED.category_id, EXCLUDED.price,
+           EXCLUDED.stock, EXCLUDED.manufacturer)
+    RETURNING p.product_id, p.xmax = 0 AS inserted
+"""
+
+ERRORS_SQL = """
+    SELECT line_no AS record, product_id, error
+    FROM product_import
+    WHERE error IS NOT NULL
+    ORDER BY line_no
+    LIMIT $1
+"""
+
+COUNTS_SQL = """
+    SELECT COUNT(*) AS total, COUNT(error) AS error_count
+    FROM product_import
+"""
+
+
+def read_import_header(source) -> list:
+    """
+    Читает строку заголовка CSV из двоичного файла и возвращает список столбцов.
+    Файл остаётся на начале данных.
+    """
+    line = source.readline()
+    if not line:
+        raise ValueError("Файл пуст.")
+    header = next(csv.reader([line.decode('utf-8-sig')]), [])
+    columns = [name.strip().lower() for name in header]
+    if not columns:
+        raise ValueError("В заголовке нет столбцов.")
+    unknown = [name for name in columns if name not in IMPORT_COLUMNS]
+    if unknown:
+        raise ValueError(f"Неизвестные столбцы: {', '.join(unknown)}. Допустимые: {', '.join(IMPORT_COLUMNS)}.")
+    if len(set(columns)) != len(columns):
+        raise ValueError("Столбцы в заголовке повторяются.")
+    return columns
+
+
+async def import_products_csv(pool, source, error_limit: int = IMPORT_ERROR_LIMIT) -> dict:
+    """
+    Загружает товары из CSV (двоичный файловый объект) одной транзакцией.
+    Возвращает отчёт: total, inserted, updated, unchanged, error_count,
+    errors (первые error_limit ошибочных строк: record — номер записи CSV
+    после заголовка, product_id, error),
+    updated_ids (для инвалидации кеша) и columns.
+    Ошибка в формате файла (ValueError) отменяет загрузку целиком.
+    """
+    columns = read_import_header(source)
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(CREATE_STAGING_SQL)
+            try:
+                await conn.copy_to_table(
+                    'product_import', source=source, columns=columns, format='csv', encoding='UTF8'
+                )
+            except asyncpg.DataError as e:
+                raise ValueError(f"Ошибка в формате CSV: {e}") from e
+            await conn.execute(NORMALIZE_SQL)
+            await conn.execute(VALIDATE_SQL)
+            await conn.execute(CONVERT_SQL)
+            merged = await conn.fetch(MERGE_SQL)
+            counts = await conn.fetchrow(COUNTS_SQL)
+            errors = await conn.fetch(ERRORS_SQL, error_limit)
+
+    inserted = sum(1 for row in merged if row['inserted'])
+    updated_ids = [row['product_id'] for row in merged if not row['inserted']]
+    valid = counts['total'] - counts['error_count']
+    return {
+        'columns': columns,
+        'total': counts['total'],
+        'inserted': inserted,
+        'updated': len(updated_ids),
+        'unchanged': valid - inserted - len(updated_ids),
+        'error_count': counts['error_count'],
+        'errors': [dict(row) for row in errors],
+        'updated_ids': updated_ids,
+    }
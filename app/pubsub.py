@@ -1,34 +1,25 @@
 import asyncio
-import json
 from app.redis_client import get_redis
+from app.cache_utils import INVALIDATION_CHANNEL, local_cache
 import logging
 
 logger = logging.getLogger(__name__)
 
-async def publish_event(channel: str, message: dict):
+async def listen_to_events():
     """
-    Публикует событие в указанный Redis-канал.
-    """
-    r = await get_redis()
-    await r.publish(channel, json.dumps(message))
-
-async def listen_to_orders():
-    """
-    Подписывается на Redis-канал и обрабатывает входящие сообщения.
-    Эта функция запускается при старте приложения.
-    Все события будут здесь ловиться.
-    Логируется информация о заказах.
+    Подписывается на канал инвалидации кеша: ключи (по одному на строку)
+    удаляются из локального кеша процесса. Функция запускается при старте
+    приложения, одна подписка на процесс.
+    События заказов идут через Redis Stream (см. app/order_events.py).
     """
     r = await get_redis()
     pubsub = r.pubsub()
-    await pubsub.subscribe("orders")
+    await pubsub.subscribe(INVALIDATION_CHANNEL)
 
-    logger.info("Подписка на канал 'orders' запущена")
+    logger.info(f"Подписка на канал '{INVALIDATION_CHANNEL}' запущена")
 
     async for msg in pubsub.listen():
-        if msg['type'] == 'message':
-            try:
-                data = json.loads(msg['data'])
-                logger.info(f"Получено событие: {data}")
-            except Exception as e:
-                logger.error(f"Ошибка при обработке события: {e}")
\ No newline at end of file
+        if msg['type'] != 'message':
+            continue
+        for key in msg['data'].split("\n"):
+            local_cache.delete(key)
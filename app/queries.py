@@ -0,0 +1,131 @@
+import time
+import logging
+import asyncpg
+from app.metrics import db_query_duration_seconds, db_query_errors_total
+from app.slow_queries import record_slow_query
+
+logger = logging.getLogger(__name__)
+
+# Реестр именованных SQL-запросов приложения: имя -> текст запроса.
+# Все запросы подготавливаются на каждом новом соединении пула (prepare_queries).
+QUERIES = {}
+
+# Запросы, которые подготавливаются не при создании соединения, а при первом вызове
+# (редкие варианты с большим числом комбинаций, например сетка товаров в админке)
+LAZY_QUERIES = set()
+
+# Статистика выполнения по именам запросов
+query_stats = {}
+
+
+def register_query(name: str, sql: str, lazy: bool = False) -> str:
+    """
+    Зарегистрировать запрос под именем и вернуть это имя.
+    lazy=True — не подготавливать запрос заранее на каждом соединении.
+    """
+    if name in QUERIES and QUERIES[name] != sql:
+        raise ValueError(f"Запрос с именем {name} уже зарегистрирован с другим текстом.")
+    QUERIES[name] = sql
+    if lazy:
+        LAZY_QUERIES.add(name)
+    query_stats.setdefault(name, {"calls": 0, "total_time": 0.0, "max_time": 0.0})
+    return name
+
+
+class RegistryConnection(asyncpg.Connection):
+    """
+    Соединение, хранящее подготовленные запросы реестра (передаётся в create_pool
+    как connection_class).
+    """
+    __slots__ = ("prepared_statements",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements = {}
+
+
+async def prepare_queries(conn):
+    """
+    Хук init пула: подготавливает все запросы реестра (кроме lazy) на новом соединении.
+    Запрос, который не удалось подготовить (например, схема ещё не обновлена),
+    будет подготовлен при первом вызове.
+    """
+    for name, sql in QUERIES.items():
+        if name in LAZY_QUERIES:
+            continue
+        try:
+            conn.prepared_statements[name] = await conn.prepare(sql)
+        except asyncpg.PostgresError as e:
+            logger.warning(f"Не удалось подготовить запрос {name}: {e}")
+
+
+async def _statement(conn, name: str, statements: dict):
+    stmt = statements.get(name)
+    if stmt is None:
+        stmt = await conn.prepare(QUERIES[name])
+        statements[name] = stmt
+    return stmt
+
+
+async def _run(conn, name: str, method: str, args):
+    statements = getattr(conn, "prepared_statements", None)
+    started = time.perf_counter()
+    try:
+        if statements is None:
+            # Обычное соединение (не из пула приложения) — неявный кеш asyncpg
+            return await getattr(conn, method)(QUERIES[name], *args)
+        stmt = await _statement(conn, name, statements)
+        try:
+            return await getattr(stmt, method)(*args)
+        except asyncpg.exceptions.InvalidCachedStatementError:
+            # Схема изменилась после подготовки — подготавливаем заново (вне транзакции это безопасно)
+            statements.pop(name, None)
+            if conn.is_in_transaction():
+                raise
+            stmt = await _statement(conn, name, statements)
+            return await getattr(stmt, method)(*args)
+    except Exception:
+        db_query_errors_total.inc(name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        db_query_duration_seconds.observe(elapsed, name)
+        stats = query_stats[name]
+        stats["calls"] += 1
+        stats["total_time"] += elapsed
+        stats["max_time"] = max(stats["max_time"], elapsed)
+        record_slow_query(conn, name, QUERIES[name], args, elapsed)
+
+
+async def fetch(conn, name: str, *args):
+    return await _run(conn, name, "fetch", args)
+
+
+async def fetchrow(conn, name: str, *args):
+    return await _run(conn, name, "fetchrow", args)
+
+
+async def fetchval(conn, name: str, *args):
+    return await _run(conn, name, "fetchval", args)
+
+
+async def execute(conn, name: str, *args):
+    """
+    Выполнить запрос без результата (у подготовленного запроса нет execute — используем fetch).
+    """
+    await _run(conn, name, "fetch", args)
+
+
+def get_query_stats() -> dict:
+    """
+    Число вызовов и время выполнения (мс) по каждому запросу реестра.
+    """
+    return {
+        name: {
+            "calls": stats["calls"],
+            "total_ms": round(stats["total_time"] * 1000, 3),
+            "avg_ms": round(stats["total_time"] * 1000 / stats["calls"], 3) if stats["calls"] else 0.0,
+            "max_ms": round(stats["max_time"] * 1000, 3),
+        }
+        for name, stats in query_stats.items()
+    }
@@ -1,18 +1,35 @@
 import redis.asyncio as redis_lib
 import os
+import time
+from app.metrics import redis_command_duration_seconds
 
 redis = None
+redis_binary = None
+
+class InstrumentedRedis(redis_lib.Redis):
+    """
+    Клиент Redis, замеряющий время выполнения каждой команды
+    (команды внутри pipeline и pub/sub не учитываются).
+    """
+
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            redis_command_duration_seconds.observe(time.perf_counter() - started, str(args[0]).upper())
+
 
 async def init_redis():
     """
-    Создаёт глобальное подключение к Redis, используя URL из переменных окружения.
-    Подключение сохраняется в переменной redis для повторного использования.
+    Создаёт глобальные подключения к Redis, используя URL из переменных окружения.
+    Подключения сохраняются в переменных redis (строки) и redis_binary (байты,
+    для двоичных значений кеша) для повторного использования.
     """
-    global redis
-    redis = redis_lib.from_url(
-        os.getenv("REDIS_URL", "redis://localhost"),
-        decode_responses=True
-    )
+    global redis, redis_binary
+    url = os.getenv("REDIS_URL", "redis://localhost")
+    redis = InstrumentedRedis.from_url(url, decode_responses=True)
+    redis_binary = InstrumentedRedis.from_url(url, decode_responses=False)
 
 async def get_redis():
     """
@@ -21,4 +38,12 @@ async def get_redis():
     global redis
     if redis is None:
         raise ConnectionError("Redis не инициализирован или не подключен.")
-    return redis
\ No newline at end of file
+    return redis
+
+async def get_binary_redis():
+    """
+    Подключение к Redis без декодирования ответов — для значений кеша в двоичном формате.
+    """
+    if redis_binary is None:
+        raise ConnectionError("Redis не инициализирован или не подключен.")
+    return redis_binary
@@ -1,12 +1,16 @@
-from quart import Blueprint, render_template, request, redirect, url_for, flash, current_app, session, abort
+from quart import Blueprint, render_template, request, redirect, url_for, flash, current_app, session, abort, Response
 from app.db import *
 import bcrypt
 import logging
 from quart import g
-from app.auth_token_utils import store_token, get_user_by_token, delete_token
-from app.cache_utils import get_or_cache_json
-from app.pubsub import publish_event
+from app.auth_token_utils import (
+    store_token, delete_token, get_auth_context, refresh_token_roles, get_roles_version
+)
+from app.cache_utils import get_or_cache_json, invalidate_cache, CACHE_STALE_TTL, CACHE_XFETCH_BETA
+from app.cache_codec import make_json_serializable
+from app.order_push import order_status_stream
 from app.redis_client import get_redis
+from app.pagination import decode_cursor, InvalidCursor
 import json
 
 logger = logging.getLogger(__name__)
@@ -14,33 +18,59 @@ main = Blueprint("main", __name__)
 
 @main.before_app_request
 async def load_user_roles():
+    """
+    Проверяет токен и загружает роли пользователя в g.user_roles.
+    Токен и роли берутся из Redis одним запросом; в БД идём, только если
+    роли в записи токена устарели (изменилась версия ролей).
+    """
+    g.user_roles = []
+    g.auth_context = None
+
+    # Статике авторизация не нужна
+    if request.endpoint == "static":
+        return
+
     token = session.get("auth_token")
     user_id = session.get("user_id")
 
-    # Проверка токена через Redis
-    if token:
-        redis_user_id = await get_user_by_token(token)
-        if not redis_user_id or redis_user_id != user_id:
-            # Токен невалиден — принудительно выходим
+    if not token:
+        if user_id:
+            # Нет токена, но есть user_id — тоже невалидно
             session.pop("user_id", None)
-            session.pop("auth_token", None)
-            g.user_roles = []
-            return  # пропускаем дальнейшие проверки
-    elif user_id:
-        # Нет токена, но есть user_id — тоже невалидно
-        session.pop("user_id", None)
-        g.user_roles = []
-        return
-    else:
-        g.user_roles = []
         return
 
-    # Если всё ок — загружаем роли
-    try:
-        g.user_roles = await get_user_roles(current_app.db_pool, user_id)
-    except Exception as e:
-        # БД может быть отключена — для Redis-страниц пропускаем
-        g.user_roles = []
+    # Проверка токена через Redis
+    context = await get_auth_context(token, user_id) if user_id else None
+    if context is None:
+        # Токен невалиден — принудительно выходим
+        session.pop("user_id", None)
+        session.pop("auth_token", None)
+        return  # пропускаем дальнейшие проверки
+
+    if context["stale"]:
+        # Роли изменились (или токен старого формата) — перечитываем из БД
+        try:
+            roles = await get_user_roles(current_app.db_pool, user_id)
+            await refresh_token_roles(token, user_id, roles, context["current_roles_version"])
+            context["roles"] = roles
+        except Exception as e:
+            # БД может быть отключена — страницы, которым роли не нужны, работают,
+            # но устаревшим ролям не доверяем (у пользователя могли отозвать права)
+            logger.warning(f"Не удалось обновить роли пользователя {user_id}: {e}")
+            context["roles"] = []
+
+    g.auth_context = context
+    g.user_roles = context["roles"]
+
+def cart_failure_message(failure: dict) -> str:
+    """
+    Текст сообщения для ошибки из apply_cart_changes.
+    """
+    if failure["reason"] == "not_found":
+        return f"Товар {failure['product_id']} не найден."
+    if failure["reason"] == "insufficient_stock":
+        return f"Недостаточно товара на складе для продукта {failure['product_id']} (доступно: {failure['available']})."
+    return f"Некорректные данные для товара {failure['product_id']}."
 
 @main.route("/", methods=["GET"])
 async def home():
@@ -51,19 +81,32 @@ async def home():
         query = request.args.get('q', '').strip()
         category_id = request.args.get('category', '')
         manufacturer = request.args.get('manufacturer', '').strip()
+        after = decode_cursor(request.args.get('cursor', ''), 2)
+        limit = request.args.get('limit', CATALOG_PAGE_SIZE)
 
         #categories = await get_all_categories(current_app.db_pool)
-        categories = await get_or_cache_json("cache:categories", lambda: get_all_categories(current_app.db_pool))
+        categories = await get_or_cache_json(
+            "cache:categories",
+            lambda: get_all_categories(current_app.db_pool),
+            stale_ttl=CACHE_STALE_TTL,
+            xfetch_beta=CACHE_XFETCH_BETA
+        )
         #manufacturers = await get_all_manufacturers(current_app.db_pool)
-        manufacturers = await get_or_cache_json("cache:manufacturers", lambda: get_all_manufacturers(current_app.db_pool))
-
-        products = await search_products(
-            current_app.db_pool,
-            query=query,
-            category_id=category_id,
-            manufacturer=manufacturer
+        manufacturers = await get_or_cache_json(
+            "cache:manufacturers",
+            lambda: get_all_manufacturers(current_app.db_pool),
+            stale_ttl=CACHE_STALE_TTL,
+            xfetch_beta=CACHE_XFETCH_BETA
         )
 
+        search = dict(query=query, category_id=category_id, manufacturer=manufacturer, limit=limit)
+        try:
+            products, next_cursor = await search_products(current_app.db_pool, after=after, **search)
+        except InvalidCursor:
+            # Курсор от другого запроса или повреждён — показываем первую страницу
+            after = None
+            products, next_cursor = await search_products(current_app.db_pool, **search)
+
         if query or category_id or manufacturer:
             search_message = "Результаты поиска"
         else:
@@ -74,7 +117,9 @@ async def home():
             products=products,
             categories=categories,
             manufacturers=manufacturers,
-            search_message=search_message
+            search_message=search_message,
+            next_cursor=next_cursor,
+            is_first_page=after is None
         )
     except Exception as e:
         logger.error(f"Ошибка при загрузке главной страницы: {e}")
@@ -112,6 +157,25 @@ async def profile():
         return redirect(url_for("main.home"))
 
 
+@main.route("/orders/events")
+async def order_status_events():
+    """
+    Поток server-sent events со сменой статуса заказов пользователя (для страницы профиля).
+    """
+    user_id = session.get("user_id")
+    if not user_id:
+        abort(401)
+
+    response = Response(
+        order_status_stream(user_id, resync=bool(request.headers.get("Last-Event-ID"))),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    # Соединение держится, пока открыта страница
+    response.timeout = None
+    return response
+
+
 @main.route("/register", methods=["GET", "POST"])
 async def register():
     """
@@ -131,28 +195,27 @@ async def register():
 
         hashed_password = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
 
-        async with current_app.db_pool.acquire():
-            try:
-                # Проверяем, существует ли пользователь с таким email
-                existing_user = await get_user_by_email(current_app.db_pool, email)
-                if existing_user:
-                    logger.warning(f"Пользователь с email {email} уже существует.")
-                    await flash("Пользователь с таким email уже существует.", "danger")
-                    return redirect(url_for("main.register"))
-
-                # Получаем ID роли "User"
-
-                # Создаём пользователя
-                user_id = await create_user(current_app.db_pool, username, hashed_password, email)
-                logger.info(f"Пользователь {email} успешно зарегистрирован с ID: {user_id}.")
-
-                await flash("Регистрация прошла успешно! Теперь вы можете войти.", "success")
-                return redirect(url_for("main.login"))
-            except Exception as e:
-                logger.error(f"Ошибка при регистрации пользователя {email}: {e}")
-                await flash("Произошла ошибка. Попробуйте ещё раз.", "danger")
+        try:
+            # Проверяем, существует ли пользователь с таким email
+            existing_user = await get_user_by_email(current_app.db_pool, email)
+            if existing_user:
+                logger.warning(f"Пользователь с email {email} уже существует.")
+                await flash("Пользователь с таким email уже существует.", "danger")
                 return redirect(url_for("main.register"))
 
+            # Получаем ID роли "User"
+
+            # Создаём пользователя
+            user_id = await create_user(current_app.db_pool, username, hashed_password, email)
+            logger.info(f"Пользователь {email} успешно зарегистрирован с ID: {user_id}.")
+
+            await flash("Регистрация прошла успешно! Теперь вы можете войти.", "success")
+            return redirect(url_for("main.login"))
+        except Exception as e:
+            logger.error(f"Ошибка при регистрации пользователя {email}: {e}")
+            await flash("Произошла ошибка. Попробуйте ещё раз.", "danger")
+            return redirect(url_for("main.register"))
+
     return await render_template("register.html")
 
 @main.route("/login", methods=["GET", "POST"])
@@ -189,8 +252,12 @@ async def login():
         logger.info(f"Пользователь {email} успешно авторизовался.")
         session["user_id"] = str(user["user_id"])  # Используем session для сохранения user_id
 
+        # Роли сохраняем вместе с токеном, чтобы не читать их из БД на каждом запросе
+        roles_version = await get_roles_version(str(user["user_id"]))
+        roles = await get_user_roles(current_app.db_pool, str(user["user_id"]))
+
         token = str(uuid.uuid4())
-        await store_token(token, str(user["user_id"]))
+        await store_token(token, str(user["user_id"]), roles, roles_version)
         session["auth_token"] = token
 
         await flash(f"Добро пожаловать, {user['username']}!", "success")
@@ -256,8 +323,11 @@ async def update_cart():
             quantities[product_id] = form.get(key)
 
     try:
-        await update_cart_quantities(current_app.db_pool, user_id, quantities)
-        await flash("Корзина обновлена.", "success")
+        failures = await update_cart_quantities(current_app.db_pool, user_id, quantities)
+        for failure in failures:
+            await flash(cart_failure_message(failure), "danger")
+        if len(failures) < len(quantities):
+            await flash("Корзина обновлена.", "success")
     except Exception as e:
         logger.error(f"Ошибка при обновлении корзины: {e}")
         await flash(str(e), "danger")
@@ -277,10 +347,6 @@ async def place_order():
 
     try:
         await process_order(current_app.db_pool, user_id)
-        await publish_event("orders", {
-            "type": "new_order",
-            "user_id": user_id
-        })
         await flash("Заказ успешно оформлен!", "success")
     except Exception as e:
         logger.error(f"Ошибка при оформлении заказа: {e}")
@@ -304,18 +370,10 @@ async def repeat_order():
         return redirect(url_for("main.profile"))
 
     try:
-        async with current_app.db_pool.acquire() as conn:
-            # Получаем товары из заказа
-            products = await conn.fetch("""
-                SELECT product_id, quantity
-                FROM order_items
-                WHERE order_id = $1
-            """, order_id)
-
-            # Добавляем товары в корзину
-            for product in products:
-                await add_to_cart(current_app.db_pool, user_id, product["product_id"], product["quantity"])
-
+        # Все товары заказа добавляются в корзину одним запросом
+        failures = await repeat_order_to_cart(current_app.db_pool, user_id, order_id)
+        for failure in failures:
+            await flash(cart_failure_message(failure), "warning")
         await flash("Заказ успешно добавлен в корзину.", "success")
     except Exception as e:
         current_app.logger.error(f"Ошибка при повторении заказа {order_id}: {e}")
@@ -339,19 +397,16 @@ async def add_item_to_cart():
     quantity = int(form.get("quantity", 1))
 
     try:
-        # Проверяем, существует ли товар с таким ID
-        product = await get_product_by_id(current_app.db_pool, product_id)
-        if not product:
-            await flash("Товар не найден.", "danger")
-            return redirect(url_for("main.home"))
-
         # Проверяем, что количество корректно
-        if quantity < 1 or quantity > product["stock"]:
+        if quantity < 1:
             await flash("Некорректное количество товара.", "warning")
             return redirect(url_for("main.home"))
 
-        # Добавляем товар в корзину
-        await add_to_cart(current_app.db_pool, user_id, product_id, quantity)
+        # Добавляем товар в корзину; наличие товара и остаток проверяются в том же запросе
+        failures = await add_to_cart(current_app.db_pool, user_id, product_id, quantity)
+        if failures:
+            await flash(cart_failure_message(failures[0]), "warning")
+            return redirect(url_for("main.home"))
         await flash("Товар успешно добавлен в корзину.", "success")
     except Exception as e:
         logger.error(f"Ошибка при добавлении товара в корзину: {e}")
@@ -405,6 +460,7 @@ async def product_page(product_id):
 
         try:
             await add_review(current_app.db_pool, product_id, user_id, rating, comment)
+            await invalidate_cache(f"cache:reviews:{product_id}")
             await flash("Ваш отзыв успешно добавлен.", "success")
         except Exception as e:
             logger.error(f"Ошибка при добавлении отзыва: {e}")
@@ -417,19 +473,59 @@ async def product_page(product_id):
         product = await get_or_cache_json(
             f"cache:product:{product_id}",
             lambda: get_product_by_id(current_app.db_pool, product_id),
-            ttl=600
+            ttl=600,
+            stale_ttl=CACHE_STALE_TTL,
+            xfetch_beta=CACHE_XFETCH_BETA
         )
         if not product:
             await flash("Товар не найден.", "danger")
             return redirect(url_for("main.home"))
 
-        reviews = await get_reviews_by_product_id(current_app.db_pool, product_id)
-        return await render_template("product.html", product=product, reviews=reviews)
+        # Первая страница отзывов и рейтинг кешируются до нового отзыва
+        reviews = await get_or_cache_json(
+            f"cache:reviews:{product_id}",
+            lambda: load_first_reviews_page(product_id),
+            ttl=600
+        )
+        return await render_template(
+            "product.html",
+            product=product,
+            reviews=reviews["reviews"],
+            next_cursor=reviews["next_cursor"],
+            rating=reviews["rating"]
+        )
     except Exception as e:
         logger.error(f"Ошибка при загрузке страницы товара: {e}")
         await flash("Произошла ошибка при загрузке страницы товара.", "danger")
         return redirect(url_for("main.home"))
 
+async def load_first_reviews_page(product_id: str) -> dict:
+    """
+    Первая страница отзывов о товаре, курсор следующей и рейтинг — для кеша страницы товара.
+    """
+    reviews, next_cursor = await get_reviews_page(current_app.db_pool, product_id)
+    rating = await get_product_rating(current_app.db_pool, product_id)
+    return {"reviews": reviews, "next_cursor": next_cursor, "rating": rating}
+
+@main.route("/product/<product_id>/reviews", methods=["GET"])
+async def product_reviews(product_id):
+    """
+    Следующие страницы отзывов о товаре в формате JSON (курсор из предыдущей страницы).
+    """
+    after = decode_cursor(request.args.get('cursor', ''), 2)
+    if after is None:
+        return {"error": "Неверный курсор."}, 400
+    try:
+        reviews, next_cursor = await get_reviews_page(
+            current_app.db_pool,
+            product_id,
+            after=after,
+            limit=request.args.get('limit', REVIEWS_PAGE_SIZE)
+        )
+    except ValueError:
+        return {"error": "Неверный курсор."}, 400
+    return {"reviews": make_json_serializable(reviews), "next_cursor": next_cursor}
+
 @main.route("/cache")
 async def demo_cache_only():
     """
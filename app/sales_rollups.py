@@ -0,0 +1,29 @@
+import os
+import asyncio
+import logging
+from app.db import fold_sales_rollup_deltas
+
+logger = logging.getLogger(__name__)
+
+# Перенос изменений продаж из sales_rollup_delta в дневные агрегаты (см. schema.sql).
+# Задача запускается в каждом процессе; переносит за раз один из них.
+
+SALES_ROLLUP_FOLD_INTERVAL = float(os.getenv("SALES_ROLLUP_FOLD_INTERVAL", 5))
+SALES_ROLLUP_FOLD_BATCH = int(os.getenv("SALES_ROLLUP_FOLD_BATCH", 10_000))
+
+
+async def fold_sales_rollups(pool):
+    """
+    Фоновая задача процесса: раз в SALES_ROLLUP_FOLD_INTERVAL секунд переносит
+    накопленные изменения в агрегаты; полная пачка — сразу берёт следующую.
+    """
+    while True:
+        try:
+            folded = await fold_sales_rollup_deltas(pool, SALES_ROLLUP_FOLD_BATCH)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка переноса изменений в агрегаты продаж: {e}")
+            folded = 0
+        if folded < SALES_ROLLUP_FOLD_BATCH:
+            await asyncio.sleep(SALES_ROLLUP_FOLD_INTERVAL)
@@ -0,0 +1,162 @@
+import os
+import re
+import time
+import random
+import asyncio
+import logging
+import asyncpg
+from collections import deque
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Запрос дольше порога попадает в лог медленных запросов
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 200))
+# Доля медленных запросов, для которых снимается план EXPLAIN (ANALYZE, BUFFERS)
+SLOW_QUERY_EXPLAIN_RATE = float(os.getenv("SLOW_QUERY_EXPLAIN_RATE", 0.1))
+# Не чаще одного плана на запрос реестра за интервал, секунды
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL", 60))
+# Ограничение времени выполнения самого EXPLAIN ANALYZE, мс
+SLOW_QUERY_EXPLAIN_TIMEOUT_MS = int(os.getenv("SLOW_QUERY_EXPLAIN_TIMEOUT_MS", 10000))
+# Сколько последних медленных запросов хранить для страницы админки
+SLOW_QUERY_BUFFER_SIZE = int(os.getenv("SLOW_QUERY_BUFFER_SIZE", 100))
+
+# Кольцевой буфер последних медленных запросов (новые в конце)
+slow_queries = deque(maxlen=SLOW_QUERY_BUFFER_SIZE)
+
+# Отдельный пул на одно соединение для EXPLAIN (задаётся при запуске)
+_explain_pool = None
+# Имя запроса -> время последнего снятого плана (time.monotonic)
+_last_explain = {}
+# Выполняющиеся задачи EXPLAIN (ссылки, чтобы задачи не собрал сборщик мусора)
+_explain_tasks = set()
+
+# EXPLAIN ANALYZE выполняет запрос, поэтому его снимаем только для чтения;
+# для изменяющих запросов — план без выполнения. Изменяющими считаются также
+# SELECT с блокировкой строк (FOR UPDATE/SHARE) и вызовы функций без FROM
+# (SELECT checkout_user_order($1)): функция может изменять данные.
+_READ_ONLY_RE = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+_WRITE_RE = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE)\b", re.IGNORECASE)
+_LOCKING_RE = re.compile(r"\bFOR\s+(NO\s+KEY\s+UPDATE|UPDATE|KEY\s+SHARE|SHARE)\b", re.IGNORECASE)
+_FUNCTION_CALL_RE = re.compile(r"^\s*SELECT\s+[\w.]+\s*\(", re.IGNORECASE)
+_FROM_RE = re.compile(r"\bFROM\b", re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def init_slow_query_log(pool):
+    """
+    Задаёт пул для снятия планов медленных запросов — отдельный от основного
+    (db_pool.create_service_pool), чтобы EXPLAIN ANALYZE не занимал соединения
+    приложения. Пока снимается один план, другие не запускаются.
+
+    Время замеряется только для запросов реестра (queries._run). Запросы,
+    выполняемые напрямую через conn.execute/fetch, COPY и курсоры (выгрузки,
+    импорт товаров, задачи резервного копирования), в лог не попадают.
+    """
+    global _explain_pool
+    _explain_pool = pool
+
+
+async def close_slow_query_log():
+    global _explain_pool
+    if _explain_pool is not None:
+        pool, _explain_pool = _explain_pool, None
+        await pool.close()
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Текст запроса в одну строку. Значения в запросах реестра передаются
+    параметрами ($1, $2, ...), поэтому в тексте их нет.
+    """
+    return _WHITESPACE_RE.sub(" ", sql).strip()
+
+
+def param_shape(value) -> str:
+    """
+    Тип параметра без значения: для списков — тип элементов и длина.
+    """
+    if isinstance(value, (list, tuple)):
+        inner = type(value[0]).__name__ if value else "?"
+        return f"{inner}[{len(value)}]"
+    if value is None:
+        return "null"
+    return type(value).__name__
+
+
+def is_read_only(sql: str) -> bool:
+    if not _READ_ONLY_RE.match(sql) or _WRITE_RE.search(sql) or _LOCKING_RE.search(sql):
+        return False
+    return not (_FUNCTION_CALL_RE.match(sql) and not _FROM_RE.search(sql))
+
+
+def record_slow_query(conn, name: str, sql: str, args, elapsed: float):
+    """
+    Вызывается для каждого выполненного запроса реестра (см. queries._run).
+    Медленный запрос логируется и попадает в буфер; для части из них
+    в фоне снимается план на отдельном соединении.
+    """
+    elapsed_ms = elapsed * 1000
+    if elapsed_ms < SLOW_QUERY_MS:
+        return
+
+    shapes = [param_shape(arg) for arg in args]
+    entry = {
+        "name": name,
+        "sql": normalize_sql(sql),
+        "params": shapes,
+        "duration_ms": round(elapsed_ms, 1),
+        "in_transaction": conn.is_in_transaction(),
+        "at": datetime.now().isoformat(timespec="seconds"),
+        "plan": None,
+    }
+    slow_queries.append(entry)
+    logger.warning(f"Медленный запрос {name}: {elapsed_ms:.1f} мс, параметры ({', '.join(shapes)}): {entry['sql']}")
+
+    now = time.monotonic()
+    if (_explain_pool is None
+            or _explain_tasks
+            or random.random() >= SLOW_QUERY_EXPLAIN_RATE
+            or now - _last_explain.get(name, float("-inf")) < SLOW_QUERY_EXPLAIN_INTERVAL):
+        return
+    _last_explain[name] = now
+    task = asyncio.ensure_future(_explain(entry, sql, args))
+    _explain_tasks.add(task)
+    task.add_done_callback(_explain_tasks.discard)
+
+
+async def _explain(entry: dict, sql: str, args):
+    """
+    Снимает план запроса с теми же параметрами. ANALYZE — только для чтения,
+    в транзакции READ ONLY с ограничением по времени. Если запрос всё же
+    пытается писать (например, через функцию), снимается план без выполнения.
+    """
+    analyze = is_read_only(sql)
+    try:
+        try:
+            rows = await _fetch_plan(sql, args, analyze)
+        except asyncpg.exceptions.ReadOnlySQLTransactionError:
+            if not analyze:
+                raise
+            analyze = False
+            rows = await _fetch_plan(sql, args, analyze)
+        entry["plan"] = "\n".join(row[0] for row in rows)
+        entry["analyzed"] = analyze
+    except Exception as e:
+        logger.warning(f"Не удалось снять план запроса {entry['name']}: {e}")
+        entry["plan"] = f"Ошибка EXPLAIN: {e}"
+
+
+async def _fetch_plan(sql: str, args, analyze: bool):
+    options = "ANALYZE, BUFFERS" if analyze else "VERBOSE"
+    async with _explain_pool.acquire() as conn:
+        async with conn.transaction(readonly=True):
+            await conn.execute(f"SET LOCAL statement_timeout = {SLOW_QUERY_EXPLAIN_TIMEOUT_MS}")
+            return await conn.fetch(f"EXPLAIN ({options}) {sql}", *args)
+
+
+def get_slow_queries() -> list:
+    """
+    Медленные запросы из буфера, новые первыми.
+    """
+    return list(reversed(slow_queries))
@@ -1,5 +1,7 @@
 from functools import wraps
-from quart import session, redirect, url_for, flash, current_app
+from quart import session, redirect, url_for, flash, current_app, g
+from markupsafe import Markup, escape
+from datetime import datetime
 from app.db import *
 
 def admin_required(func):
@@ -10,9 +12,36 @@ def admin_required(func):
             await flash("Пожалуйста, войдите в систему.", "warning")
             return redirect(url_for('main.login'))
         # Проверяем, есть ли у пользователя роль 'Admin'
-        roles = await get_user_roles(current_app.db_pool, user_id)
+        # (роли уже загружены в load_user_roles вместе с токеном)
+        if getattr(g, 'auth_context', None) is not None:
+            roles = g.user_roles
+        else:
+            roles = await get_user_roles(current_app.db_pool, user_id)
         if 'Admin' not in roles:
             await flash("Доступ запрещен.", "danger")
             return redirect(url_for('main.home'))
         return await func(*args, **kwargs)
     return decorated_view
+
+
+def highlight(snippet):
+    """
+    Шаблонный фильтр: экранирует фрагмент из ts_headline и
+    заменяет маркеры совпадений на <mark>.
+    """
+    if not snippet:
+        return ''
+    html = str(escape(snippet))
+    return Markup(html.replace(SNIPPET_START, '<mark>').replace(SNIPPET_STOP, '</mark>'))
+
+
+def format_datetime(value, fmt='%Y-%m-%d %H:%M'):
+    """
+    Шаблонный фильтр: форматирует дату. Значение из кеша в формате JSON
+    приходит строкой ISO 8601 — её сначала разбираем.
+    """
+    if not value:
+        return ''
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.strftime(fmt)
@@ -294,4 +294,452 @@ BEGIN
     -- Очищаем корзину пользователя
     DELETE FROM cart WHERE user_id = uid;
 END;
-$$;
\ No newline at end of file
+$$;
+-- Индексы для постраничного (keyset) просмотра каталога по (name, product_id)
+CREATE INDEX IF NOT EXISTS idx_products_name_id ON products (name, product_id);
+CREATE INDEX IF NOT EXISTS idx_products_category_name_id ON products (category_id, name, product_id);
+
+-- Полнотекстовый и триграммный поиск товаров
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Поисковый вектор: название (вес A) важнее описания (вес B)
+ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'B')
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_products_search_vector ON products USING gin (search_vector);
+-- Триграммы: опечатки (%) и поиск подстроки (ILIKE) по названию и производителю
+CREATE INDEX IF NOT EXISTS idx_products_name_trgm ON products USING gin (name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_products_manufacturer_trgm ON products USING gin (manufacturer gin_trgm_ops);
+
+-- Оформление заказа без гонок за остатками.
+-- Строки корзины и товаров блокируются в порядке product_id (без взаимных
+-- блокировок между покупателями и без двойного оформления одной корзины), остатки списываются одним условным UPDATE,
+-- позиции заказа вставляются одним INSERT ... SELECT. Возвращает order_id.
+CREATE OR REPLACE FUNCTION checkout_user_order(uid UUID)
+RETURNS UUID
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    new_order_id UUID := uuid_generate_v4();
+    items_count INT;
+    updated_count INT;
+    order_total NUMERIC := 0;
+    short_product UUID;
+BEGIN
+    -- Блокируем товары корзины в детерминированном порядке и считаем сумму по актуальным ценам
+    SELECT COUNT(*), COALESCE(SUM(locked.price * locked.quantity), 0)
+    INTO items_count, order_total
+    FROM (
+        SELECT p.price, c.quantity
+        FROM cart c
+        JOIN products p ON p.product_id = c.product_id
+        WHERE c.user_id = uid
+        ORDER BY p.product_id
+        FOR UPDATE OF c, p
+    ) locked;
+
+    IF items_count = 0 THEN
+        RAISE EXCEPTION 'Корзина пуста.';
+    END IF;
+
+    -- Списываем остатки одним запросом; строки без достаточного остатка не обновятся
+    UPDATE products p
+    SET stock = p.stock - c.quantity
+    FROM cart c
+    WHERE c.user_id = uid
+      AND p.product_id = c.product_id
+      AND p.stock >= c.quantity;
+    GET DIAGNOSTICS updated_count = ROW_COUNT;
+
+    IF updated_count < items_count THEN
+        SELECT c.product_id INTO short_product
+        FROM cart c
+        JOIN products p ON p.product_id = c.product_id
+        WHERE c.user_id = uid AND p.stock < c.quantity
+        ORDER BY c.product_id
+        LIMIT 1;
+        RAISE EXCEPTION 'Недостаточно товара на складе для продукта %', short_product;
+    END IF;
+
+    INSERT INTO orders (order_id, user_id, total_cost, order_date, status)
+    VALUES (new_order_id, uid, order_total, NOW(), 'Pending');
+
+    INSERT INTO order_items (order_id, product_id, quantity, price)
+    SELECT new_order_id, c.product_id, c.quantity, p.price
+    FROM cart c
+    JOIN products p ON p.product_id = c.product_id
+    WHERE c.user_id = uid;
+
+    -- Очищаем корзину пользователя
+    DELETE FROM cart WHERE user_id = uid;
+
+    RETURN new_order_id;
+END;
+$$;
+
+-- Старая процедура оставлена для совместимости и использует новую функцию
+CREATE OR REPLACE PROCEDURE process_user_order(uid UUID)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM checkout_user_order(uid);
+END;
+$$;
+
+-- Дневные агрегаты продаж для аналитики (get_analytics, get_top_sales).
+-- Триггеры на вставку позиций заказов и удаление заказов только дописывают изменения
+-- в sales_rollup_delta; в агрегаты их переносит fold_sales_rollup_deltas()
+-- (фоновая задача приложения, раз в несколько секунд).
+-- Пересчитываются из истории функцией rebuild_sales_rollups (scripts/backfill_sales_rollups.py).
+CREATE TABLE IF NOT EXISTS sales_daily_product (
+    sale_date DATE NOT NULL,
+    product_id UUID NOT NULL,
+    category_id UUID,  -- категория товара на момент продажи
+    quantity BIGINT NOT NULL,
+    revenue NUMERIC(14, 2) NOT NULL,
+    PRIMARY KEY (sale_date, product_id),
+    CONSTRAINT sales_daily_product_product_id_fkey FOREIGN KEY (product_id) REFERENCES products(product_id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_sales_daily_product_product ON sales_daily_product (product_id);
+
+CREATE TABLE IF NOT EXISTS sales_daily_category (
+    sale_date DATE NOT NULL,
+    category_id UUID,  -- NULL — товары без категории
+    quantity BIGINT NOT NULL,
+    revenue NUMERIC(14, 2) NOT NULL
+);
+-- Уникальность с учётом NULL-категории (для ON CONFLICT)
+CREATE UNIQUE INDEX IF NOT EXISTS idx_sales_daily_category_key
+    ON sales_daily_category (sale_date, COALESCE(category_id, '00000000-0000-0000-0000-000000000000'::uuid));
+
+CREATE INDEX IF NOT EXISTS idx_orders_date_id ON orders (order_date, order_id);
+
+-- Изменения агрегатов, ещё не перенесённые в sales_daily_*.
+-- Оформление заказа не обновляет общие строки агрегатов (день × категория):
+-- иначе параллельные заказы одной категории ждали бы друг друга до фиксации.
+CREATE TABLE IF NOT EXISTS sales_rollup_delta (
+    delta_id BIGSERIAL PRIMARY KEY,
+    sale_date DATE NOT NULL,
+    product_id UUID NOT NULL,
+    category_id UUID,
+    quantity BIGINT NOT NULL,
+    revenue NUMERIC(14, 2) NOT NULL
+);
+
+-- Записывает вставленные позиции заказов в sales_rollup_delta (один раз на оператор INSERT).
+CREATE OR REPLACE FUNCTION sales_rollup_add_items()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO sales_rollup_delta (sale_date, product_id, category_id, quantity, revenue)
+    SELECT o.order_date::date, n.product_id, p.category_id,
+           SUM(n.quantity), SUM(n.price * n.quantity)
+    FROM new_items n
+    JOIN orders o ON o.order_id = n.order_id
+    JOIN products p ON p.product_id = n.product_id
+    GROUP BY 1, 2, 3;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS sales_rollup_items_trigger ON order_items;
+CREATE TRIGGER sales_rollup_items_trigger
+AFTER INSERT ON order_items
+REFERENCING NEW TABLE AS new_items
+FOR EACH STATEMENT
+EXECUTE FUNCTION sales_rollup_add_items();
+
+-- Переносит накопленные изменения в агрегаты (не больше max_rows строк за вызов)
+-- и возвращает число перенесённых строк. Одновременно работает один вызов,
+-- остальные сразу возвращают 0. Строки агрегатов обновляются в порядке ключа.
+CREATE OR REPLACE FUNCTION fold_sales_rollup_deltas(max_rows INT DEFAULT 10000)
+RETURNS INT AS $$
+DECLARE
+    folded INT;
+BEGIN
+    IF NOT pg_try_advisory_xact_lock(hashtext('sales_rollup_delta')) THEN
+        RETURN 0;
+    END IF;
+
+    WITH moved AS (
+        DELETE FROM sales_rollup_delta
+        WHERE delta_id IN (SELECT delta_id FROM sales_rollup_delta ORDER BY delta_id LIMIT max_rows)
+        RETURNING sale_date, product_id, category_id, quantity, revenue
+    ), delta AS (
+        -- Изменения уже удалённых товаров пропускаем: их агрегаты удалены
+        SELECT m.sale_date, m.product_id, (array_agg(m.category_id))[1] AS category_id,
+               SUM(m.quantity) AS quantity, SUM(m.revenue) AS revenue
+        FROM moved m
+        JOIN products p ON p.product_id = m.product_id
+        GROUP BY m.sale_date, m.product_id
+    ), product_rows AS (
+        INSERT INTO sales_daily_product AS s (sale_date, product_id, category_id, quantity, revenue)
+        SELECT sale_date, product_id, category_id, quantity, revenue
+        FROM delta
+        ORDER BY sale_date, product_id
+        ON CONFLICT (sale_date, product_id) DO UPDATE
+        SET quantity = s.quantity + EXCLUDED.quantity,
+            revenue = s.revenue + EXCLUDED.revenue
+        -- категория берётся из строки агрегата: она могла быть записана раньше под другой категорией
+        RETURNING s.sale_date, s.product_id, s.category_id
+    ), category_rows AS (
+        INSERT INTO sales_daily_category AS s (sale_date, category_id, quantity, revenue)
+        SELECT r.sale_date, r.category_id, SUM(d.quantity), SUM(d.revenue)
+        FROM product_rows r
+        JOIN delta d ON d.sale_date = r.sale_date AND d.product_id = r.product_id
+        GROUP BY r.sale_date, r.category_id
+        ORDER BY r.sale_date, r.category_id
+        ON CONFLICT (sale_date, COALESCE(category_id, '00000000-0000-0000-0000-000000000000'::uuid)) DO UPDATE
+        SET quantity = s.quantity + EXCLUDED.quantity,
+            revenue = s.revenue + EXCLUDED.revenue
+        RETURNING 1
+    )
+    SELECT COUNT(*) INTO folded FROM moved;
+    RETURN folded;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Записывает позиции удаляемого заказа в sales_rollup_delta с обратным знаком
+-- (позиции ещё на месте — триггер BEFORE).
+CREATE OR REPLACE FUNCTION sales_rollup_remove_order()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO sales_rollup_delta (sale_date, product_id, category_id, quantity, revenue)
+    SELECT OLD.order_date::date, oi.product_id, p.category_id,
+           -SUM(oi.quantity), -SUM(oi.price * oi.quantity)
+    FROM order_items oi
+    JOIN products p ON p.product_id = oi.product_id
+    WHERE oi.order_id = OLD.order_id
+    GROUP BY oi.product_id, p.category_id;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS sales_rollup_order_delete_trigger ON orders;
+CREATE TRIGGER sales_rollup_order_delete_trigger
+BEFORE DELETE ON orders
+FOR EACH ROW
+EXECUTE FUNCTION sales_rollup_remove_order();
+
+-- При удалении товара его продажи пропадают из аналитики (как и раньше, когда
+-- позиции заказов удалялись каскадно): вычитаем их из агрегатов по категориям,
+-- строки по товару удалятся каскадно. Неперенесённые изменения товара отбрасываются
+-- (если их сейчас переносят, DELETE дождётся конца переноса).
+CREATE OR REPLACE FUNCTION sales_rollup_remove_product()
+RETURNS TRIGGER AS $$
+BEGIN
+    DELETE FROM sales_rollup_delta WHERE product_id = OLD.product_id;
+
+    UPDATE sales_daily_category s
+    SET quantity = s.quantity - p.quantity,
+        revenue = s.revenue - p.revenue
+    FROM sales_daily_product p
+    WHERE p.product_id = OLD.product_id
+      AND s.sale_date = p.sale_date
+      AND s.category_id IS NOT DISTINCT FROM p.category_id;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS sales_rollup_product_delete_trigger ON products;
+CREATE TRIGGER sales_rollup_product_delete_trigger
+BEFORE DELETE ON products
+FOR EACH ROW
+EXECUTE FUNCTION sales_rollup_remove_product();
+
+-- Пересчёт агрегатов за период [from_date, to_date] из заказов.
+-- На время пересчёта вставка позиций заказов и перенос изменений блокируются,
+-- поэтому период стоит брать небольшим (скрипт идёт по месяцам).
+-- Неперенесённые изменения за период отбрасываются: они уже учтены в заказах.
+CREATE OR REPLACE FUNCTION rebuild_sales_rollups(from_date DATE, to_date DATE)
+RETURNS VOID AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('sales_rollup_delta'));
+    LOCK TABLE order_items IN SHARE MODE;
+
+    DELETE FROM sales_rollup_delta WHERE sale_date BETWEEN from_date AND to_date;
+    DELETE FROM sales_daily_product WHERE sale_date BETWEEN from_date AND to_date;
+    DELETE FROM sales_daily_category WHERE sale_date BETWEEN from_date AND to_date;
+
+    INSERT INTO sales_daily_product (sale_date, product_id, category_id, quantity, revenue)
+    SELECT o.order_date::date, oi.product_id, p.category_id,
+           SUM(oi.quantity), SUM(oi.price * oi.quantity)
+    FROM orders o
+    JOIN order_items oi ON oi.order_id = o.order_id
+    JOIN products p ON p.product_id = oi.product_id
+    WHERE o.order_date >= from_date AND o.order_date < to_date + 1
+    GROUP BY 1, 2, 3;
+
+    INSERT INTO sales_daily_category (sale_date, category_id, quantity, revenue)
+    SELECT sale_date, category_id, SUM(quantity), SUM(revenue)
+    FROM sales_daily_product
+    WHERE sale_date BETWEEN from_date AND to_date
+    GROUP BY sale_date, category_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Агрегаты оценок товаров: число и сумма оценок и распределение по звёздам.
+-- Обновляются триггерами на reviews; reconcile_product_ratings() исправляет расхождения
+-- (scripts/reconcile_product_ratings.py).
+CREATE TABLE IF NOT EXISTS product_ratings (
+    product_id UUID PRIMARY KEY,
+    rating_count INT NOT NULL DEFAULT 0,
+    rating_sum INT NOT NULL DEFAULT 0,
+    rating_1 INT NOT NULL DEFAULT 0,
+    rating_2 INT NOT NULL DEFAULT 0,
+    rating_3 INT NOT NULL DEFAULT 0,
+    rating_4 INT NOT NULL DEFAULT 0,
+    rating_5 INT NOT NULL DEFAULT 0,
+    CONSTRAINT product_ratings_product_id_fkey FOREIGN KEY (product_id) REFERENCES products(product_id) ON DELETE CASCADE
+);
+
+-- Применяет изменения отзывов к агрегатам (один раз на оператор, в том числе для COPY).
+CREATE OR REPLACE FUNCTION product_ratings_apply()
+RETURNS TRIGGER AS $$
+DECLARE
+    ids UUID[];
+    ratings INT[];
+    signs INT[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(product_id), array_agg(rating), array_agg(1)
+        INTO ids, ratings, signs
+        FROM new_rows;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT array_agg(product_id), array_agg(rating), array_agg(-1)
+        INTO ids, ratings, signs
+        FROM old_rows;
+    ELSE
+        SELECT array_agg(product_id), array_agg(rating), array_agg(sign)
+        INTO ids, ratings, signs
+        FROM (
+            SELECT product_id, rating, 1 AS sign FROM new_rows
+            UNION ALL
+            SELECT product_id, rating, -1 AS sign FROM old_rows
+        ) changed;
+    END IF;
+
+    -- Товары, удаляемые вместе с отзывами (каскадно), пропускаем: их агрегаты удалятся сами
+    INSERT INTO product_ratings AS pr
+        (product_id, rating_count, rating_sum, rating_1, rating_2, rating_3, rating_4, rating_5)
+    SELECT d.product_id,
+           SUM(d.sign),
+           SUM(d.sign * d.rating),
+           SUM(CASE WHEN d.rating = 1 THEN d.sign ELSE 0 END),
+           SUM(CASE WHEN d.rating = 2 THEN d.sign ELSE 0 END),
+           SUM(CASE WHEN d.rating = 3 THEN d.sign ELSE 0 END),
+           SUM(CASE WHEN d.rating = 4 THEN d.sign ELSE 0 END),
+           SUM(CASE WHEN d.rating = 5 THEN d.sign ELSE 0 END)
+    FROM unnest(ids, ratings, signs) AS d(product_id, rating, sign)
+    JOIN products p ON p.product_id = d.product_id
+    GROUP BY d.product_id
+    ORDER BY d.product_id
+    ON CONFLICT (product_id) DO UPDATE
+    SET rating_count = pr.rating_count + EXCLUDED.rating_count,
+        rating_sum = pr.rating_sum + EXCLUDED.rating_sum,
+        rating_1 = pr.rating_1 + EXCLUDED.rating_1,
+        rating_2 = pr.rating_2 + EXCLUDED.rating_2,
+        rating_3 = pr.rating_3 + EXCLUDED.rating_3,
+        rating_4 = pr.rating_4 + EXCLUDED.rating_4,
+        rating_5 = pr.rating_5 + EXCLUDED.rating_5;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS product_ratings_insert_trigger ON reviews;
+CREATE TRIGGER product_ratings_insert_trigger
+AFTER INSERT ON reviews
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION product_ratings_apply();
+
+DROP TRIGGER IF EXISTS product_ratings_update_trigger ON reviews;
+CREATE TRIGGER product_ratings_update_trigger
+AFTER UPDATE ON reviews
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION product_ratings_apply();
+
+DROP TRIGGER IF EXISTS product_ratings_delete_trigger ON reviews;
+CREATE TRIGGER product_ratings_delete_trigger
+AFTER DELETE ON reviews
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION product_ratings_apply();
+
+-- Пересчитывает агрегаты из reviews и возвращает число исправленных строк.
+-- На время пересчёта изменения отзывов блокируются, чтобы не потерять их.
+CREATE OR REPLACE FUNCTION reconcile_product_ratings()
+RETURNS INT AS $$
+DECLARE
+    fixed INT;
+BEGIN
+    LOCK TABLE reviews IN SHARE MODE;
+
+    INSERT INTO product_ratings AS pr
+        (product_id, rating_count, rating_sum, rating_1, rating_2, rating_3, rating_4, rating_5)
+    SELECT p.product_id,
+           COUNT(r.rating),
+           COALESCE(SUM(r.rating), 0),
+           COUNT(*) FILTER (WHERE r.rating = 1),
+           COUNT(*) FILTER (WHERE r.rating = 2),
+           COUNT(*) FILTER (WHERE r.rating = 3),
+           COUNT(*) FILTER (WHERE r.rating = 4),
+           COUNT(*) FILTER (WHERE r.rating = 5)
+    FROM products p
+    LEFT JOIN reviews r ON r.product_id = p.product_id
+    GROUP BY p.product_id
+    ON CONFLICT (product_id) DO UPDATE
+    SET rating_count = EXCLUDED.rating_count,
+        rating_sum = EXCLUDED.rating_sum,
+        rating_1 = EXCLUDED.rating_1,
+        rating_2 = EXCLUDED.rating_2,
+        rating_3 = EXCLUDED.rating_3,
+        rating_4 = EXCLUDED.rating_4,
+        rating_5 = EXCLUDED.rating_5
+    WHERE (pr.rating_count, pr.rating_sum, pr.rating_1, pr.rating_2, pr.rating_3, pr.rating_4, pr.rating_5)
+        IS DISTINCT FROM
+          (EXCLUDED.rating_count, EXCLUDED.rating_sum, EXCLUDED.rating_1, EXCLUDED.rating_2,
+           EXCLUDED.rating_3, EXCLUDED.rating_4, EXCLUDED.rating_5);
+    GET DIAGNOSTICS fixed = ROW_COUNT;
+    RETURN fixed;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Средний рейтинг по агрегатам. Раньше условие product_id = product_id сравнивало
+-- столбец сам с собой и функция усредняла все отзывы таблицы.
+CREATE OR REPLACE FUNCTION get_average_product_rating(product_id UUID)
+RETURNS NUMERIC AS $$
+BEGIN
+    RETURN (
+        SELECT pr.rating_sum::NUMERIC / NULLIF(pr.rating_count, 0)
+        FROM product_ratings pr
+        WHERE pr.product_id = get_average_product_rating.product_id
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+-- Постраничная выдача отзывов о товаре: новые первыми, keyset по (review_date, review_id)
+CREATE INDEX IF NOT EXISTS idx_reviews_product_date_id ON reviews (product_id, review_date DESC, review_id DESC);
+
+-- Сортировка сетки товаров в админке (keyset по столбцу и product_id)
+CREATE INDEX IF NOT EXISTS idx_products_price_id ON products (price, product_id);
+CREATE INDEX IF NOT EXISTS idx_products_stock_id ON products (stock, product_id);
+CREATE INDEX IF NOT EXISTS idx_products_manufacturer_id ON products (COALESCE(manufacturer, ''), product_id);
+
+-- Консоль заказов в админке: фильтры по статусу и покупателю, keyset по (order_date, order_id)
+CREATE INDEX IF NOT EXISTS idx_orders_status_date_id ON orders (status, order_date, order_id);
+CREATE INDEX IF NOT EXISTS idx_orders_user_date_id ON orders (user_id, order_date, order_id);
+
+-- Исходящие события заказов (transactional outbox).
+-- Событие пишется в той же транзакции, что и изменение заказа, после блокировки
+-- строки заказа, поэтому события одного заказа получают возрастающие event_id
+-- в порядке фиксации. Фоновый ретранслятор (app/order_events.py) переносит их
+-- в Redis Stream в порядке event_id и удаляет отсюда.
+CREATE TABLE IF NOT EXISTS order_outbox (
+    event_id BIGSERIAL PRIMARY KEY,
+    payload JSONB NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
@@ -0,0 +1,76 @@
+# Пересчёт дневных агрегатов продаж (sales_daily_product, sales_daily_category) из истории заказов
+#
+# Запуск:
+#   python scripts/backfill_sales_rollups.py [--from 2023-01-01] [--to 2024-12-31]
+#
+# Без параметров пересчитывается весь период от первого до последнего заказа.
+# Период обрабатывается по месяцам, каждый месяц — отдельной транзакцией
+# (rebuild_sales_rollups на это время блокирует вставку позиций заказов).
+# Скрипт можно запускать повторно: данные за месяц заменяются целиком.
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+import asyncpg
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def parse_date(value: str) -> date:
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def month_ranges(start: date, end: date):
+    """
+    Разбивает [start, end] на отрезки по календарным месяцам.
+    """
+    current = start
+    while current <= end:
+        next_month = (current.replace(day=1) + timedelta(days=32)).replace(day=1)
+        yield current, min(next_month - timedelta(days=1), end)
+        current = next_month
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Пересчёт агрегатов продаж для аналитики")
+    parser.add_argument("--from", dest="start", type=parse_date, help="начальная дата (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="end", type=parse_date, help="конечная дата (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    conn = await asyncpg.connect(
+        database=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        host=os.getenv("DB_HOST"),
+        port=int(os.getenv("DB_PORT", 5432)),
+    )
+    try:
+        first, last = await conn.fetchrow("SELECT MIN(order_date)::date, MAX(order_date)::date FROM orders")
+        start = args.start or first
+        end = args.end or last
+        if start is None or end is None:
+            print("Заказов нет — пересчитывать нечего.")
+            return 0
+
+        started = time.perf_counter()
+        for month_start, month_end in month_ranges(start, end):
+            month_started = time.perf_counter()
+            async with conn.transaction():
+                await conn.execute("SELECT rebuild_sales_rollups($1, $2)", month_start, month_end)
+            print(f"{month_start} — {month_end}: {time.perf_counter() - month_started:.2f} с")
+
+        await conn.execute("ANALYZE sales_daily_product")
+        await conn.execute("ANALYZE sales_daily_category")
+        print(f"Готово за {time.perf_counter() - started:.1f} с.")
+        return 0
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
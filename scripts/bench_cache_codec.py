@@ -0,0 +1,118 @@
+# Сравнение кодеков кеша: время кодирования/декодирования и память в Redis
+#
+# Запуск:
+#   python scripts/bench_cache_codec.py [--manufacturers 50000] [--repeat 50] [--redis]
+#
+# С флагом --redis значения записываются в Redis (REDIS_URL) и для каждого
+# берётся MEMORY USAGE; ключи удаляются после замера.
+
+import argparse
+import decimal
+import os
+import random
+import sys
+import timeit
+import uuid
+from datetime import datetime, timedelta
+
+from faker import Faker
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.cache_codec import CacheCodec, JsonCodec, MsgpackCodec, msgpack
+
+
+def build_payloads(num_manufacturers: int) -> dict:
+    fake = Faker()
+    Faker.seed(42)
+    random.seed(42)
+
+    manufacturers = sorted({fake.company() for _ in range(num_manufacturers)})
+
+    def product():
+        return {
+            "product_id": uuid.uuid4(),
+            "name": fake.catch_phrase(),
+            "description": fake.text(max_nb_chars=200),
+            "category_id": uuid.uuid4(),
+            "price": decimal.Decimal(f"{random.uniform(5.0, 500.0):.2f}"),
+            "stock": random.randint(10, 1000),
+            "manufacturer": fake.company(),
+            "search_vector": None,
+        }
+
+    # Значение в режиме обновления в фоне (см. get_or_cache_json)
+    envelope = {
+        "value": product(),
+        "soft_expiry": (datetime.now() + timedelta(minutes=10)).timestamp(),
+        "delta": 0.004,
+    }
+    return {
+        "manufacturers": manufacturers,
+        "product": product(),
+        "product_envelope": envelope,
+        "catalog_page": [product() for _ in range(24)],
+    }
+
+
+def build_codecs() -> dict:
+    codecs = {
+        "json": CacheCodec(JsonCodec(), compress_min_bytes=0),
+        "json+zlib": CacheCodec(JsonCodec(), compress_min_bytes=1),
+    }
+    if msgpack is not None:
+        codecs["msgpack"] = CacheCodec(MsgpackCodec(), compress_min_bytes=0)
+        codecs["msgpack+zlib"] = CacheCodec(MsgpackCodec(), compress_min_bytes=1)
+    else:
+        print("msgpack не установлен — сравнивается только JSON.")
+    return codecs
+
+
+def redis_memory_usage(client, key: str, encoded: bytes):
+    client.set(key, encoded)
+    try:
+        return client.memory_usage(key)
+    finally:
+        client.delete(key)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк кодеков кеша")
+    parser.add_argument("--manufacturers", type=int, default=50_000)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--redis", action="store_true", help="замерить MEMORY USAGE в Redis")
+    args = parser.parse_args()
+
+    payloads = build_payloads(args.manufacturers)
+    codecs = build_codecs()
+
+    client = None
+    if args.redis:
+        import redis
+        client = redis.from_url(os.getenv("REDIS_URL", "redis://localhost"))
+
+    header = f"{'payload':<18}{'codec':<14}{'bytes':>10}{'encode, мкс':>14}{'decode, мкс':>14}"
+    if client is not None:
+        header += f"{'redis, байт':>14}"
+    print(header)
+    print("-" * len(header))
+
+    for payload_name, payload in payloads.items():
+        for codec_name, codec in codecs.items():
+            # Как в get_or_cache_json: подготовка результата запроса + кодирование
+            encode = lambda: codec.encode(codec.prepare(payload))
+            encoded = encode()
+            decode = lambda: codec.decode(encoded)
+
+            encode_us = min(timeit.repeat(encode, number=args.repeat, repeat=3)) / args.repeat * 1e6
+            decode_us = min(timeit.repeat(decode, number=args.repeat, repeat=3)) / args.repeat * 1e6
+
+            line = f"{payload_name:<18}{codec_name:<14}{len(encoded):>10}{encode_us:>14.1f}{decode_us:>14.1f}"
+            if client is not None:
+                usage = redis_memory_usage(client, f"bench:codec:{payload_name}:{codec_name}", encoded)
+                line += f"{usage:>14}"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# Нагрузочный тест оформления заказа: много покупателей на одни и те же товары
+#
+# Запуск:
+#   python scripts/bench_checkout.py [--buyers 500] [--stock 200] [--concurrency 50] [--products 1]
+#
+# Создаёт временную категорию с --products товарами (остаток каждого --stock)
+# и --buyers покупателей, у каждого в корзине одна единица одного из товаров
+# (по кругу), затем параллельно вызывает checkout_user_order. Проверяет, что
+# каждого товара продано ровно min(покупателей товара, stock) единиц и остатки
+# не ушли в минус. Временные данные удаляются после теста.
+#
+# С --products 1 все ждут блокировку одного товара; с --products 50 заказы
+# разных товаров одной категории должны идти параллельно (агрегаты продаж
+# по категории не блокируют оформление).
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+
+import asyncpg
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+async def prepare(pool, buyers: int, stock: int, products: int):
+    category_id = uuid.uuid4()
+    product_ids = [uuid.uuid4() for _ in range(products)]
+    user_ids = [uuid.uuid4() for _ in range(buyers)]
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                "INSERT INTO categories (category_id, name) VALUES ($1, $2)",
+                category_id, f"bench checkout {category_id}",
+            )
+            await conn.executemany("""
+                INSERT INTO products (product_id, name, description, category_id, price, stock, manufacturer)
+                VALUES ($1, 'bench checkout product', 'bench', $2, 10.00, $3, 'bench')
+            """, [(product_id, category_id, stock) for product_id in product_ids])
+            await conn.copy_records_to_table(
+                "users",
+                records=[(uid, "bench", "bench", f"bench-{uid}@example.com") for uid in user_ids],
+                columns=["user_id", "username", "hashed_password", "email"],
+            )
+            await conn.copy_records_to_table(
+                "cart",
+                records=[(uid, product_ids[i % products], 1) for i, uid in enumerate(user_ids)],
+                columns=["user_id", "product_id", "quantity"],
+            )
+    return category_id, product_ids, user_ids
+
+
+async def cleanup(pool, category_id, product_ids, user_ids):
+    async with pool.acquire() as conn:
+        # Заказы и корзины удаляются каскадно вместе с пользователями
+        await conn.execute("DELETE FROM users WHERE user_id = ANY($1::uuid[])", user_ids)
+        await conn.execute("DELETE FROM products WHERE product_id = ANY($1::uuid[])", product_ids)
+        await conn.execute("DELETE FROM categories WHERE category_id = $1", category_id)
+
+
+async def checkout(pool, user_id, latencies: list) -> bool:
+    started = time.perf_counter()
+    try:
+        async with pool.acquire() as conn:
+            await conn.fetchval("SELECT checkout_user_order($1)", user_id)
+        return True
+    except asyncpg.RaiseError:
+        return False
+    finally:
+        latencies.append(time.perf_counter() - started)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Конкурентное оформление заказов на товары одной категории")
+    parser.add_argument("--buyers", type=int, default=500)
+    parser.add_argument("--stock", type=int, default=200, help="остаток каждого товара")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--products", type=int, default=1, help="сколько товаров в категории")
+    args = parser.parse_args()
+
+    pool = await asyncpg.create_pool(
+        database=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        host=os.getenv("DB_HOST"),
+        port=int(os.getenv("DB_PORT", 5432)),
+        min_size=args.concurrency,
+        max_size=args.concurrency,
+    )
+    category_id, product_ids, user_ids = await prepare(pool, args.buyers, args.stock, args.products)
+    try:
+        latencies = []
+        started = time.perf_counter()
+        results = await asyncio.gather(*(checkout(pool, uid, latencies) for uid in user_ids))
+        elapsed = time.perf_counter() - started
+
+        async with pool.acquire() as conn:
+            final_stock = await conn.fetchval(
+                "SELECT SUM(stock) FROM products WHERE product_id = ANY($1::uuid[])", product_ids
+            )
+            min_stock = await conn.fetchval(
+                "SELECT MIN(stock) FROM products WHERE product_id = ANY($1::uuid[])", product_ids
+            )
+            sold = await conn.fetchval(
+                "SELECT COALESCE(SUM(quantity), 0) FROM order_items WHERE product_id = ANY($1::uuid[])", product_ids
+            )
+
+        succeeded = sum(results)
+        # Покупателей у товара i: buyers // products, первым buyers % products — на одного больше
+        expected = sum(
+            min(args.buyers // args.products + (1 if i < args.buyers % args.products else 0), args.stock)
+            for i in range(args.products)
+        )
+        total_stock = args.stock * args.products
+        latencies.sort()
+        print(f"Покупателей: {args.buyers}, товаров: {args.products}, остаток каждого: {args.stock}, "
+              f"параллельно: {args.concurrency}")
+        print(f"Успешных заказов: {succeeded}, отказов: {args.buyers - succeeded}")
+        print(f"Время: {elapsed:.2f} с, пропускная способность: {args.buyers / elapsed:.1f} попыток/с")
+        print(f"Задержка p50: {latencies[len(latencies) // 2] * 1000:.1f} мс, "
+              f"p99: {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f} мс")
+        print(f"Продано: {sold}, итоговый остаток: {final_stock}")
+
+        oversold = min_stock < 0 or sold != total_stock - final_stock or succeeded != expected
+        print("Перепродаж нет." if not oversold else "ОШИБКА: остатки не сходятся!")
+        return 1 if oversold else 0
+    finally:
+        await cleanup(pool, category_id, product_ids, user_ids)
+        await pool.close()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
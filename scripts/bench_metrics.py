@@ -0,0 +1,82 @@
+# Стоимость сбора метрик: отдельные операции и накладные расходы на один HTTP-запрос
+#
+# Запуск:
+#   python scripts/bench_metrics.py [--requests 5000] [--repeat 200000]
+#
+# Запросы выполняются через тестовый клиент Quart к минимальному приложению
+# с учётом метрик и без него, так что разница — это цена middleware.
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+import timeit
+
+from quart import Quart
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.metrics import Counter, Histogram, init_metrics, render_metrics
+
+
+def bench_primitives(repeat: int):
+    histogram = Histogram("bench_duration_seconds", "Бенчмарк.", ("route",))
+    counter = Counter("bench_total", "Бенчмарк.", ("route", "status"))
+
+    observe_ns = min(timeit.repeat(lambda: histogram.observe(0.0042, "/product"), number=repeat, repeat=3)) / repeat * 1e9
+    inc_ns = min(timeit.repeat(lambda: counter.inc("/product", "200"), number=repeat, repeat=3)) / repeat * 1e9
+    print(f"Histogram.observe: {observe_ns:.0f} нс")
+    print(f"Counter.inc:       {inc_ns:.0f} нс")
+
+    # Отдача /metrics с заметным числом рядов (маршруты x запросы к БД)
+    for i in range(200):
+        histogram.observe(0.01, f"/route/{i}")
+    started = time.perf_counter()
+    body = render_metrics()
+    print(f"render_metrics: {(time.perf_counter() - started) * 1000:.2f} мс, {len(body) // 1024} КиБ")
+
+
+def build_app(with_metrics: bool) -> Quart:
+    app = Quart(__name__)
+    if with_metrics:
+        init_metrics(app)
+
+    @app.route("/ping/<int:item_id>")
+    async def ping(item_id):
+        return "ok"
+
+    return app
+
+
+async def time_requests(app: Quart, count: int) -> float:
+    client = app.test_client()
+    for _ in range(100):  # прогрев
+        await client.get("/ping/1")
+    started = time.perf_counter()
+    for i in range(count):
+        await client.get(f"/ping/{i}")
+    return (time.perf_counter() - started) / count
+
+
+async def bench_requests(count: int):
+    baseline = await time_requests(build_app(False), count)
+    instrumented = await time_requests(build_app(True), count)
+    print(f"Запрос без метрик: {baseline * 1e6:.1f} мкс")
+    print(f"Запрос с метриками: {instrumented * 1e6:.1f} мкс")
+    print(f"Накладные расходы: {(instrumented - baseline) * 1e6:.1f} мкс на запрос "
+          f"({(instrumented / baseline - 1) * 100:.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк сбора метрик")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=200_000)
+    args = parser.parse_args()
+
+    bench_primitives(args.repeat)
+    asyncio.run(bench_requests(args.requests))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# Массовая загрузка и обновление товаров из CSV (цены и остатки поставщиков)
+#
+# Запуск:
+#   python scripts/import_products.py prices.csv [--errors errors.csv] [--no-cache]
+#
+# Формат файла и правила слияния — в app/product_import.py. Строки с ошибками
+# не загружаются и выводятся в отчёт с номером записи CSV после заголовка
+# (--errors — записать их в CSV).
+# После загрузки из кеша удаляются карточки обновлённых товаров
+# (--no-cache — пропустить, если Redis недоступен).
+
+import argparse
+import asyncio
+import csv
+import os
+import sys
+import time
+
+import asyncpg
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.product_import import import_products_csv
+
+load_dotenv()
+
+
+async def invalidate(report: dict):
+    from app.redis_client import init_redis
+    from app.cache_utils import invalidate_cache, invalidate_cache_keys
+
+    await init_redis()
+    await invalidate_cache_keys(f"cache:product:{product_id}" for product_id in report['updated_ids'])
+    if report['inserted'] or report['updated']:
+        await invalidate_cache("cache:manufacturers")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Импорт товаров из CSV")
+    parser.add_argument("path", help="CSV-файл с заголовком")
+    parser.add_argument("--errors", help="записать ошибочные строки в этот CSV")
+    parser.add_argument("--error-limit", type=int, default=100_000, help="сколько ошибочных строк выгрузить")
+    parser.add_argument("--no-cache", action="store_true", help="не сбрасывать кеш товаров")
+    args = parser.parse_args()
+
+    pool = await asyncpg.create_pool(
+        database=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        host=os.getenv("DB_HOST"),
+        port=int(os.getenv("DB_PORT", 5432)),
+        min_size=1,
+        max_size=1,
+    )
+    try:
+        started = time.perf_counter()
+        with open(args.path, "rb") as source:
+            try:
+                report = await import_products_csv(pool, source, error_limit=args.error_limit)
+            except ValueError as e:
+                print(f"Файл не загружен: {e}")
+                return 1
+    finally:
+        await pool.close()
+
+    print(f"Строк: {report['total']}, добавлено: {report['inserted']}, обновлено: {report['updated']}, "
+          f"без изменений: {report['unchanged']}, с ошибками: {report['error_count']} "
+          f"({time.perf_counter() - started:.1f} с)")
+    for row in report['errors'][:20]:
+        print(f"  запись {row['record']}: {row['error']}")
+    if args.errors and report['errors']:
+        with open(args.errors, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=("record", "product_id", "error"))
+            writer.writeheader()
+            writer.writerows(report['errors'])
+        print(f"Ошибки записаны в {args.errors}")
+
+    if not args.no_cache:
+        try:
+            await invalidate(report)
+        except Exception as e:
+            print(f"Не удалось сбросить кеш товаров: {e}")
+    return 0 if report['error_count'] == 0 else 2
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
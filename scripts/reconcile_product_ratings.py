@@ -0,0 +1,39 @@
+# Сверка агрегатов оценок товаров (product_ratings) с таблицей reviews
+#
+# Запуск:
+#   python scripts/reconcile_product_ratings.py
+#
+# Пересчитывает агрегаты всех товаров и исправляет расхождения (например,
+# после загрузки отзывов с отключёнными триггерами). При первом запуске
+# после обновления схемы заполняет таблицу. Подходит для запуска по cron.
+
+import asyncio
+import os
+import sys
+import time
+
+import asyncpg
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+async def main():
+    conn = await asyncpg.connect(
+        database=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        host=os.getenv("DB_HOST"),
+        port=int(os.getenv("DB_PORT", 5432)),
+    )
+    try:
+        started = time.perf_counter()
+        fixed = await conn.fetchval("SELECT reconcile_product_ratings()")
+        print(f"Исправлено агрегатов: {fixed}, время: {time.perf_counter() - started:.2f} с")
+        return 0
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -1,12 +1,39 @@
 # Генерация данных
+#
+# Запуск:
+#   python scripts/seed_data.py [--scale 1.0] [--seed 42] [--workers 8] [--truncate]
+#   python scripts/seed_data.py --rebuild-only      # восстановить индексы после прерванной загрузки
+#
+# Строки не накапливаются в памяти: генераторы отдают их прямо в COPY ... FROM STDIN
+# порциями по --chunk-size строк. Порции распределяются между процессами,
+# каждая порция — отдельная транзакция.
+#
+# На время загрузки у заполняемых таблиц снимаются внешние ключи, первичные ключи,
+# уникальные ограничения и индексы, отключаются пользовательские триггеры.
+# Их определения сохраняются в scripts/.seed_schema.json и восстанавливаются
+# после загрузки (параллельно, по таблицам). Если загрузка прервалась,
+# запустите скрипт с --rebuild-only.
+#
+# Данные детерминированы: при одинаковых --seed, --scale и --end-date получаются
+# одинаковые строки с одинаковыми идентификаторами независимо от --workers.
+# Идентификаторы вычисляются по номеру строки, поэтому процессам не нужно
+# передавать друг другу списки ключей.
 
-import psycopg2
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
 import uuid
+from datetime import datetime, timedelta
+
+import psycopg2
+from dotenv import load_dotenv
 from faker import Faker
-import random
 from tqdm import tqdm
-from dotenv import load_dotenv
-import os
 
 # Загружаем переменные из .env
 load_dotenv()
@@ -19,20 +46,7 @@ DB_USER = os.getenv('DB_USER')
 DB_PASSWORD = os.getenv('DB_PASSWORD')
 SECRET_KEY = os.getenv('SECRET_KEY')
 
-fake = Faker()
-
-# Настройки подключения к базе
-conn = psycopg2.connect(
-    dbname=DB_NAME,
-    user=DB_USER,
-    password=DB_PASSWORD,
-    host=DB_HOST,
-    port=DB_PORT
-)
-conn.autocommit = True
-cur = conn.cursor()
-
-# Число записей
+# Число записей при --scale 1
 NUM_USERS = 500_000
 NUM_CATEGORIES = 50
 NUM_PRODUCTS = 500_000
@@ -41,7 +55,412 @@ NUM_REVIEWS = 500_000
 NUM_SUPPORT_SESSIONS = 100_000
 NUM_MESSAGES_PER_SESSION = 5
 
-def save_secret_key():
+# Статусы заказов — те же, что в app/db.py (ORDER_STATUSES)
+ORDER_STATUSES = ('Pending', 'Processing', 'Shipped', 'Delivered', 'Cancelled')
+
+# Размер словарей Faker: тексты выбираются из заранее сгенерированных,
+# вызывать Faker на каждую строку слишком медленно
+FAKER_POOL_SIZE = 2000
+
+# Заполняемые таблицы (с них снимаются индексы и ограничения)
+SEED_TABLES = (
+    'users', 'user_roles', 'categories', 'products', 'orders', 'order_items',
+    'reviews', 'support_sessions', 'support_messages',
+)
+# Таблицы, которые пересчитываются из заполняемых или очищаются вместе с ними
+DERIVED_TABLES = ('order_history', 'cart', 'sales_daily_product', 'sales_daily_category', 'sales_rollup_delta', 'product_ratings')
+
+SCHEMA_STATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.seed_schema.json')
+
+
+def connect():
+    return psycopg2.connect(
+        dbname=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        host=DB_HOST,
+        port=DB_PORT
+    )
+
+
+# ---------------------------------------------------------------------------
+# Детерминированные идентификаторы и случайные числа
+# ---------------------------------------------------------------------------
+
+_id_bases = {}
+
+
+def row_id(seed: int, table: str, index: int) -> str:
+    """
+    UUID строки с номером index: старшие 64 бита зависят от seed и таблицы,
+    младшие — номер строки.
+    """
+    base = _id_bases.get((seed, table))
+    if base is None:
+        digest = hashlib.sha256(f"{seed}:{table}".encode()).digest()
+        base = _id_bases[(seed, table)] = int.from_bytes(digest[:8], 'big') << 64
+    return str(uuid.UUID(int=base | index))
+
+
+def chunk_rng(seed: int, table: str, start: int) -> random.Random:
+    """
+    Генератор случайных чисел порции: зависит только от seed, таблицы и начала порции,
+    а не от того, какой процесс её обрабатывает.
+    """
+    return random.Random(f"{seed}:{table}:{start}")
+
+
+def money(cents: int) -> str:
+    return f"{cents // 100}.{cents % 100:02d}"
+
+
+# ---------------------------------------------------------------------------
+# COPY из генератора
+# ---------------------------------------------------------------------------
+
+def copy_field(value) -> str:
+    """
+    Значение в текстовом формате COPY.
+    """
+    if value is None:
+        return '\\N'
+    text = str(value)
+    if '\\' in text or '\t' in text or '\n' in text or '\r' in text:
+        text = text.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+    return text
+
+
+class CopyStream:
+    """
+    Файлоподобный объект для cursor.copy_expert: строки генерируются по мере того,
+    как psycopg2 читает очередной блок, поэтому в памяти не больше одного блока.
+    """
+
+    def __init__(self, rows):
+        self._lines = ('\t'.join(map(copy_field, row)) + '\n' for row in rows)
+        self.rows = 0
+
+    def read(self, size: int = -1) -> str:
+        chunk, total = [], 0
+        for line in self._lines:
+            chunk.append(line)
+            total += len(line)
+            self.rows += 1
+            if 0 <= size <= total:
+                break
+        return ''.join(chunk)
+
+
+def copy_rows(cur, table: str, columns, rows) -> int:
+    stream = CopyStream(rows)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", stream, size=64 * 1024)
+    return stream.rows
+
+
+# ---------------------------------------------------------------------------
+# Рабочие процессы
+# ---------------------------------------------------------------------------
+
+# Состояние рабочего процесса (задаётся в init_worker)
+_worker = {}
+
+
+def init_worker(settings: dict):
+    conn = connect()
+    with conn.cursor() as cur:
+        # Потеря последних транзакций при сбое сервера для генерации данных не страшна
+        cur.execute("SET synchronous_commit = off")
+        cur.execute("SET maintenance_work_mem = %s", (settings['maintenance_work_mem'],))
+    conn.commit()
+    _worker.clear()
+    _worker.update(settings, conn=conn, texts=None)
+
+
+def faker_texts() -> dict:
+    """
+    Словари текстов Faker, одинаковые во всех процессах при одном seed.
+    """
+    if _worker['texts'] is None:
+        Faker.seed(_worker['seed'])
+        fake = Faker()
+        _worker['texts'] = {
+            'word': [fake.word() for _ in range(FAKER_POOL_SIZE)],
+            'username': [fake.user_name() for _ in range(FAKER_POOL_SIZE)],
+            'password': [fake.password() for _ in range(FAKER_POOL_SIZE)],
+            'domain': [fake.free_email_domain() for _ in range(50)],
+            'catch_phrase': [fake.catch_phrase() for _ in range(FAKER_POOL_SIZE)],
+            'description': [fake.text(max_nb_chars=200) for _ in range(FAKER_POOL_SIZE)],
+            'company': [fake.company() for _ in range(FAKER_POOL_SIZE)],
+            'sentence': [fake.sentence() for _ in range(FAKER_POOL_SIZE)],
+        }
+    return _worker['texts']
+
+
+def random_time(rng: random.Random, start: datetime, end: datetime) -> datetime:
+    return start + timedelta(seconds=rng.randrange(max(int((end - start).total_seconds()), 1)))
+
+
+def load_categories(cur, start: int, stop: int):
+    seed, texts = _worker['seed'], faker_texts()
+    rng = chunk_rng(seed, 'categories', start)
+    rows = ((row_id(seed, 'categories', i), rng.choice(texts['word'])) for i in range(start, stop))
+    copy_rows(cur, 'categories', ('category_id', 'name'), rows)
+
+
+def load_users(cur, start: int, stop: int):
+    seed, texts = _worker['seed'], faker_texts()
+    rng = chunk_rng(seed, 'users', start)
+
+    def users():
+        for i in range(start, stop):
+            username = rng.choice(texts['username'])
+            # Номер строки в адресе гарантирует уникальность email
+            yield (row_id(seed, 'users', i), username, rng.choice(texts['password']),
+                   f"{username}{i}@{rng.choice(texts['domain'])}")
+
+    copy_rows(cur, 'users', ('user_id', 'username', 'hashed_password', 'email'), users())
+
+    roles_rng = chunk_rng(seed, 'user_roles', start)
+    role_ids = _worker['role_ids']
+    rows = ((row_id(seed, 'users', i), roles_rng.choice(role_ids)) for i in range(start, stop))
+    copy_rows(cur, 'user_roles', ('user_id', 'role_id'), rows)
+
+
+def load_products(cur, start: int, stop: int):
+    seed, texts, counts = _worker['seed'], faker_texts(), _worker['counts']
+    rng = chunk_rng(seed, 'products', start)
+    rows = (
+        (
+            row_id(seed, 'products', i),
+            f"{rng.choice(texts['catch_phrase'])} {rng.choice(texts['word'])}",
+            rng.choice(texts['description']),
+            row_id(seed, 'categories', rng.randrange(counts['categories'])),
+            money(rng.randint(500, 50000)),
+            rng.randint(10, 1000),
+            rng.choice(texts['company']),
+        )
+        for i in range(start, stop)
+    )
+    copy_rows(cur, 'products', ('product_id', 'name', 'description', 'category_id', 'price', 'stock', 'manufacturer'), rows)
+
+
+def load_orders(cur, start: int, stop: int):
+    seed, counts = _worker['seed'], _worker['counts']
+    period_start, period_end = _worker['decade_start'], _worker['end']
+    rng = chunk_rng(seed, 'orders', start)
+    # Позиции порции копятся, пока генерируются заказы (сумма заказа считается по ним),
+    # и копируются следом — не больше 5 позиций на заказ порции
+    items = []
+
+    def orders():
+        for i in range(start, stop):
+            order_id = row_id(seed, 'orders', i)
+            total = 0
+            for product_index in rng.sample(range(counts['products']), rng.randint(1, 5)):
+                quantity, price = rng.randint(1, 10), rng.randint(500, 50000)
+                total += quantity * price
+                items.append((order_id, row_id(seed, 'products', product_index), quantity, money(price)))
+            yield (
+                order_id,
+                row_id(seed, 'users', rng.randrange(counts['users'])),
+                random_time(rng, period_start, period_end),
+                rng.choice(ORDER_STATUSES),
+                money(total),
+            )
+
+    copy_rows(cur, 'orders', ('order_id', 'user_id', 'order_date', 'status', 'total_cost'), orders())
+    copy_rows(cur, 'order_items', ('order_id', 'product_id', 'quantity', 'price'), items)
+
+
+def load_reviews(cur, start: int, stop: int):
+    seed, texts, counts = _worker['seed'], faker_texts(), _worker['counts']
+    period_start, period_end = _worker['year_start'], _worker['end']
+    rng = chunk_rng(seed, 'reviews', start)
+    rows = (
+        (
+            row_id(seed, 'reviews', i),
+            row_id(seed, 'products', rng.randrange(counts['products'])),
+            row_id(seed, 'users', rng.randrange(counts['users'])),
+            rng.randint(1, 5),
+            rng.choice(texts['sentence']),
+            random_time(rng, period_start, period_end),
+        )
+        for i in range(start, stop)
+    )
+    copy_rows(cur, 'reviews', ('review_id', 'product_id', 'user_id', 'rating', 'comment', 'review_date'), rows)
+
+
+def load_support_sessions(cur, start: int, stop: int):
+    seed, texts, counts = _worker['seed'], faker_texts(), _worker['counts']
+    period_start, period_end = _worker['year_start'], _worker['end']
+    rng = chunk_rng(seed, 'support_sessions', start)
+
+    def sessions():
+        for i in range(start, stop):
+            start_time = random_time(rng, period_start, period_end)
+            end_time = None if rng.random() < 0.3 else random_time(rng, start_time, period_end)
+            yield (
+                row_id(seed, 'support_sessions', i),
+                row_id(seed, 'users', rng.randrange(counts['users'])),
+                start_time,
+                end_time,
+                rng.choice(('open', 'closed')),
+            )
+
+    copy_rows(cur, 'support_sessions', ('session_id', 'user_id', 'start_time', 'end_time', 'status'), sessions())
+
+    messages_rng = chunk_rng(seed, 'support_messages', start)
+    rows = (
+        (
+            row_id(seed, 'support_messages', i * NUM_MESSAGES_PER_SESSION + n),
+            row_id(seed, 'support_sessions', i),
+            messages_rng.choice(('user', 'support')),
+            messages_rng.choice(texts['sentence']),
+            random_time(messages_rng, period_start, period_end),
+        )
+        for i in range(start, stop)
+        for n in range(NUM_MESSAGES_PER_SESSION)
+    )
+    copy_rows(cur, 'support_messages', ('message_id', 'session_id', 'sender', 'message', 'sent_at'), rows)
+
+
+# Группа -> функция загрузки порции (число строк группы — в counts)
+LOADERS = {
+    'categories': load_categories,
+    'users': load_users,
+    'products': load_products,
+    'orders': load_orders,
+    'reviews': load_reviews,
+    'support_sessions': load_support_sessions,
+}
+
+
+def run_chunk(task) -> tuple:
+    """
+    Загружает порцию [start, stop) группы в отдельной транзакции.
+    """
+    group, start, stop = task
+    conn = _worker['conn']
+    try:
+        with conn.cursor() as cur:
+            LOADERS[group](cur, start, stop)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return group, stop - start
+
+
+def run_statement(sql: str) -> str:
+    conn = _worker['conn']
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return sql
+
+
+# ---------------------------------------------------------------------------
+# Индексы, ограничения и триггеры
+# ---------------------------------------------------------------------------
+
+def collect_schema(cur) -> dict:
+    """
+    Определения ограничений и индексов заполняемых таблиц (и внешних ключей,
+    ссылающихся на них), чтобы снять их на время загрузки и восстановить после.
+    """
+    tables = list(SEED_TABLES)
+    cur.execute("""
+        SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE contype = 'f'
+          AND (conrelid::regclass::text = ANY(%s) OR confrelid::regclass::text = ANY(%s))
+        ORDER BY 1, 2
+    """, (tables, tables))
+    foreign_keys = cur.fetchall()
+
+    cur.execute("""
+        SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE contype IN ('p', 'u') AND conrelid::regclass::text = ANY(%s)
+        ORDER BY 1, 2
+    """, (tables,))
+    keys = cur.fetchall()
+
+    # Индексы, не принадлежащие ограничениям (индексы PRIMARY KEY/UNIQUE пересоздаются с ними)
+    cur.execute("""
+        SELECT i.indrelid::regclass::text, i.indexrelid::regclass::text, pg_get_indexdef(i.indexrelid)
+        FROM pg_index i
+        WHERE i.indrelid::regclass::text = ANY(%s)
+          AND NOT EXISTS (
+              SELECT 1 FROM pg_constraint c
+              WHERE c.conindid = i.indexrelid AND c.conrelid = i.indrelid AND c.contype IN ('p', 'u', 'x')
+          )
+        ORDER BY 1, 2
+    """, (tables,))
+    indexes = cur.fetchall()
+
+    return {'foreign_keys': foreign_keys, 'keys': keys, 'indexes': indexes}
+
+
+def drop_schema(cur, schema: dict):
+    for table in SEED_TABLES:
+        cur.execute(f"ALTER TABLE {table} DISABLE TRIGGER USER")
+    for table, name, _ in schema['foreign_keys']:
+        cur.execute(f'ALTER TABLE {table} DROP CONSTRAINT "{name}"')
+    for table, name, _ in schema['keys']:
+        cur.execute(f'ALTER TABLE {table} DROP CONSTRAINT "{name}"')
+    for _, name, _ in schema['indexes']:
+        cur.execute(f"DROP INDEX {name}")
+
+
+def rebuild_schema(pool, conn, schema: dict):
+    """
+    Восстанавливает ключи, затем индексы, затем внешние ключи. Внутри каждого этапа
+    операторы разных таблиц выполняются параллельно в рабочих процессах.
+    """
+    stages = (
+        ('Первичные и уникальные ключи', [f'ALTER TABLE {t} ADD CONSTRAINT "{n}" {d}' for t, n, d in schema['keys']]),
+        ('Индексы', [d for _, _, d in schema['indexes']]),
+        ('Внешние ключи', [f'ALTER TABLE {t} ADD CONSTRAINT "{n}" {d}' for t, n, d in schema['foreign_keys']]),
+    )
+    for title, statements in stages:
+        started = time.perf_counter()
+        for _ in tqdm(pool.imap_unordered(run_statement, statements), total=len(statements), desc=title):
+            pass
+        print(f"{title}: {time.perf_counter() - started:.1f} с")
+
+    with conn.cursor() as cur:
+        for table in SEED_TABLES:
+            cur.execute(f"ALTER TABLE {table} ENABLE TRIGGER USER")
+
+
+def refresh_derived(cur):
+    """
+    Триггеры при загрузке были отключены: история заказов, агрегаты продаж
+    и оценок строятся одним проходом.
+    """
+    cur.execute("""
+        INSERT INTO order_history (order_id, status, change_date)
+        SELECT order_id, status, NOW() FROM orders
+    """)
+    cur.execute("SELECT MIN(order_date)::date, MAX(order_date)::date FROM orders")
+    first, last = cur.fetchone()
+    if first is not None:
+        cur.execute("SELECT rebuild_sales_rollups(%s, %s)", (first, last))
+    cur.execute("SELECT reconcile_product_ratings()")
+    for table in SEED_TABLES + DERIVED_TABLES:
+        cur.execute(f"ANALYZE {table}")
+
+
+# ---------------------------------------------------------------------------
+# Подготовка
+# ---------------------------------------------------------------------------
+
+def save_secret_key(cur):
     # Для примера сохраним SECRET_KEY в таблицу настроек приложения
     cur.execute("""
         CREATE TABLE IF NOT EXISTS app_settings (
@@ -54,165 +473,125 @@ def save_secret_key():
         ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
     """, (SECRET_KEY,))
 
-def create_roles():
-    # Сначала создаем уникальное ограничение, если его нет
-    cur.execute("""
-        ALTER TABLE roles ADD CONSTRAINT roles_name_unique UNIQUE (name)
-        """)
-    # Затем выполняем вставку с ON CONFLICT
+
+def create_roles(cur) -> list:
     cur.execute("""
-        INSERT INTO roles (name) VALUES ('User'), ('Admin') 
-        ON CONFLICT (name) DO NOTHING
-        """)
-
-def create_categories():
-    categories = [(str(uuid.uuid4()), fake.word()) for _ in range(NUM_CATEGORIES)]
-    cur.executemany("""
-        INSERT INTO categories (category_id, name) 
-        VALUES (%s, %s) 
-        ON CONFLICT (category_id) DO NOTHING
-    """, categories)
-    return [c[0] for c in categories]
-
-def create_users():
-    users = [(str(uuid.uuid4()), fake.user_name(), fake.password(), fake.unique.email()) for _ in range(NUM_USERS)]
-    cur.executemany("""
-        INSERT INTO users (user_id, username, hashed_password, email)
-        VALUES (%s, %s, %s, %s)
-        ON CONFLICT (email) DO NOTHING
-    """, users)
-    return [u[0] for u in users]
-
-def assign_user_roles(user_ids):
-    roles = [1, 2]
-    user_roles = [(uid, random.choice(roles)) for uid in user_ids]
-    cur.executemany("""
-        INSERT INTO user_roles (user_id, role_id) 
-        VALUES (%s, %s)
-        ON CONFLICT (user_id, role_id) DO NOTHING
-    """, user_roles)
-
-def create_products(category_ids):
-    products = []
-    for _ in range(NUM_PRODUCTS):
-        products.append((
-            str(uuid.uuid4()),
-            fake.catch_phrase(),
-            fake.text(max_nb_chars=200),
-            random.choice(category_ids),
-            round(random.uniform(5.0, 500.0), 2),
-            random.randint(10, 1000),
-            fake.company()
-        ))
-    cur.executemany("""
-        INSERT INTO products (product_id, name, description, category_id, price, stock, manufacturer)
-        VALUES (%s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT (product_id) DO NOTHING
-    """, products)
-    return [p[0] for p in products]
-
-def create_orders(user_ids):
-    orders = []
-    for _ in range(NUM_ORDERS):
-        orders.append((
-            str(uuid.uuid4()),
-            random.choice(user_ids),
-            fake.date_time_this_decade(),
-            random.choice(['Pending', 'Completed', 'Cancelled']),
-            round(random.uniform(20.0, 2000.0), 2)
-        ))
-    cur.executemany("""
-        INSERT INTO orders (order_id, user_id, order_date, status, total_cost)
-        VALUES (%s, %s, %s, %s, %s)
-        ON CONFLICT (order_id) DO NOTHING
-    """, orders)
-    return [o[0] for o in orders]
-
-def create_order_items(order_ids, product_ids):
-    order_items = []
-    for order_id in tqdm(order_ids, desc="Inserting order_items"):
-        products_in_order = set()  # Множество для хранения уникальных product_id
-        for _ in range(random.randint(1, 5)):  # Случайное количество товаров в заказе
-            product_id = random.choice(product_ids)
-            while product_id in products_in_order:  # Проверяем, чтобы товар не повторялся
-                product_id = random.choice(product_ids)
-            products_in_order.add(product_id)  # Добавляем товар в заказ
-            quantity = random.randint(1, 10)
-            price = round(random.uniform(5.0, 500.0), 2)
-            order_items.append((order_id, product_id, quantity, price))
-    cur.executemany("""
-        INSERT INTO order_items (order_id, product_id, quantity, price)
-        VALUES (%s, %s, %s, %s)
-        ON CONFLICT (order_id, product_id) DO NOTHING
-    """, order_items)
-
-def create_reviews(user_ids, product_ids):
-    reviews = []
-    for _ in tqdm(range(NUM_REVIEWS), desc="Inserting reviews"):
-        reviews.append((
-            str(uuid.uuid4()),
-            random.choice(product_ids),
-            random.choice(user_ids),
-            random.randint(1, 5),
-            fake.sentence(),
-            fake.date_time_this_year()
-        ))
-    cur.executemany("""
-        INSERT INTO reviews (review_id, product_id, user_id, rating, comment, review_date)
-        VALUES (%s, %s, %s, %s, %s, %s)
-        ON CONFLICT (review_id) DO NOTHING
-    """, reviews)
-
-def create_support_sessions(user_ids):
-    sessions = []
-    for _ in range(NUM_SUPPORT_SESSIONS):
-        start_time = fake.date_time_this_year()
-        end_time = None if random.random() < 0.3 else fake.date_time_between(start_date=start_time)
-        sessions.append((
-            str(uuid.uuid4()),
-            random.choice(user_ids),
-            start_time,
-            end_time,
-            random.choice(['open', 'closed'])
-        ))
-    cur.executemany("""
-        INSERT INTO support_sessions (session_id, user_id, start_time, end_time, status)
-        VALUES (%s, %s, %s, %s, %s)
-        ON CONFLICT (session_id) DO NOTHING
-    """, sessions)
-    return [s[0] for s in sessions]
-
-def create_support_messages(session_ids):
-    messages = []
-    for session_id in tqdm(session_ids, desc="Inserting support_messages"):
-        for _ in range(NUM_MESSAGES_PER_SESSION):
-            messages.append((
-                str(uuid.uuid4()),
-                session_id,
-                random.choice(['user', 'support']),
-                fake.sentence(),
-                fake.date_time_this_year()
-            ))
-    cur.executemany("""
-        INSERT INTO support_messages (message_id, session_id, sender, message, sent_at)
-        VALUES (%s, %s, %s, %s, %s)
-        ON CONFLICT (message_id) DO NOTHING
-    """, messages)
+        INSERT INTO roles (name)
+        SELECT v.name FROM (VALUES ('User'), ('Admin')) AS v(name)
+        WHERE NOT EXISTS (SELECT 1 FROM roles r WHERE r.name = v.name)
+    """)
+    cur.execute("SELECT role_id FROM roles WHERE name IN ('User', 'Admin') ORDER BY role_id")
+    return [row[0] for row in cur.fetchall()]
+
+
+def prepare_tables(cur, truncate: bool) -> bool:
+    if truncate:
+        cur.execute(f"TRUNCATE {', '.join(SEED_TABLES + DERIVED_TABLES)} CASCADE")
+        return True
+    for table in SEED_TABLES:
+        cur.execute(f"SELECT EXISTS (SELECT 1 FROM {table})")
+        if cur.fetchone()[0]:
+            print(f"Таблица {table} не пуста. Запустите с --truncate, чтобы очистить заполняемые таблицы.")
+            return False
+    return True
+
+
+def build_tasks(counts: dict, chunk_size: int) -> list:
+    tasks = []
+    for group, count in counts.items():
+        for start in range(0, count, chunk_size):
+            tasks.append((group, start, min(start + chunk_size, count)))
+    # Сначала крупные группы, чтобы процессы не простаивали в конце загрузки
+    tasks.sort(key=lambda task: -counts[task[0]])
+    return tasks
+
+
+def parse_date(value: str) -> datetime:
+    return datetime.strptime(value, "%Y-%m-%d")
+
 
 def main():
-    print("Starting data generation...")
-    save_secret_key()
-    create_roles()
-    category_ids = create_categories()
-    user_ids = create_users()
-    assign_user_roles(user_ids)
-    product_ids = create_products(category_ids)
-    order_ids = create_orders(user_ids)
-    create_order_items(order_ids, product_ids)
-    create_reviews(user_ids, product_ids)
-    session_ids = create_support_sessions(user_ids)
-    create_support_messages(session_ids)
-    print("Data generation completed!")
+    parser = argparse.ArgumentParser(description="Генерация тестовых данных через COPY")
+    parser.add_argument("--scale", type=float, default=1.0, help="множитель числа строк (1.0 — 1 млн заказов)")
+    parser.add_argument("--seed", type=int, default=42, help="зерно генератора случайных чисел")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="число процессов")
+    parser.add_argument("--chunk-size", type=int, default=50_000, help="строк в одной порции COPY")
+    parser.add_argument("--end-date", type=parse_date, default=None,
+                        help="дата, до которой генерируются заказы и отзывы (YYYY-MM-DD, по умолчанию сегодня)")
+    parser.add_argument("--maintenance-work-mem", default="512MB", help="память на построение одного индекса")
+    parser.add_argument("--truncate", action="store_true", help="очистить заполняемые таблицы перед загрузкой")
+    parser.add_argument("--rebuild-only", action="store_true",
+                        help="только восстановить индексы и ограничения после прерванной загрузки")
+    args = parser.parse_args()
+
+    end = args.end_date or datetime.combine(datetime.now().date(), datetime.min.time())
+    counts = {
+        'categories': NUM_CATEGORIES,
+        'users': max(int(NUM_USERS * args.scale), 1),
+        'products': max(int(NUM_PRODUCTS * args.scale), 5),
+        'orders': int(NUM_ORDERS * args.scale),
+        'reviews': int(NUM_REVIEWS * args.scale),
+        'support_sessions': int(NUM_SUPPORT_SESSIONS * args.scale),
+    }
+
+    conn = connect()
+    conn.autocommit = True
+    cur = conn.cursor()
+    try:
+        if os.path.exists(SCHEMA_STATE_FILE) and not args.rebuild_only:
+            print(f"Найден {SCHEMA_STATE_FILE}: предыдущая загрузка не завершилась. Запустите с --rebuild-only.")
+            return 1
+
+        settings = {
+            'seed': args.seed,
+            'counts': counts,
+            'end': end,
+            'decade_start': datetime(end.year // 10 * 10, 1, 1),
+            'year_start': datetime(end.year, 1, 1),
+            'maintenance_work_mem': args.maintenance_work_mem,
+            'role_ids': [],
+        }
+
+        if args.rebuild_only:
+            if not os.path.exists(SCHEMA_STATE_FILE):
+                print("Сохранённых определений нет — восстанавливать нечего.")
+                return 0
+            with open(SCHEMA_STATE_FILE, encoding="utf-8") as f:
+                schema = json.load(f)
+            with multiprocessing.Pool(args.workers, init_worker, (settings,)) as pool:
+                rebuild_schema(pool, conn, schema)
+            os.remove(SCHEMA_STATE_FILE)
+            refresh_derived(cur)
+            return 0
+
+        print("Генерация данных...")
+        if not prepare_tables(cur, args.truncate):
+            return 1
+        save_secret_key(cur)
+        settings['role_ids'] = create_roles(cur)
+
+        schema = collect_schema(cur)
+        with open(SCHEMA_STATE_FILE, "w", encoding="utf-8") as f:
+            json.dump(schema, f, ensure_ascii=False, indent=2)
+        drop_schema(cur, schema)
+
+        started = time.perf_counter()
+        tasks = build_tasks(counts, args.chunk_size)
+        with multiprocessing.Pool(args.workers, init_worker, (settings,)) as pool:
+            with tqdm(total=sum(counts.values()), desc="Загрузка", unit=" строк", unit_scale=True) as progress:
+                for _, rows in pool.imap_unordered(run_chunk, tasks):
+                    progress.update(rows)
+            print(f"Загрузка: {time.perf_counter() - started:.1f} с")
+            rebuild_schema(pool, conn, schema)
+        os.remove(SCHEMA_STATE_FILE)
+
+        refresh_derived(cur)
+        print(f"Генерация данных завершена за {time.perf_counter() - started:.1f} с.")
+        return 0
+    finally:
+        cur.close()
+        conn.close()
+
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
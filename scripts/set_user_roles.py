@@ -0,0 +1,64 @@
+# Назначение ролей пользователю
+#
+# Запуск:
+#   python scripts/set_user_roles.py user@example.com Admin User
+#
+# Роли пользователя заменяются перечисленными. Версия ролей в Redis
+# увеличивается, поэтому уже выданные токены перечитают роли из БД
+# при следующем запросе (отозванные права перестают действовать сразу).
+
+import argparse
+import asyncio
+import os
+import sys
+
+import asyncpg
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.db import get_user_by_email, set_user_roles, get_user_roles
+from app.redis_client import init_redis
+from app.auth_token_utils import bump_roles_version
+
+load_dotenv()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Назначение ролей пользователю")
+    parser.add_argument("email", help="email пользователя")
+    parser.add_argument("roles", nargs="+", help="имена ролей (например, Admin User)")
+    args = parser.parse_args()
+
+    pool = await asyncpg.create_pool(
+        database=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        host=os.getenv("DB_HOST"),
+        port=int(os.getenv("DB_PORT", 5432)),
+        min_size=1,
+        max_size=1,
+    )
+    try:
+        user = await get_user_by_email(pool, args.email)
+        if not user:
+            print(f"Пользователь {args.email} не найден.")
+            return 1
+        user_id = str(user["user_id"])
+        try:
+            await set_user_roles(pool, user_id, args.roles)
+        except ValueError as e:
+            print(e)
+            return 1
+        roles = await get_user_roles(pool, user_id)
+    finally:
+        await pool.close()
+
+    await init_redis()
+    await bump_roles_version(user_id)
+    print(f"Роли {args.email}: {', '.join(sorted(roles))}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))